@@ -1 +1,2 @@
-from .note_density import *
\ No newline at end of file
+from .note_density import *
+from .features import *
\ No newline at end of file
@@ -0,0 +1,182 @@
+import json
+import os
+import traceback
+
+import numpy as np
+from scipy import signal
+
+from bsrating.analysis.note_density import note_densities
+from bsrating.utils.parallel import process_chunks
+
+# bump when the features change, so that every map is analysed again
+FEATURE_VERSION = 1
+
+DENSITY_RESOLUTION = 1 / 8
+KERNEL_WIDTHS = [ 8, 2 ]
+
+def feature_columns(kernel_widths : list = KERNEL_WIDTHS) -> list:
+    """The names of the feature columns, in order."""
+
+    columns = [
+        "rating", "n_notes", "n_left", "n_right", "n_bombs", "n_obstacles",
+        "length_beats", "length_seconds", "nps", "left_ratio", "mean_njs"
+    ]
+    for k in kernel_widths:
+        for hand in ("both", "left", "right"):
+            columns += [ f"density_{hand}_k{k:g}_{stat}" for stat in ("mean", "std", "max", "p90") ]
+            columns.append(f"peaks_{hand}_k{k:g}")
+
+    return columns
+
+def extract_features(data : list, rating : float = np.nan, kernel_widths : list = KERNEL_WIDTHS) -> dict:
+    """Compute the features of a map: element counts, length, hand balance, and density
+    statistics and peak counts (as in `map_analysis.py`) for every kernel width.
+
+    Args:
+        data (list): The elements of the map, in processed form.
+        rating (float, optional): The rating of the map. Defaults to NaN.
+        kernel_widths (list, optional): The widths of the density kernels, in beats.
+
+    Returns:
+        dict: The value of every column in `feature_columns`.
+    """
+    types = np.fromiter((m["type"] for m in data), dtype=np.int64, count=len(data))
+    times = np.fromiter((m.get("time", np.nan) for m in data), dtype=np.float64, count=len(data))
+    beats = np.fromiter((m["beat"] for m in data), dtype=np.float64, count=len(data))
+    njs = np.fromiter((m.get("njs", np.nan) for m in data), dtype=np.float64, count=len(data))
+
+    n_left = int(np.count_nonzero(types == 0))
+    n_right = int(np.count_nonzero(types == 1))
+    n_notes = n_left + n_right
+    length_seconds = float(np.nanmax(times)) if np.any(~np.isnan(times)) else 0.0
+
+    features = {
+        "rating" :          rating,
+        "n_notes" :         n_notes,
+        "n_left" :          n_left,
+        "n_right" :         n_right,
+        "n_bombs" :         int(np.count_nonzero(types == 2)),
+        "n_obstacles" :     int(np.count_nonzero(types == 3)),
+        "length_beats" :    float(beats.max()) if len(beats) > 0 else 0.0,
+        "length_seconds" :  length_seconds,
+        "nps" :             n_notes / length_seconds if length_seconds > 0 else np.nan,
+        "left_ratio" :      n_left / n_notes if n_notes > 0 else np.nan,
+        "mean_njs" :        float(np.nanmean(njs)) if np.any(~np.isnan(njs)) else np.nan,
+    }
+
+    _, densities, ds_left, ds_right = note_densities(data, DENSITY_RESOLUTION, kernel_widths)
+    for k, kernel_width in enumerate(kernel_widths):
+        for hand, density in (("both", densities[k]), ("left", ds_left[k]), ("right", ds_right[k])):
+            prefix = f"density_{hand}_k{kernel_width:g}"
+            features[f"{prefix}_mean"] = float(density.mean())
+            features[f"{prefix}_std"] = float(density.std())
+            features[f"{prefix}_max"] = float(density.max())
+            features[f"{prefix}_p90"] = float(np.percentile(density, 90))
+            features[f"peaks_{hand}_k{kernel_width:g}"] = len(signal.find_peaks_cwt(-density, 16, gap_thresh=16))
+
+    return features
+
+def analyse_chunk(chunk : list, kernel_widths : list = KERNEL_WIDTHS) -> list:
+    """Compute the features of a chunk of processed map files.
+
+    Args:
+        chunk (list): The paths to the processed map files.
+        kernel_widths (list, optional): The widths of the density kernels, in beats.
+
+    Returns:
+        list: One result per file, as a dict with the file path and either its "features"
+            or the "error" and "traceback".
+    """
+    results = []
+    for filepath in chunk:
+        result = { "path" : filepath }
+        try:
+            with open(filepath, encoding='utf-8') as fp:
+                map_data = json.load(fp)
+
+            result["features"] = extract_features(map_data["data"], map_data.get("rating", np.nan), kernel_widths)
+        except Exception as e:
+            result["error"] = repr(e)
+            result["traceback"] = traceback.format_exc()
+
+        results.append(result)
+
+    return results
+
+def load_feature_table(path : str) -> dict:
+    """Load a feature table written by `build_feature_table`.
+
+    Returns:
+        dict: The columns of the table, by name. "name" holds the file names of the maps and
+            "mtime" the modification times of the files when they were analysed.
+    """
+    with np.load(path) as table:
+        return { key : table[key] for key in table.files }
+
+def save_feature_table(path : str, table : dict):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as fp:
+        np.savez(fp, **table)
+
+    os.replace(tmp_path, path)
+
+def build_feature_table(folder : str, output_path : str, workers : int = 1, chunk_size : int = 16,
+                        force : bool = False, kernel_widths : list = KERNEL_WIDTHS, progress = None) -> tuple[dict, list]:
+    """Compute the features of every processed map in a dataset folder and write them as a
+    columnar table (one row per difficulty) in a .npz file.
+
+    If the table already exists, only the maps that are new or whose file changed since the last
+    run are analysed, and the rows of the maps that no longer exist are dropped.
+
+    Args:
+        folder (str): The dataset folder, with the files written by `load_maps.py`.
+        output_path (str): The path to the .npz table.
+        workers (int, optional): The number of worker processes. If it is 1 or less, everything
+        is analysed in the current process. Defaults to 1.
+        chunk_size (int, optional): The number of maps sent to a worker at once. Defaults to 16.
+        force (bool, optional): Analyse every map again. Defaults to False.
+        kernel_widths (list, optional): The widths of the density kernels, in beats.
+        progress (optional): A progress bar (e.g. tqdm) updated after each chunk. Defaults to None.
+
+    Returns:
+        (dict, list): The table, and the results of the maps analysed in this run (see `analyse_chunk`).
+    """
+    columns = feature_columns(kernel_widths)
+
+    with os.scandir(folder) as it:
+        files = { f.name : f.stat().st_mtime_ns for f in it if f.is_file() and f.name.endswith(".json") }
+
+    # rows of the previous table that are still valid
+    previous = {}
+    if os.path.isfile(output_path) and not force:
+        old = load_feature_table(output_path)
+        if int(old.get("version", -1)) == FEATURE_VERSION and all(c in old for c in columns):
+            for i, name in enumerate(old["name"]):
+                if files.get(name) == int(old["mtime"][i]):
+                    previous[name] = { c : old[c][i] for c in columns }
+
+    to_analyse = sorted(os.path.join(folder, name) for name in files if name not in previous)
+
+    if progress is not None:
+        progress.total = len(to_analyse)
+
+    results = process_chunks(analyse_chunk, to_analyse, kernel_widths, workers=workers, chunk_size=chunk_size, progress=progress,
+        on_error=lambda chunk, error, tb : [ { "path" : filepath, "error" : error, "traceback" : tb } for filepath in chunk ])
+
+    rows = dict(previous)
+    for result in results:
+        if "features" in result:
+            rows[os.path.basename(result["path"])] = result["features"]
+
+    names = sorted(rows.keys())
+    table = {
+        "version" : np.array(FEATURE_VERSION),
+        "name" :    np.array(names, dtype=str),
+        "mtime" :   np.array([ files[name] for name in names ], dtype=np.int64)
+    }
+    for c in columns:
+        table[c] = np.array([ rows[name][c] for name in names ], dtype=np.float64)
+
+    save_feature_table(output_path, table)
+
+    return table, results
@@ -1,31 +1,58 @@
 import numpy as np
 
-def note_density(map_data, resolution, kernel_width) -> tuple[np.array, np.array, np.array, np.array]:
-
-    max_ts = max(map_data, key=lambda m : m["beat"])["beat"]
+def _window_counts(ts : np.ndarray, beats : np.ndarray, half_width : float, max_ts : float) -> np.ndarray:
+    # number of notes whose window (lo, hi) strictly contains each timestamp
+    lo = np.maximum(beats - half_width, 0)
+    hi = np.minimum(beats + half_width, max_ts)
+
+    # empty windows never contain anything, and would break the subtraction below
+    valid = lo < hi
+    lo = np.sort(lo[valid])
+    hi = np.sort(hi[valid])
+
+    # #(lo < t) - #(hi <= t), every note with hi <= t also has lo < t
+    return (np.searchsorted(lo, ts, side='left') - np.searchsorted(hi, ts, side='right')).astype(np.float64)
+
+def note_densities(map_data, resolution, kernel_widths) -> tuple[np.array, np.array, np.array, np.array]:
+    """Compute the note density of a map for several kernel widths at once. Each note adds
+    1 to the timestamps strictly inside a window of `kernel_width` beats centered on it,
+    and the counts are normalized by the width of the kernel.
+
+    Args:
+        map_data (list): The elements of the map, in processed form.
+        resolution (float): The distance between timestamps, in beats.
+        kernel_widths (list): The widths of the kernels, in beats.
+
+    Returns:
+        (np.array, np.array, np.array, np.array): The timestamps, and the density for both hands,
+            left hand and right hand, each with shape `[len(kernel_widths), len(timestamps)]`.
+    """
+    beats = np.fromiter((m["beat"] for m in map_data), dtype=np.float64, count=len(map_data))
+    types = np.fromiter((m["type"] for m in map_data), dtype=np.int64, count=len(map_data))
+
+    max_ts = beats.max()
     els = int(max_ts / resolution) + 1
     map_ts = np.linspace(0.0, max_ts, els)
-    map_density = np.zeros(els)
-    map_density_left = np.zeros(els)
-    map_density_right = np.zeros(els)
 
-    for note in map_data:
+    # only notes add density, bombs and obstacles are skipped
+    note_beats = beats[(types == 0) | (types == 1)]
+    left_beats = beats[types == 0]
+    right_beats = beats[types == 1]
 
-        # if it is a note, accumulate density into the array, otherwise skip
-        if note["type"] not in [0, 1]:
-            continue
+    map_density = np.zeros((len(kernel_widths), els))
+    map_density_left = np.zeros((len(kernel_widths), els))
+    map_density_right = np.zeros((len(kernel_widths), els))
 
-        ts_range_min = np.maximum(note["beat"] - kernel_width / 2.0, 0)
-        ts_range_max = np.minimum(note["beat"] + kernel_width / 2.0, max_ts)
-        acc_mask = np.logical_and(map_ts > ts_range_min, map_ts < ts_range_max)
+    for k, kernel_width in enumerate(kernel_widths):
+        map_density[k] = _window_counts(map_ts, note_beats, kernel_width / 2.0, max_ts) / kernel_width * 2.0
+        map_density_left[k] = _window_counts(map_ts, left_beats, kernel_width / 2.0, max_ts) / kernel_width * 2.0
+        map_density_right[k] = _window_counts(map_ts, right_beats, kernel_width / 2.0, max_ts) / kernel_width * 2.0
 
-        map_density[acc_mask] += 1
+    return map_ts, map_density, map_density_left, map_density_right
 
-        if note["type"] == 0:
-            map_density_left[acc_mask] += 1
+def note_density(map_data, resolution, kernel_width) -> tuple[np.array, np.array, np.array, np.array]:
+    """Same as `note_densities`, for a single kernel width."""
 
-        if note["type"] == 1:
-            map_density_right[acc_mask] += 1
-        
-    return map_ts, map_density / kernel_width * 2.0, map_density_left / kernel_width * 2.0, map_density_right / kernel_width * 2.0
+    map_ts, map_density, map_density_left, map_density_right = note_densities(map_data, resolution, [kernel_width])
 
+    return map_ts, map_density[0], map_density_left[0], map_density_right[0]
@@ -1,16 +1,42 @@
 from pprint import pprint
 from packaging.version import Version
 
-from bsrating.game.element import Element
+import numpy as np
+
+from bsrating.game.columns import BPM_DTYPE, ELEMENT_DTYPE, NJS_DTYPE, as_record_array, records_from_json
+from bsrating.game.element import Element, ElementType
 from bsrating.game.events import BPMEvent
 from bsrating.game.notes import BombNote, ColorNote, Obstacle
+from bsrating.game.timing import TimingGrid
+from bsrating.utils.jsonstream import JSONStreamReader
+
+# the NJS the game uses for difficulties that don't set one
+DEFAULT_NJS = { "Easy" : 10.0, "Normal" : 10.0, "Hard" : 10.0, "Expert" : 12.0, "ExpertPlus" : 16.0 }
+
+class DifficultyInfo:
+    """Information about a single difficulty, as listed in the info file of the song."""
+
+    def __init__(self, diff : str, characteristic : str, fname : str, njs : float, njs_offset : float):
+        self.diff = diff
+        self.characteristic = characteristic
+        self.fname = fname
+        self.njs = njs
+        self.njs_offset = njs_offset
 
 class SongInfo(Element):
-    def __init__(self, version : Version, initial_bpm : float, njs : float, diff_fname : str):
+    """Information about a song. `difficulties` indexes every difficulty in the info file 
+    by characteristic and difficulty name, e.g. `difficulties["Standard"]["ExpertPlus"]`.
+    The `njs` and `diff_fname` attributes refer to the selected difficulty, if any 
+    (see `for_difficulty`).
+    """
+
+    def __init__(self, version : Version, initial_bpm : float, njs : float, diff_fname : str, 
+                 difficulties : dict = None):
         self.version = version
         self.initial_bpm = initial_bpm
         self.njs = njs
         self.diff_fname = diff_fname
+        self.difficulties = difficulties if difficulties is not None else {}
 
     @classmethod
     def get_parsing_table(cls):
@@ -18,6 +44,24 @@ class SongInfo(Element):
             Version("2.0.0"): SongInfo.from_json_2_0_0,
             Version("4.0.0"): SongInfo.from_json_4_0_0
         }
+
+    def for_difficulty(self, diff : str, characteristic : str = "Standard"):
+        """Get the song information with some difficulty selected, without reading 
+        the info file again.
+
+        Args:
+            diff (str): The name of the difficulty (e.g. ExpertPlus)
+            characteristic (str, optional): The characteristic. Defaults to "Standard".
+
+        Raises:
+            KeyError: If the difficulty doesn't exist.
+
+        Returns:
+            SongInfo: The information of the song for that difficulty.
+        """
+        diff_data = self.difficulties[characteristic][diff]
+
+        return SongInfo(self.version, self.initial_bpm, diff_data.njs, diff_data.fname, self.difficulties)
     
     @staticmethod
     def from_json_2_0_0(json : dict, **kwargs):
@@ -29,15 +73,27 @@ class SongInfo(Element):
             print(version)
         initial_bpm = json["_beatsPerMinute"]
 
-        # fetch all map data
-        bm_data = next(filter(lambda e : e["_beatmapCharacteristicName"] == "Standard", json["_difficultyBeatmapSets"]))["_difficultyBeatmaps"]
+        # index all difficulties by characteristic and name
+        difficulties = {
+            bm_set["_beatmapCharacteristicName"] : {
+                diff_data["_difficulty"] : DifficultyInfo(
+                    diff_data["_difficulty"],
+                    bm_set["_beatmapCharacteristicName"],
+                    diff_data["_beatmapFilename"],
+                    diff_data.get("_noteJumpMovementSpeed", DEFAULT_NJS.get(diff_data["_difficulty"], 10.0)),
+                    diff_data.get("_noteJumpStartBeatOffset", 0)
+                )
+                for diff_data in bm_set["_difficultyBeatmaps"]
+            }
+            for bm_set in json["_difficultyBeatmapSets"]
+        }
 
-        # get the path pointing to the difficulty file and its NJS    
-        diff_data = next(filter(lambda e : e["_difficulty"] == kwargs["diff"], bm_data))
-        diff_fname = diff_data["_beatmapFilename"]
-        diff_njs = diff_data["_noteJumpMovementSpeed"]
+        info = SongInfo(version, initial_bpm, None, None, difficulties)
+        if kwargs.get("diff") is None:
+            return info
 
-        return SongInfo(version, initial_bpm, diff_njs, diff_fname)
+        # select the difficulty file and its NJS
+        return info.for_difficulty(kwargs["diff"], kwargs.get("characteristic", "Standard"))
     
 
     @staticmethod
@@ -45,16 +101,43 @@ class SongInfo(Element):
         raise NotImplementedError("Not planned (4.0.0)")
 
 class BeatMap(Element):
+    """A difficulty of a map. The elements are stored in columnar form, as structured
+    arrays (see `bsrating.game.columns`) that the parsers fill directly. The `notes`, `bombs`,
+    `obstacles` and `bpm_events` properties give an object view over those arrays.
+
+    NJS changes can be given as a `NJS_DTYPE` array in `njs_events`. None of the supported
+    formats define them yet, but the timing grid already takes them into account.
+    """
 
     def __init__(self, version : Version, info : SongInfo, 
-                 bpm_events : list, notes : list, bombs : list, obstacles : list):
+                 bpm_events, notes, bombs, obstacles, njs_events = None):
 
         self.version = version
         self.info = info
-        self.bpm_events = bpm_events
-        self.notes = notes
-        self.bombs = bombs
-        self.obstacles = obstacles
+        self.bpm_array = as_record_array(bpm_events, BPM_DTYPE)
+        self.note_array = as_record_array(notes, ELEMENT_DTYPE)
+        self.bomb_array = as_record_array(bombs, ELEMENT_DTYPE)
+        self.obstacle_array = as_record_array(obstacles, ELEMENT_DTYPE)
+        self.njs_array = as_record_array([] if njs_events is None else njs_events, NJS_DTYPE)
+
+        self._timing = None
+        self._elements = None
+
+    @property
+    def bpm_events(self) -> list:
+        return [ BPMEvent.from_record(r) for r in self.bpm_array.tolist() ]
+
+    @property
+    def notes(self) -> list:
+        return [ ColorNote.from_record(r) for r in self.note_array.tolist() ]
+
+    @property
+    def bombs(self) -> list:
+        return [ BombNote.from_record(r) for r in self.bomb_array.tolist() ]
+
+    @property
+    def obstacles(self) -> list:
+        return [ Obstacle.from_record(r) for r in self.obstacle_array.tolist() ]
 
     @classmethod
     def get_parsing_table(cls):
@@ -70,27 +153,18 @@ class BeatMap(Element):
         version = Version(jv)
 
         # read bpm events
-        bpm_events = list(
-            map(lambda fev : BPMEvent.from_json(version, fev), 
-                filter(lambda ev : ev["_type"] == 100, json["_events"])
-                )
-            )
-
-        # read notes
-        notes = []
-        bombs = []
-
-        for note in json["_notes"]:
+        bpm_events = records_from_json(
+            BPMEvent, version, filter(lambda ev : ev["_type"] == 100, json["_events"]), BPM_DTYPE)
 
-            match note["_type"]:
-                case 0 | 1:
-                    notes.append(ColorNote.from_json(version, note))
-
-                case 3:
-                    notes.append(BombNote.from_json(version, note))
+        # read notes (types 0 and 1) and bombs (type 3)
+        notes = records_from_json(
+            ColorNote, version, filter(lambda n : n["_type"] in (0, 1), json["_notes"]), ELEMENT_DTYPE)
+        bombs = records_from_json(
+            BombNote, version, filter(lambda n : n["_type"] == 3, json["_notes"]), ELEMENT_DTYPE)
 
         # read obstacles
-        obstacles = list(map(lambda o : Obstacle.from_json(version, o), json["_obstacles"]))
+        obstacles = records_from_json(
+            Obstacle, version, json["_obstacles"], ELEMENT_DTYPE, len(json["_obstacles"]))
 
         return BeatMap(version, kwargs["info"], bpm_events, notes, bombs, obstacles)
 
@@ -100,22 +174,18 @@ class BeatMap(Element):
         version = Version(jv)
 
         # read bpm events
-        bpm_events = list(
-            map(lambda fev : BPMEvent.from_json(version, fev), json["bpmEvents"])
-        )
+        bpm_events = records_from_json(
+            BPMEvent, version, json["bpmEvents"], BPM_DTYPE, len(json["bpmEvents"]))
 
         # read notes
-        notes = list(
-            map(lambda fev : ColorNote.from_json(version, fev), json["colorNotes"])
-        )
-        bombs = list(
-            map(lambda fev : BombNote.from_json(version, fev), json["bombNotes"])
-        )
+        notes = records_from_json(
+            ColorNote, version, json["colorNotes"], ELEMENT_DTYPE, len(json["colorNotes"]))
+        bombs = records_from_json(
+            BombNote, version, json["bombNotes"], ELEMENT_DTYPE, len(json["bombNotes"]))
 
         # read obstacles
-        obstacles = list(
-            map(lambda fev : Obstacle.from_json(version, fev), json["obstacles"])
-        )
+        obstacles = records_from_json(
+            Obstacle, version, json["obstacles"], ELEMENT_DTYPE, len(json["obstacles"]))
 
         return BeatMap(version, kwargs["info"], bpm_events, notes, bombs, obstacles)
 
@@ -123,46 +193,130 @@ class BeatMap(Element):
     @staticmethod
     def from_json_4_0_0(json : dict, **kwargs):
         raise NotImplementedError("Not planned (4.0.0)")
+
+    @staticmethod
+    def from_stream(fp, info : SongInfo, version : Version = None):
+        """Parse a difficulty file incrementally. Only the elements used by the map are
+        decoded, one at a time; everything else (lightshow events, custom data...) is 
+        skipped without being materialized, so the memory usage doesn't depend on the 
+        size of the lightshow.
+
+        Args:
+            fp (TextIO): The difficulty file. It must be seekable if the version 
+            appears after the map elements.
+            info (SongInfo): The song information for this difficulty.
+            version (Version, optional): The version of the format. If None, it is read 
+            from the file. Defaults to None.
+
+        Returns:
+            BeatMap: The parsed difficulty.
+        """
+        records = { "notes": [], "bombs": [], "obstacles": [], "bpm_events": [] }
+
+        for key, value in JSONStreamReader(fp).items():
+            if key in ("_version", "version"):
+                version = version or Version(value.load())
+                continue
+
+            routes = _STREAM_ROUTES.get(key)
+            if routes is None:
+                continue
+
+            # the version usually comes first, otherwise look for it and start over
+            if version is None:
+                return BeatMap.from_stream(fp, info, BeatMap._find_stream_version(fp, key))
+
+            if BeatMap.resolve_parser(version) is BeatMap.from_json_4_0_0:
+                return BeatMap.from_json_4_0_0({}, info=info)
+
+            parsers = [ 
+                (records[target], cls.resolve_record_parser(version), pred) 
+                for cls, target, pred in routes 
+            ]
+
+            for item in value.iter():
+                for out, parse, pred in parsers:
+                    if pred is None or pred(item):
+                        out.append(parse(item))
+
+        return BeatMap(
+            version or Version("2.0.0"), info,
+            np.array(records["bpm_events"], dtype=BPM_DTYPE),
+            np.array(records["notes"], dtype=ELEMENT_DTYPE),
+            np.array(records["bombs"], dtype=ELEMENT_DTYPE),
+            np.array(records["obstacles"], dtype=ELEMENT_DTYPE))
+
+    @staticmethod
+    def _find_stream_version(fp, first_key : str) -> Version:
+        # scan the whole file for the version key without decoding anything else,
+        # and leave the file ready to be read again
+        fp.seek(0)
+        version = None
+        for key, value in JSONStreamReader(fp).items():
+            if key in ("_version", "version"):
+                version = Version(value.load())
+                break
+
+        fp.seek(0)
+        if version is None:
+            # v2 keys start with an underscore
+            version = Version("2.0.0" if first_key.startswith("_") else "3.0.0")
+
+        return version
+
+    @property
+    def timing(self) -> TimingGrid:
+        """The timing grid of this difficulty. It is built once and reused afterwards."""
+        if self._timing is None:
+            self._timing = TimingGrid(self.info.initial_bpm, self.bpm_array, self.info.njs, self.njs_array)
+
+        return self._timing
+
+    def element_array(self) -> np.ndarray:
+        """All the notes, obstacles and bombs of the map in a single structured array,
+        sorted by beat. The array is built once and reused afterwards.
+        """
+        if self._elements is None:
+            elements = np.concatenate([ self.note_array, self.obstacle_array, self.bomb_array ])
+            self._elements = elements[np.argsort(elements["beat"], kind="stable")]
+
+        return self._elements
     
     def to_dict(self):
 
-        # TODO: for every element, change the beat ("time" field) to real time in seconds.
-        # This will potentially improve gauging difficulty based on swing speed/eBPMs
+        elements = self.element_array()
 
-        bpm_evs = sorted(self.bpm_events, key = lambda ev : ev.beat)
+        # convert every beat to real time (seconds), along with the NJS at that point
+        times = self.timing.beat_to_time(elements["beat"])
+        njs = self.timing.njs_at(elements["beat"])
 
-        elements = list(sorted(self.notes + self.obstacles + self.bombs, key = lambda n : n.beat))
-        elements = list(map(lambda e : e.to_dict(), elements))
-        
-        # marks current beat, timestamp and index of the latest BPM event
-        element_idx = 0
-        bpm_ev_ts = 0
-        prev_ev_beat = 0
-        prev_ev_ts = 0
-        prev_ev_bpm = self.info.initial_bpm
-        
-        for i, bpm_ev in enumerate(bpm_evs):
-            bpm_section_beats = bpm_ev.beat - prev_ev_beat
-            prev_ev_ts = bpm_ev_ts
-            bpm_ev_ts += 60.0 * bpm_section_beats / prev_ev_bpm
- 
-            while element_idx < len(elements) and elements[element_idx]["beat"] < bpm_ev.beat:
-                section_diff_beats = elements[element_idx]["beat"] - prev_ev_beat
-                elements[element_idx]["time"] = prev_ev_ts + 60.0 * section_diff_beats / prev_ev_bpm
-
-                # Future work: include VNJS events
-                elements[element_idx]["njs"] = self.info.njs
-                element_idx += 1
-
-            prev_ev_beat = bpm_ev.beat
-            prev_ev_bpm = bpm_ev.bpm
-
-        while element_idx < len(elements):
-            section_diff_beats = elements[element_idx]["beat"] - prev_ev_beat
-            elements[element_idx]["time"] = prev_ev_ts + 60.0 * section_diff_beats / prev_ev_bpm
-
-            # Future work: include VNJS events
-            elements[element_idx]["njs"] = self.info.njs
-            element_idx += 1
+        dicts = []
+        for r, t, n in zip(elements.tolist(), times.tolist(), njs.tolist()):
+            d = _ELEMENT_CLASSES[r[0]].from_record(r).to_dict()
+            d["time"] = t
+            d["njs"] = n
+            dicts.append(d)
         
-        return elements
\ No newline at end of file
+        return dicts
+
+_ELEMENT_CLASSES = {
+    ElementType.ColorNoteRed:   ColorNote,
+    ElementType.ColorNoteBlue:  ColorNote,
+    ElementType.BombNote:       BombNote,
+    ElementType.Obstacle:       Obstacle,
+}
+
+# arrays read by `BeatMap.from_stream`: key -> [(element class, target, filter)]
+_STREAM_ROUTES = {
+    # v2
+    "_notes":       [ (ColorNote, "notes", lambda n : n["_type"] in (0, 1)),
+                      (BombNote, "bombs", lambda n : n["_type"] == 3) ],
+    "_obstacles":   [ (Obstacle, "obstacles", None) ],
+    "_events":      [ (BPMEvent, "bpm_events", lambda ev : ev["_type"] == 100) ],
+
+    # v3
+    "colorNotes":   [ (ColorNote, "notes", None) ],
+    "bombNotes":    [ (BombNote, "bombs", None) ],
+    "obstacles":    [ (Obstacle, "obstacles", None) ],
+    "bpmEvents":    [ (BPMEvent, "bpm_events", None) ],
+}
@@ -0,0 +1,51 @@
+import numpy as np
+
+# Columnar layout shared by every map element (color notes, bombs and obstacles).
+# Fields that don't apply to some element type (e.g. `duration` for notes) are zero.
+ELEMENT_DTYPE = np.dtype([
+    ("type",            np.uint8),
+    ("beat",            np.float64),
+    ("x",               np.float32),
+    ("y",               np.float32),
+    ("color",           np.int8),
+    ("cut_dir",         np.int8),
+    ("angle_offset",    np.float32),
+    ("duration",        np.float32),
+    ("width",           np.float32),
+    ("height",          np.float32),
+])
+
+BPM_DTYPE = np.dtype([
+    ("beat",            np.float64),
+    ("bpm",             np.float64),
+])
+
+NJS_DTYPE = np.dtype([
+    ("beat",            np.float64),
+    ("njs",             np.float64),
+])
+
+def records_from_json(cls, version, items, dtype : np.dtype, count : int = -1) -> np.ndarray:
+    """Parse a sequence of JSON elements straight into a structured array, without 
+    creating an intermediate object per element. The parsing function is resolved once 
+    and then applied to every element.
+
+    Args:
+        cls (type): The element class, which must implement `get_record_table`.
+        version (Version): The version of the map format.
+        items (iterable): The JSON representation of the elements.
+        dtype (np.dtype): The dtype of the array (`ELEMENT_DTYPE` or `BPM_DTYPE`).
+        count (int, optional): The number of items, if known. Defaults to -1.
+
+    Returns:
+        np.ndarray: A structured array with one row per element.
+    """
+    return np.fromiter(map(cls.resolve_record_parser(version), items), dtype=dtype, count=count)
+
+def as_record_array(elements, dtype : np.dtype) -> np.ndarray:
+    """Convert a list of element objects into a structured array. Arrays are returned as they are.
+    """
+    if isinstance(elements, np.ndarray):
+        return elements.astype(dtype, copy=False)
+
+    return np.fromiter(map(lambda e : e.to_record(), elements), dtype=dtype, count=len(elements))
@@ -1,6 +1,8 @@
 from packaging.version import Version
 
 from abc import ABC, abstractmethod
+from bisect import bisect_right
+from functools import lru_cache
 from enum import IntEnum
 
 class ElementType(IntEnum):
@@ -43,21 +45,55 @@ class Element:
     def get_enum_type(cls) -> ElementType:
         return cls.type
 
+    @classmethod
+    def get_record_table(cls) -> dict:
+        """Same as the parsing table, but the functions return a flat tuple following the
+        layout of `bsrating.game.columns.ELEMENT_DTYPE` instead of an object, so that parsers
+        can fill structured arrays directly. Only map elements implement this.
+        """
+        raise NotImplementedError(f"{cls.__name__} can't be stored in columnar form")
+
+    @classmethod
+    def resolve_parser(cls, version : Version):
+        """Get the function that parses this element for some version of the map format.
+        The lookup is memoized per (class, version), so it can be done once per file and 
+        the function applied to every element afterwards.
+        """
+        return _resolve(cls, version, "get_parsing_table")
+
+    @classmethod
+    def resolve_record_parser(cls, version : Version):
+        """Same as `resolve_parser`, but for the record table."""
+        return _resolve(cls, version, "get_record_table")
+
     @classmethod
     def from_json(cls, version : Version, json: dict, **kwargs):
 
-        table = cls.get_parsing_table()
-        versions = list(table.keys())
-        target = versions[0]
-        for vl in versions:
-            
-            if vl > version:
-                break
-            else:
-                target = vl
+        return cls.resolve_parser(version)(json, **kwargs)
 
-        return table[target](json, **kwargs)
+    @classmethod
+    def record_from_json(cls, version : Version, json: dict, **kwargs) -> tuple:
+
+        return cls.resolve_record_parser(version)(json, **kwargs)
+
+    @classmethod
+    def from_record(cls, record : tuple):
+        """Build the element object back from a row of its structured array."""
+        raise NotImplementedError(f"{cls.__name__} can't be stored in columnar form")
+
+    def to_record(self) -> tuple:
+        raise NotImplementedError(f"{type(self).__name__} can't be stored in columnar form")
             
     @abstractmethod
     def to_dict(self) -> dict:
         pass
+
+@lru_cache(maxsize=None)
+def _resolve(cls, version : Version, table_getter : str):
+    # pick the latest version in the table that is not newer than the requested one,
+    # or the oldest entry if every version in the table is newer
+    table = getattr(cls, table_getter)()
+    versions = sorted(table.keys())
+    idx = max(bisect_right(versions, version) - 1, 0)
+
+    return table[versions[idx]]
@@ -17,21 +17,43 @@ class BPMEvent(Element):
             Version("3.0.0"): BPMEvent.from_json_3_0_0
         }
     
-    @staticmethod
-    def from_json_2_5_0(json: dict, **kwargs):
+    @classmethod
+    def get_record_table(cls):
+        return {
+            Version("2.5.0"): BPMEvent.record_2_5_0,
+            Version("3.0.0"): BPMEvent.record_3_0_0
+        }
 
-        return BPMEvent(
+    @staticmethod
+    def record_2_5_0(json: dict, **kwargs):
+        return (
             json.get("_time", 0),
             json.get("_floatValue", 0)
         )
-    
+
     @staticmethod
-    def from_json_3_0_0(json: dict, **kwargs):
-        return BPMEvent(
+    def record_3_0_0(json: dict, **kwargs):
+        return (
             json.get("b", 0),
             json.get("m", 0)
         )
     
+    @staticmethod
+    def from_json_2_5_0(json: dict, **kwargs):
+        return BPMEvent.from_record(BPMEvent.record_2_5_0(json))
+    
+    @staticmethod
+    def from_json_3_0_0(json: dict, **kwargs):
+        return BPMEvent.from_record(BPMEvent.record_3_0_0(json))
+
+    @classmethod
+    def from_record(cls, record):
+        beat, bpm = record
+        return BPMEvent(beat, bpm)
+
+    def to_record(self) -> tuple:
+        return (self.beat, self.bpm)
+    
     def to_dict(self):
         return {
             "type": self.elm_type,
@@ -15,33 +15,64 @@ class ColorNote(Element):
         self.angle_offset = angle_offset
 
     @staticmethod
-    def from_json_2_0_0(json: dict, **kwargs):
-        return ColorNote(
+    def record_2_0_0(json: dict, **kwargs):
+        color = json.get("_type", 0)
+        return (
+            ElementType.ColorNoteRed if color == 0 else ElementType.ColorNoteBlue,
             json.get("_time", 0),
             json.get("_lineIndex", 0),
             json.get("_lineLayer", 0),
-            json.get("_type", 0),
+            color,
             json.get("_cutDirection", 0),
-            0
+            0, 0, 0, 0
         )
 
     @staticmethod
-    def from_json_3_0_0(json: dict, **kwargs):
-        return ColorNote(
+    def record_3_0_0(json: dict, **kwargs):
+        color = json.get("c", 0)
+        return (
+            ElementType.ColorNoteRed if color == 0 else ElementType.ColorNoteBlue,
             json.get("b", 0),
             json.get("x", 0),
             json.get("y", 0),
-            json.get("c", 0),
+            color,
             json.get("d", 0),
-            json.get("a", 0)
+            json.get("a", 0),
+            0, 0, 0
         )
 
+    @staticmethod
+    def from_json_2_0_0(json: dict, **kwargs):
+        return ColorNote.from_record(ColorNote.record_2_0_0(json))
+
+    @staticmethod
+    def from_json_3_0_0(json: dict, **kwargs):
+        return ColorNote.from_record(ColorNote.record_3_0_0(json))
+
     @classmethod
     def get_parsing_table(cls):
         return {
             Version("2.0.0"): ColorNote.from_json_2_0_0,
             Version("3.0.0"): ColorNote.from_json_3_0_0
         }
+
+    @classmethod
+    def get_record_table(cls):
+        return {
+            Version("2.0.0"): ColorNote.record_2_0_0,
+            Version("3.0.0"): ColorNote.record_3_0_0
+        }
+
+    @classmethod
+    def from_record(cls, record):
+        _, beat, x, y, color, cut_dir, angle_offset, _, _, _ = record
+        return ColorNote(beat, x, y, color, cut_dir, angle_offset)
+
+    def to_record(self) -> tuple:
+        return (
+            ElementType.ColorNoteRed if self.color == 0 else ElementType.ColorNoteBlue,
+            self.beat, self.x, self.y, self.color, self.cut_dir, self.angle_offset, 0, 0, 0
+        )
     
     def note_angle(self) -> float:
         # get angle of the cut direction and add offset
@@ -85,27 +116,54 @@ class BombNote(Element):
         self.y = y
 
     @staticmethod
-    def from_json_2_0_0(json: dict, **kwargs):
-        return BombNote(
+    def record_2_0_0(json: dict, **kwargs):
+        return (
+            ElementType.BombNote,
             json.get("_time", 0),
             json.get("_lineIndex", 0),
-            json.get("_lineLayer", 0)
+            json.get("_lineLayer", 0),
+            0, 0, 0, 0, 0, 0
         )
 
     @staticmethod
-    def from_json_3_0_0(json: dict, **kwargs):
-        return BombNote(
+    def record_3_0_0(json: dict, **kwargs):
+        return (
+            ElementType.BombNote,
             json.get("b", 0),
             json.get("x", 0),
-            json.get("y", 0)
+            json.get("y", 0),
+            0, 0, 0, 0, 0, 0
         )
 
+    @staticmethod
+    def from_json_2_0_0(json: dict, **kwargs):
+        return BombNote.from_record(BombNote.record_2_0_0(json))
+
+    @staticmethod
+    def from_json_3_0_0(json: dict, **kwargs):
+        return BombNote.from_record(BombNote.record_3_0_0(json))
+
     @classmethod
     def get_parsing_table(cls):
         return {
             Version("2.0.0"): BombNote.from_json_2_0_0,
             Version("3.0.0"): BombNote.from_json_3_0_0,
         }
+
+    @classmethod
+    def get_record_table(cls):
+        return {
+            Version("2.0.0"): BombNote.record_2_0_0,
+            Version("3.0.0"): BombNote.record_3_0_0,
+        }
+
+    @classmethod
+    def from_record(cls, record):
+        _, beat, x, y, _, _, _, _, _, _ = record
+        return BombNote(beat, x, y)
+
+    def to_record(self) -> tuple:
+        return (self.elm_type, self.beat, self.x, self.y, 0, 0, 0, 0, 0, 0)
     
     def to_dict(self):
         return {
@@ -132,60 +190,98 @@ class Obstacle(Element):
     def get_parsing_table(cls):
         return {
             Version("2.0.0"): Obstacle.from_json_2_0_0,
-            Version("2.6.0"): Obstacle.from_json_2_0_0,
+            Version("2.6.0"): Obstacle.from_json_2_6_0,
             Version("3.0.0"): Obstacle.from_json_3_0_0
         }
+
+    @classmethod
+    def get_record_table(cls):
+        return {
+            Version("2.0.0"): Obstacle.record_2_0_0,
+            Version("2.6.0"): Obstacle.record_2_6_0,
+            Version("3.0.0"): Obstacle.record_3_0_0
+        }
     
     @staticmethod
-    def from_json_2_0_0(json: dict, **kwargs):
+    def record_2_0_0(json: dict, **kwargs):
 
         match json["_type"]:
             case 0:
-                return Obstacle(
+                # full height wall
+                return (
+                    ElementType.Obstacle,
                     json.get("_time", 0),
                     json.get("_lineIndex", 0),
-                    0,
+                    0, 0, 0, 0,
                     json.get("_duration", 0),
                     json.get("_width", 0),
                     5
                 )
             case 1:
-                return Obstacle(
+                # crouch wall
+                return (
+                    ElementType.Obstacle,
                     json.get("_time", 0),
                     json.get("_lineIndex", 0),
-                    2,
+                    2, 0, 0, 0,
                     json.get("_duration", 0),
                     json.get("_width", 0),
                     3
                 )
+            case t:
+                raise ValueError(f"Unknown obstacle type {t}")
 
     @staticmethod
-    def from_json_2_6_0(json: dict, **kwargs):
+    def record_2_6_0(json: dict, **kwargs):
         
         match json["_type"]:
             case 0 | 1:
-                return Obstacle.from_json_2_0_0(json)
+                return Obstacle.record_2_0_0(json)
             
-            case 2:
-                return Obstacle(
+            case _:
+                return (
+                    ElementType.Obstacle,
                     json.get("_time", 0),
                     json.get("_lineIndex", 0),
                     json.get("_lineLayer", 0),
+                    0, 0, 0,
                     json.get("_duration", 0),
                     json.get("_width", 0),
                     json.get("_height", 0)
                 )
     
     @staticmethod
-    def from_json_3_0_0(json: dict, **kwargs):
-        return Obstacle(
+    def record_3_0_0(json: dict, **kwargs):
+        return (
+            ElementType.Obstacle,
             json.get("b", 0),
-            json.get("d", 0),
             json.get("x", 0),
             json.get("y", 0),
+            0, 0, 0,
+            json.get("d", 0),
             json.get("w", 0),
             json.get("h", 0)
         )
+
+    @staticmethod
+    def from_json_2_0_0(json: dict, **kwargs):
+        return Obstacle.from_record(Obstacle.record_2_0_0(json))
+
+    @staticmethod
+    def from_json_2_6_0(json: dict, **kwargs):
+        return Obstacle.from_record(Obstacle.record_2_6_0(json))
+    
+    @staticmethod
+    def from_json_3_0_0(json: dict, **kwargs):
+        return Obstacle.from_record(Obstacle.record_3_0_0(json))
+
+    @classmethod
+    def from_record(cls, record):
+        _, beat, x, y, _, _, _, duration, width, height = record
+        return Obstacle(beat, x, y, duration, width, height)
+
+    def to_record(self) -> tuple:
+        return (self.elm_type, self.beat, self.x, self.y, 0, 0, 0, self.duration, self.width, self.height)
     
     def to_dict(self):
         return {
@@ -196,4 +292,4 @@ class Obstacle(Element):
             "duration": self.duration,
             "width": self.width,
             "height": self.height,
-        }
\ No newline at end of file
+        }
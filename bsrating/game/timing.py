@@ -0,0 +1,87 @@
+import numpy as np
+
+from bsrating.game.columns import BPM_DTYPE, NJS_DTYPE
+
+class TimingGrid:
+    """Converts beats into real time (seconds) and note jump speed for a whole difficulty.
+
+    The BPM changes split the map into segments with a constant tempo. The start beat, 
+    start time and tempo of every segment are computed once, so any number of beats can
+    then be mapped with a single `searchsorted` pass:
+
+    ```
+    segment = searchsorted(start_beats, beat) - 1
+    time = start_times[segment] + (beat - start_beats[segment]) * 60 / bpms[segment]
+    ```
+
+    NJS changes are handled in the same way: the NJS is linearly interpolated between
+    the NJS events, starting from the base NJS of the difficulty at beat 0 and staying 
+    constant after the last event.
+
+    Args:
+        initial_bpm (float): The BPM of the song at beat 0.
+        bpm_events (np.ndarray): BPM changes, as a `BPM_DTYPE` array. Events with a 
+        non-positive BPM are ignored.
+        njs (float): The base NJS of the difficulty.
+        njs_events (np.ndarray, optional): NJS changes, as a `NJS_DTYPE` array. Defaults to None.
+    """
+
+    def __init__(self, initial_bpm : float, bpm_events : np.ndarray, njs : float, njs_events : np.ndarray = None):
+
+        bpm_events = np.asarray(bpm_events, dtype=BPM_DTYPE)
+        bpm_events = bpm_events[bpm_events["bpm"] > 0]
+        bpm_events = bpm_events[np.argsort(bpm_events["beat"], kind="stable")]
+
+        # segment table: the first segment starts at beat 0 with the initial BPM
+        self.start_beats = np.concatenate([ [0.0], bpm_events["beat"] ])
+        self.bpms = np.concatenate([ [initial_bpm], bpm_events["bpm"] ]).astype(np.float64)
+        self.start_times = np.concatenate([ 
+            [0.0], np.cumsum(np.diff(self.start_beats) * 60.0 / self.bpms[:-1]) 
+        ])
+
+        # NJS knots for interpolation
+        if njs_events is None:
+            njs_events = np.empty(0, dtype=NJS_DTYPE)
+
+        njs_events = np.asarray(njs_events, dtype=NJS_DTYPE)
+        njs_events = njs_events[np.argsort(njs_events["beat"], kind="stable")]
+        self.njs_beats = np.concatenate([ [0.0], njs_events["beat"] ])
+        self.njs_values = np.concatenate([ [njs], njs_events["njs"] ]).astype(np.float64)
+
+    def segment(self, beats) -> np.ndarray:
+        """Index of the BPM segment that contains each beat."""
+        idx = np.searchsorted(self.start_beats, np.asarray(beats, dtype=np.float64), side="right") - 1
+        return np.maximum(idx, 0)
+
+    def beat_to_time(self, beats) -> np.ndarray:
+        """Convert beats into seconds from the start of the song.
+
+        Args:
+            beats (array_like): The beats to convert.
+
+        Returns:
+            np.ndarray: The time of each beat, in seconds.
+        """
+        beats = np.asarray(beats, dtype=np.float64)
+        seg = self.segment(beats)
+
+        return self.start_times[seg] + (beats - self.start_beats[seg]) * 60.0 / self.bpms[seg]
+
+    def bpm_at(self, beats) -> np.ndarray:
+        """The BPM at each beat."""
+        return self.bpms[self.segment(beats)]
+
+    def njs_at(self, beats) -> np.ndarray:
+        """The note jump speed at each beat.
+
+        Args:
+            beats (array_like): The beats to look up.
+
+        Returns:
+            np.ndarray: The NJS at each beat.
+        """
+        beats = np.asarray(beats, dtype=np.float64)
+        if len(self.njs_beats) == 1:
+            return np.full(beats.shape, self.njs_values[0])
+
+        return np.interp(beats, self.njs_beats, self.njs_values)
@@ -1,4 +1,8 @@
 from .ranking import *
+from .fetcher import *
+from .cache import *
+from .ratelimit import *
 from .exceptions import *
+from .folderindex import *
 from .localdata import *
 from .levelinfo import *
\ No newline at end of file
@@ -0,0 +1,148 @@
+import json
+import sqlite3
+import threading
+import time
+
+# default time to live of the cached responses for each API, in seconds
+DEFAULT_TTL = {
+    "scoresaber" :  24 * 3600,
+    "beatleader" :  24 * 3600,
+    "beatsaver" :   7 * 24 * 3600,
+}
+
+# the access time of a cached response is only updated if it is older than this, in seconds
+ACCESS_RESOLUTION = 60.0
+
+class ResponseCache:
+    """Persistent cache for the responses of the ranking APIs, stored in a SQLite database.
+    Responses are keyed by source and request URL (which contains the endpoint, hash and
+    difficulty). Successful responses expire after the TTL of their source, and 404 responses
+    are cached as well (negative caching) with their own TTL. When the cache grows over
+    `max_bytes`, the least recently used responses are evicted.
+
+    Reads don't write to the database: the access times of the hits (with a resolution of
+    `ACCESS_RESOLUTION` seconds) are kept in memory, and stored with the next response or
+    when the cache is closed.
+
+    The cache can be shared among threads.
+
+    Args:
+        path (str): The path to the database file.
+        ttl (dict, optional): Time to live of the responses of each source, in seconds.
+        Sources missing from the dict use the defaults in `DEFAULT_TTL`. Defaults to None.
+        negative_ttl (float, optional): Time to live of 404 responses, in seconds. Defaults to 1 day.
+        max_bytes (int, optional): Maximum size of the cached bodies. Defaults to 256 MiB.
+        refresh (bool, optional): If True, cached responses are ignored (but new responses
+        are still stored). Defaults to False.
+    """
+
+    def __init__(self, path : str, ttl : dict = None, negative_ttl : float = 24 * 3600,
+                 max_bytes : int = 256 << 20, refresh : bool = False):
+        self.path = path
+        self.ttl = { **DEFAULT_TTL, **(ttl or {}) }
+        self.negative_ttl = negative_ttl
+        self.max_bytes = max_bytes
+        self.refresh = refresh
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                body TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                size INTEGER NOT NULL
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+        self._conn.commit()
+
+        # the total size of the cached bodies, and the access times not stored yet
+        self._size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self._accessed = {}
+
+    def get(self, source : str, key : str) -> tuple[int, dict]:
+        """Get a cached response.
+
+        Args:
+            source (str): The API ("scoresaber", "beatleader" or "beatsaver").
+            key (str): The request URL.
+
+        Returns:
+            (int, dict): The status code and body of the response, or None if it isn't
+                cached or has expired.
+        """
+        with self._lock:
+            row = None
+            if not self.refresh:
+                row = self._conn.execute(
+                    "SELECT status, body, fetched_at, accessed_at FROM responses WHERE key = ?", (key,)).fetchone()
+
+            now = time.time()
+            if row is not None:
+                status, body, fetched_at, accessed_at = row
+                ttl = self.negative_ttl if status == 404 else self.ttl.get(source, 0)
+                if now - fetched_at <= ttl:
+                    if now - self._accessed.get(key, accessed_at) > ACCESS_RESOLUTION:
+                        self._accessed[key] = now
+                    self.hits += 1
+                    return status, json.loads(body)
+
+            self.misses += 1
+            return None
+
+    def put(self, source : str, key : str, status : int, body : dict):
+        """Store a response. Only successful and 404 responses are stored."""
+
+        if not (200 <= status < 300 or status == 404):
+            return
+
+        data = json.dumps(body)
+        now = time.time()
+        with self._lock:
+            self._store_accessed()
+
+            replaced = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, source, status, data, now, now, len(data)))
+            self._size += len(data) - (replaced[0] if replaced is not None else 0)
+
+            self._evict()
+            self._conn.commit()
+
+    def _store_accessed(self):
+        if len(self._accessed) > 0:
+            self._conn.executemany("UPDATE responses SET accessed_at = ? WHERE key = ?",
+                                   [ (accessed_at, key) for key, accessed_at in self._accessed.items() ])
+            self._accessed.clear()
+
+    def _evict(self):
+        total = self._size
+        if total <= self.max_bytes:
+            return
+
+        # remove the least recently used responses, leaving some room so that 
+        # the next insertions don't trigger another eviction right away
+        target = int(self.max_bytes * 0.9)
+        rows = self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall()
+        victims = []
+        for key, size in rows:
+            if total <= target:
+                break
+            victims.append((key,))
+            total -= size
+
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+        self._size = total
+
+    def close(self):
+        with self._lock:
+            self._store_accessed()
+            self._conn.commit()
+            self._conn.close()
@@ -0,0 +1,258 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import requests as rq
+from requests.adapters import HTTPAdapter
+
+from bsrating.leveldata.levelinfo import OnlineLevelInfo
+from bsrating.leveldata.ratelimit import FetchStats, jittered_backoff, rate_limits_from_env
+from bsrating.leveldata.ranking import (
+    combine_online_info, load_beatleader_by_hash, load_beatsaver_by_hash, load_beatsaver_by_hashes, 
+    load_scoresaber_by_hash
+)
+from .exceptions import *
+
+class _NotCached(Exception):
+    pass
+
+class _CacheOnlySession:
+    """A session that never sends anything, to answer a lookup from the cache alone."""
+
+    def get(self, url : str, **kwargs):
+        raise _NotCached(url)
+
+class _LookupOnce:
+    """Wraps the response cache for the two passes of a request (from the cache, then from the
+    network), so that every response is looked up, and counted as a hit or a miss, only once.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.found = {}
+
+    def get(self, source : str, key : str) -> tuple[int, dict]:
+        if key not in self.found:
+            self.found[key] = self.cache.get(source, key)
+        return self.found[key]
+
+    def put(self, source : str, key : str, status : int, body : dict):
+        self.cache.put(source, key, status, body)
+
+class BeatSaverBatchResolver:
+    """Groups BeatSaver lookups into multi-hash requests. Every hash is only requested once,
+    and all the difficulties of the same song share the result. A batch is sent as soon as 
+    it is full, or after `max_delay` seconds since the first pending hash.
+
+    Args:
+        fetcher (AsyncRankingFetcher): The fetcher used to send the requests.
+        batch_size (int, optional): Maximum number of hashes per request. Defaults to 50.
+        max_delay (float, optional): Maximum time a hash waits for the batch to fill up, in seconds. 
+        Defaults to 0.05.
+    """
+
+    def __init__(self, fetcher, batch_size : int = 50, max_delay : float = 0.05):
+        self.fetcher = fetcher
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+
+        self.results = {}
+        self.pending = []
+        self._timer = None
+        self._tasks = set()
+
+    async def resolve(self, hash : str) -> dict:
+        """Get the BeatSaver information of a map, or None if it isn't found."""
+
+        key = hash.lower()
+        if key not in self.results:
+            self.results[key] = asyncio.get_running_loop().create_future()
+            self.pending.append(key)
+
+            if len(self.pending) >= self.batch_size:
+                self._flush()
+            elif self._timer is None:
+                self._timer = asyncio.get_running_loop().call_later(self.max_delay, self._flush)
+
+        return await self.results[key]
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        while len(self.pending) > 0:
+            batch, self.pending = self.pending[:self.batch_size], self.pending[self.batch_size:]
+
+            task = asyncio.create_task(self._load(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _load(self, batch : list):
+        fetcher = self.fetcher
+        try:
+            data = await fetcher.fetch_with_retry("beatsaver", lambda t : fetcher._request(
+                "beatsaver", load_beatsaver_by_hashes, batch, t))
+            
+            for key in batch:
+                self.results[key].set_result(data.get(key) if data is not None else None)
+        except Exception as e:
+            for key in batch:
+                self.results[key].set_exception(e)
+
+class AsyncRankingFetcher:
+    """Fetches map information from ScoreSaber, BeatLeader and BeatSaver concurrently.
+    The HTTP requests themselves are still blocking `requests` calls: they run in a pool of
+    `concurrency` threads, which bounds the number of requests in flight, while asyncio only
+    schedules them (and waits for the rate limits and retry backoffs without holding a thread).
+    Every API has its own `requests` session, so connections are kept alive and reused. The
+    three lookups of a map are issued at the same time, and BeatSaver lookups are grouped into
+    multi-hash requests (see `BeatSaverBatchResolver`).
+
+    Requests to each API go through a token bucket (see `rate_limits_from_env`), so that
+    the fetcher stays under their quotas. Every lookup is first answered from the cache if it
+    can be, and only the requests actually sent wait for the bucket, in the event loop: while
+    the requests to a rate limited API wait for their turn, the requests to the other APIs keep
+    flowing. Throttled requests are retried after a jittered backoff, the same way. The counters
+    in `stats` keep track of the requests, throttles, retries and time spent waiting.
+
+    ```code
+    with AsyncRankingFetcher(concurrency=16) as fetcher:
+        results = asyncio.run(fetcher.load_all([ (hash, "ExpertPlus"), ... ]))
+    ```
+
+    Args:
+        concurrency (int, optional): Maximum number of requests in flight. Defaults to 16.
+        max_retries (int, optional): Maximum number of attempts per request. Defaults to 5.
+        use_bl (bool, optional): Whether to fetch the BeatLeader stars as well. Defaults to False.
+        cache (ResponseCache, optional): The response cache. Defaults to None.
+        bs_batch_size (int, optional): Maximum number of hashes per BeatSaver request. If it is 1, 
+        every map is requested on its own. Defaults to 50.
+        rate_limits (dict, optional): The `TokenBucket` of each API. APIs without a bucket are not
+        limited. Defaults to the limits set in the environment.
+    """
+
+    def __init__(self, concurrency : int = 16, max_retries : int = 5, use_bl : bool = False, cache = None,
+                 bs_batch_size : int = 50, rate_limits : dict = None):
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.use_bl = use_bl
+        self.cache = cache
+
+        self.rate_limits = rate_limits if rate_limits is not None else rate_limits_from_env()
+        self.stats = FetchStats()
+
+        self.sessions = {
+            source : self._make_session(concurrency)
+            for source in ("scoresaber", "beatleader", "beatsaver")
+        }
+
+        # the requests are blocking, so they run in a thread pool, which also bounds the requests in flight
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+
+        self.beatsaver = BeatSaverBatchResolver(self, bs_batch_size) if bs_batch_size > 1 else None
+
+    @staticmethod
+    def _make_session(pool_size : int) -> rq.Session:
+        session = rq.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
+        return session
+
+    async def _request(self, source : str, fn, *args):
+        """Run `fn(*args, session, cache)` in the thread pool, with the session of the API. The
+        cache is tried first, and only if it can't answer does the request wait for the rate limit
+        (in the event loop, without holding a thread) and get sent.
+        """
+        loop = asyncio.get_running_loop()
+
+        cache = None
+        if self.cache is not None:
+            cache = _LookupOnce(self.cache)
+            try:
+                return await loop.run_in_executor(self.executor, functools.partial(fn, *args, _CacheOnlySession(), cache))
+            except _NotCached:
+                pass
+
+        if source in self.rate_limits:
+            delay = self.rate_limits[source].reserve()
+            self.stats.add(rate_limit_wait=delay)
+            await asyncio.sleep(delay)
+
+        self.stats.add(requests=1)
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args, self.sessions[source], cache))
+
+    async def fetch_with_retry(self, source : str, fetcher):
+        """Same as `bsrating.leveldata.ranking.fetch_with_retry`, but the throttled requests
+        wait for a jittered backoff without blocking the other requests, and go through the
+        rate limiter again when they are retried.
+        """
+        retries = 0
+        while retries < self.max_retries:
+            try:
+                return await fetcher(retries)
+            except MapNotFoundError:
+                return None
+            except TimeOutError as te:
+                self.stats.add(throttles=1)
+                retries += 1
+                if retries >= self.max_retries:
+                    break
+
+                delay = jittered_backoff(te.time)
+                self.stats.add(retries=1, backoff_wait=delay)
+                await asyncio.sleep(delay)
+
+        self.stats.add(failures=1)
+        raise MapNotFoundError(f"Couldn't retrieve map information from {source}")
+
+    async def load_info_by_hash(self, hash : str, difficulty : str) -> OnlineLevelInfo:
+        """Asynchronous version of `bsrating.leveldata.ranking.load_info_by_hash`."""
+
+        async def no_data():
+            return None
+
+        ss_data, bl_data, bs_data = await asyncio.gather(
+            self.fetch_with_retry("scoresaber", lambda t : self._request(
+                "scoresaber", load_scoresaber_by_hash, hash, difficulty, t)),
+            self.fetch_with_retry("beatleader", lambda t : self._request(
+                "beatleader", load_beatleader_by_hash, hash, difficulty, t)) if self.use_bl else no_data(),
+            self.beatsaver.resolve(hash) if self.beatsaver is not None else self.fetch_with_retry("beatsaver", lambda t : self._request(
+                "beatsaver", load_beatsaver_by_hash, hash, t))
+        )
+
+        return combine_online_info(hash, difficulty, ss_data, bl_data, bs_data)
+
+    async def load_all(self, items : list, progress = None) -> list:
+        """Fetch the information of every (hash, difficulty) pair.
+
+        Args:
+            items (list): The (hash, difficulty) pairs.
+            progress (optional): A progress bar (e.g. tqdm) updated after each map. Defaults to None.
+
+        Returns:
+            list: For each pair, in the same order, either the `OnlineLevelInfo` or the exception raised.
+        """
+        async def load(hash, difficulty):
+            try:
+                return await self.load_info_by_hash(hash, difficulty)
+            except Exception as e:
+                return e
+            finally:
+                if progress is not None:
+                    progress.update(1)
+
+        return await asyncio.gather(*[ load(hash, difficulty) for hash, difficulty in items ])
+
+    def close(self):
+        self.executor.shutdown()
+        for session in self.sessions.values():
+            session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,188 @@
+import hashlib
+import json
+import os
+
+# bump when the format of the entries changes, so that old indices are rebuilt
+FOLDER_INDEX_VERSION = 1
+
+INFO_FILE_NAMES = [ "Info.dat", "info.dat" ]
+
+def level_hash(map_folder : str, info_file : str) -> str:
+    """Compute the BeatSaver hash of a level: the SHA-1 of the info file followed by every
+    difficulty file, in the order they appear in the info file.
+
+    Args:
+        map_folder (str): The folder containing the level.
+        info_file (str): The name of the info file.
+
+    Returns:
+        str: The hash (lowercase), or None if the info file version is not supported.
+    """
+    with open(os.path.join(map_folder, info_file), 'rb') as fp:
+        info_bytes = fp.read()
+
+    json_info = json.loads(info_bytes)
+    if "_difficultyBeatmapSets" not in json_info:
+        return None
+
+    sha = hashlib.sha1(info_bytes)
+    for beatmap_set in json_info["_difficultyBeatmapSets"]:
+        for beatmap in beatmap_set["_difficultyBeatmaps"]:
+            with open(os.path.join(map_folder, beatmap["_beatmapFilename"]), 'rb') as fp:
+                sha.update(fp.read())
+
+    return sha.hexdigest()
+
+class FolderIndex:
+    """Persistent index of the CustomLevels folder. For every level folder it stores the
+    BeatSaver id (the first token of the folder name), the level hash, the info file and the
+    modification time of the folder, so that levels can be looked up by hash or id without
+    touching the filesystem.
+
+    The index is refreshed incrementally: only the folders that are new or whose modification
+    time changed are read again. Note that editing a file in place doesn't change the folder
+    modification time, use `refresh(full=True)` to read every folder again.
+
+    ```code
+    index = FolderIndex.load("data/folder_index.json", os.getenv("SONG_FOLDER"))
+    index.refresh()
+    index.save()
+
+    entry = index.lookup(hash="a1b2...", id="1a3e1")
+    ```
+
+    Args:
+        song_folder (str): The path pointing to the CustomLevels folder.
+        path (str, optional): The file the index is saved to. Defaults to None (not persisted).
+        entries (dict, optional): The indexed folders, by folder name. Defaults to None.
+    """
+
+    def __init__(self, song_folder : str, path : str = None, entries : dict = None):
+        self.song_folder = song_folder
+        self.path = path
+        self.entries = entries or {}
+
+        self._build_lookups()
+
+    @staticmethod
+    def load(path : str, song_folder : str):
+        """Load the index saved in `path`. If it doesn't exist, or was built for another
+        folder or version, an empty index is returned instead.
+        """
+        entries = None
+        if os.path.isfile(path):
+            with open(path, encoding='utf-8') as fp:
+                data = json.load(fp)
+
+            if data.get("version") == FOLDER_INDEX_VERSION and data.get("song_folder") == song_folder:
+                entries = data["entries"]
+
+        return FolderIndex(song_folder, path, entries)
+
+    def save(self, path : str = None):
+        path = path or self.path
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as fp:
+            json.dump({
+                "version" :     FOLDER_INDEX_VERSION,
+                "song_folder" : self.song_folder,
+                "entries" :     self.entries
+            }, fp)
+
+        os.replace(tmp_path, path)
+
+    def refresh(self, full : bool = False) -> dict:
+        """Scan the song folder and update the entries of the new, changed and removed folders.
+
+        Args:
+            full (bool, optional): Read every folder again, even if it didn't change. Defaults to False.
+
+        Returns:
+            dict: The number of "added", "updated", "removed" and "unchanged" folders.
+        """
+        stats = { "added" : 0, "updated" : 0, "removed" : 0, "unchanged" : 0 }
+        entries = {}
+
+        with os.scandir(self.song_folder) as it:
+            for dir_entry in it:
+                if not dir_entry.is_dir():
+                    continue
+
+                mtime = dir_entry.stat().st_mtime_ns
+                previous = self.entries.get(dir_entry.name)
+                if previous is not None and previous["mtime"] == mtime and not full:
+                    entries[dir_entry.name] = previous
+                    stats["unchanged"] += 1
+                    continue
+
+                entries[dir_entry.name] = self._index_folder(dir_entry, mtime)
+                stats["added" if previous is None else "updated"] += 1
+
+        stats["removed"] = len(self.entries.keys() - entries.keys())
+        self.entries = entries
+        self._build_lookups()
+
+        return stats
+
+    def _index_folder(self, dir_entry : os.DirEntry, mtime : int) -> dict:
+        with os.scandir(dir_entry.path) as it:
+            files = { f.name for f in it if f.is_file() }
+
+        info_file = next(filter(lambda op : op in files, INFO_FILE_NAMES), None)
+
+        hash = None
+        if info_file is not None:
+            try:
+                hash = level_hash(dir_entry.path, info_file)
+            except Exception:
+                # missing difficulty files or broken info file, still indexed by id
+                pass
+
+        return {
+            "id" :          dir_entry.name.split()[0],
+            "hash" :        hash,
+            "info_file" :   info_file,
+            "mtime" :       mtime
+        }
+
+    def _build_lookups(self):
+        self.by_hash = {}
+        self.by_id = {}
+
+        # if a level was downloaded more than once, the most recent folder wins
+        for name, entry in sorted(self.entries.items(), key=lambda e : e[1]["mtime"]):
+            if entry["info_file"] is None:
+                continue
+
+            if entry["hash"] is not None:
+                self.by_hash[entry["hash"]] = name
+            self.by_id[entry["id"]] = name
+
+    def folder_path(self, name : str) -> str:
+        return os.path.join(self.song_folder, name)
+
+    def lookup(self, hash : str = None, id : str = None) -> tuple[str, str]:
+        """Find a level by hash or, if no folder has that hash (e.g. the map was updated
+        on BeatSaver but not downloaded again), by id.
+
+        Args:
+            hash (str, optional): The level hash. Defaults to None.
+            id (str, optional): The BeatSaver id. Defaults to None.
+
+        Returns:
+            (str, str): The path to the level folder and the name of its info file,
+                or None if the level isn't found.
+        """
+        name = None
+        if hash is not None:
+            name = self.by_hash.get(hash.lower())
+        if name is None and id is not None:
+            name = self.by_id.get(id)
+
+        if name is None:
+            return None
+
+        return self.folder_path(name), self.entries[name]["info_file"]
+
+    def __len__(self):
+        return len(self.entries)
@@ -1,9 +1,8 @@
-import json
 import os
-from bsrating.game.beatmap import BeatMap, SongInfo
+from bsrating.game.beatmap import SongInfo
 from bsrating.leveldata.exceptions import MapLogicError
+from bsrating.leveldata.parsing import find_info_file, load_beatmap, load_song_info
 import numpy as np
-from packaging.version import Version
 
 from bsrating.utils.strings import capitalize_diff
 
@@ -86,44 +85,42 @@ class LocalLevelInfo:
             json_data.get("info_file", "")
         )
     
-    def _process_info(self) -> SongInfo:
+    def _process_info(self, song_info : SongInfo = None) -> SongInfo:
 
-        # load info data
-        json_info = None
-        with open(os.path.join(self.song_path, self.info_file), encoding='utf-8') as dd:
-            json_info = json.load(dd)
+        # the info file is only read if the caller doesn't already have it
+        if song_info is None:
+            song_info = self.read_song_info()
 
-        version = Version(json_info["_version"])
-        return SongInfo.from_json(version, json_info, diff=capitalize_diff(self.diff))
-    
-    def _process_beatmap(self, info : SongInfo):
+        return song_info.for_difficulty(capitalize_diff(self.diff))
 
-        # load beatmap file data
-        json_beatmap = None
-        with open(os.path.join(self.song_path, info.diff_fname), encoding='utf-8') as dd:
-            json_beatmap = json.load(dd)
+    def read_song_info(self) -> SongInfo:
+        """Read the info file of the song, with all of its difficulties. Difficulties of the same
+        song can share it (see `process` and `source_files`), so that it is only parsed once."""
 
-        jv = json_beatmap["_version"] if "_version" in json_beatmap else json_beatmap.get("version", "2.0.0")
-        version = Version(jv)
-        return BeatMap.from_json(version, json_beatmap, info=info)
+        return load_song_info(self.song_path, self.info_file)
 
-    def process(self) -> dict:
+    def source_files(self, song_info : SongInfo = None) -> list:
+        """The files this difficulty is built from: the info file and the difficulty file.
 
-        info = self._process_info()
+        Args:
+            song_info (SongInfo, optional): The information of the song, if already loaded. 
+            Defaults to None (the info file is read).
+        """
 
-        return self._process_beatmap(info).to_dict()
+        info = self._process_info(song_info)
 
-def find_info_file(map_folder):
-    # find beatmap information in the info file.
-    print(map_folder)
-    path_options = [ "Info.dat", "info.dat" ]
-    try:
-        opt = next(
-            filter(
-                lambda op : os.path.isfile(os.path.join(map_folder, op)), path_options
-            )
-        )
-    except Exception as e:
-        raise Exception(f"Info file cannot be found!")
-    
-    return os.path.join(map_folder, opt)
+        return [ os.path.join(self.song_path, self.info_file), os.path.join(self.song_path, info.diff_fname) ]
+
+    def process(self, stream : bool = False, song_info : SongInfo = None) -> dict:
+        """Load the difficulty and convert it to its processed form.
+
+        Args:
+            stream (bool, optional): Whether to parse the difficulty file incrementally
+            (see `BeatMap.from_stream`). Defaults to False.
+            song_info (SongInfo, optional): The information of the song, if already loaded. 
+            Defaults to None (the info file is read).
+        """
+
+        info = self._process_info(song_info)
+
+        return load_beatmap(self.song_path, info, stream).to_dict()
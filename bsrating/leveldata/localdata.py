@@ -1,20 +1,16 @@
 import json
 import os
 
+from bsrating.leveldata.folderindex import FolderIndex
 from bsrating.leveldata.levelinfo import LocalLevelInfo, OnlineLevelInfo
 
-def update_map_info(raw_info : LocalLevelInfo, folder_association : dict, use_bl) -> dict:
+def update_map_info(raw_info : LocalLevelInfo, folder_index : FolderIndex, use_bl) -> dict:
 
-    # find beatmap information in the info file.
-    path_options = [ "Info.dat", "info.dat" ]
-    try:
-        opt = next(
-            filter(
-                lambda op : os.path.isfile(os.path.join(folder_association[raw_info.id], op)), path_options
-            )
-        )
-    except Exception as e:
+    # find the map folder and its info file
+    found = folder_index.lookup(raw_info.hash, raw_info.id)
+    if found is None:
         raise Exception(f"[{raw_info.id}] Info file cannot be found!")
+    song_path, info_file = found
         
     return {
         "id" :              raw_info.id,
@@ -22,12 +18,12 @@ def update_map_info(raw_info : LocalLevelInfo, folder_association : dict, use_bl
         "hash" :            raw_info.hash,
         "name" :            raw_info.name,
         "stars" :           raw_info.stars,
-        "song_path":        folder_association[raw_info.id],
-        "info_file":        opt
+        "song_path":        song_path,
+        "info_file":        info_file
     }
 
 
-def combine_map_info(raw_info : OnlineLevelInfo, folder_association : dict, use_bl) -> dict:
+def combine_map_info(raw_info : OnlineLevelInfo, folder_index : FolderIndex, use_bl) -> dict:
     """Load information from the local map folder and combine it with the 
     online data. Note that this won't contain the level data, but
     it will reference the appropriate .dat file.
@@ -37,22 +33,17 @@ def combine_map_info(raw_info : OnlineLevelInfo, folder_association : dict, use_
 
     Args:
         raw_info (dict): Combined information from online APIs.
-        folder_association (dict): An association returned by `preprocess_folders`.
+        folder_index (FolderIndex): The index of the song folder.
 
     Returns:
         dict: A dictionary containing the map information and a path to the song folder, as well as the characteristic and difficulty.
     """
 
-    # find beatmap information in the info file.
-    path_options = [ "Info.dat", "info.dat" ]
-    try:
-        opt = next(
-            filter(
-                lambda op : os.path.isfile(os.path.join(folder_association[raw_info.id], op)), path_options
-            )
-        )
-    except Exception as e:
+    # find the map folder and its info file
+    found = folder_index.lookup(raw_info.hash, raw_info.id)
+    if found is None:
         raise Exception(f"[{raw_info.id}] Info file cannot be found!")
+    song_path, info_file = found
         
     return {
         "id" :              raw_info.id,
@@ -60,6 +51,6 @@ def combine_map_info(raw_info : OnlineLevelInfo, folder_association : dict, use_
         "hash" :            raw_info.hash,
         "name" :            raw_info.name,
         "stars" :           raw_info.get_stars(use_bl),
-        "song_path":        folder_association[raw_info.id],
-        "info_file":        opt
+        "song_path":        song_path,
+        "info_file":        info_file
     }
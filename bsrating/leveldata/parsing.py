@@ -1,44 +1,94 @@
 import os
 import json
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 from packaging.version import Version
 
 from bsrating.game.beatmap import BeatMap, SongInfo
-from bsrating.leveldata.levelinfo import find_info_file
-from bsrating.utils.strings import capitalize_diff
 
-def process_map_folder(map_folder):
+def find_info_file(map_folder):
+    # find beatmap information in the info file.
+    print(map_folder)
+    path_options = [ "Info.dat", "info.dat" ]
+    try:
+        opt = next(
+            filter(
+                lambda op : os.path.isfile(os.path.join(map_folder, op)), path_options
+            )
+        )
+    except Exception as e:
+        raise Exception(f"Info file cannot be found!")
+    
+    return os.path.join(map_folder, opt)
+
+def load_song_info(map_folder, info_file : str = None) -> SongInfo:
+    """Read the info file of a map folder once, indexing all of its difficulties.
 
-    # load info data
-    info_path = find_info_file(map_folder)
+    Args:
+        map_folder (str): The folder containing the map.
+        info_file (str, optional): The name of the info file, if known. Defaults to None (it is 
+        looked up with `find_info_file`).
+    """
+
+    info_path = find_info_file(map_folder) if info_file is None else os.path.join(map_folder, info_file)
     json_info = None
     with open(info_path, encoding='utf-8') as dd:
         json_info = json.load(dd)
 
     # load difficulty names (assumming <4.0.0)
-    # TODO improve info reading (modify song info to read all diffs into a dict)
-    # this is currently reading info twice
-    
-    # fetch all map data
-    bm_data = next(filter(lambda e : e["_beatmapCharacteristicName"] == "Standard", json_info["_difficultyBeatmapSets"]))["_difficultyBeatmaps"]
+    version = Version(json_info["_version"])
+    return SongInfo.from_json(version, json_info)
 
-    # create a dict associating the difficulty name and its path inside the map folder 
-    diffs = { e["_difficulty"] : e["_beatmapFilename"] for e in bm_data }
-    
-    beatmaps = {}
-    for diff, diff_fname in diffs.items():
-        version = Version(json_info["_version"])
-        diff_info = SongInfo.from_json(version, json_info, diff=capitalize_diff(diff))
+def load_beatmap(map_folder, diff_info : SongInfo, stream : bool = False) -> BeatMap:
+    """Load the difficulty file selected in `diff_info` from the map folder."""
 
-        # load beatmap file data
-        json_beatmap = None
-        with open(os.path.join(map_folder, diff_fname), encoding='utf-8') as dd:
-            json_beatmap = json.load(dd)
+    # load beatmap file data
+    json_beatmap = None
+    with open(os.path.join(map_folder, diff_info.diff_fname), encoding='utf-8') as dd:
+        if stream:
+            return BeatMap.from_stream(dd, diff_info)
 
-        jv = json_beatmap["_version"] if "_version" in json_beatmap else json_beatmap.get("version", "2.0.0")
-        version = Version(jv)
-        beatmap = BeatMap.from_json(version, json_beatmap, info=diff_info)
+        json_beatmap = json.load(dd)
 
-        beatmaps[diff] = beatmap
-    
-    return beatmaps
\ No newline at end of file
+    jv = json_beatmap["_version"] if "_version" in json_beatmap else json_beatmap.get("version", "2.0.0")
+    version = Version(jv)
+    return BeatMap.from_json(version, json_beatmap, info=diff_info)
+
+def process_map_folder(map_folder, stream : bool = False, executor : str = None,
+                       max_workers : int = None, characteristic : str = "Standard") -> dict:
+    """Load all the difficulties of a characteristic from a map folder. The info file is
+    read only once, and the difficulty files can be loaded concurrently.
+
+    Args:
+        map_folder (str): The folder containing the map.
+        stream (bool, optional): Whether to parse the difficulty files incrementally. Defaults to False.
+        executor (str, optional): "thread" or "process" to load the difficulties in a pool of
+        threads or processes, or None to load them sequentially. Defaults to None.
+        max_workers (int, optional): The size of the pool. Defaults to None (the default of the executor).
+        characteristic (str, optional): The characteristic to load. Defaults to "Standard".
+
+    Returns:
+        dict: The beatmaps of the folder, by difficulty name.
+    """
+
+    info = load_song_info(map_folder)
+    diff_infos = { diff : info.for_difficulty(diff, characteristic)
+                   for diff in info.difficulties.get(characteristic, {}) }
+
+    if executor is None:
+        return { diff : load_beatmap(map_folder, diff_info, stream)
+                 for diff, diff_info in diff_infos.items() }
+
+    pools = {
+        "thread" :  ThreadPoolExecutor,
+        "process" : ProcessPoolExecutor
+    }
+
+    if executor not in pools:
+        raise ValueError(f"Unknown executor '{executor}', expected one of {list(pools.keys())}")
+
+    with pools[executor](max_workers=max_workers) as pool:
+        futures = { diff : pool.submit(load_beatmap, map_folder, diff_info, stream)
+                    for diff, diff_info in diff_infos.items() }
+
+        return { diff : future.result() for diff, future in futures.items() }
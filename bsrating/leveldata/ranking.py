@@ -4,16 +4,45 @@ import os
 from http import HTTPStatus
 
 from bsrating.leveldata.levelinfo import OnlineLevelInfo
+from bsrating.leveldata.ratelimit import FetchStats, RateLimitedSession, jittered_backoff
 from bsrating.utils.difficulty import diff_from_str
 from .exceptions import *
 
-def load_scoresaber_by_hash(hash: str, difficulty: str, attempt : int) -> dict:
+def get_json(url : str, source : str, session = rq, cache = None) -> tuple[int, dict]:
+    """Send a GET request and return the status code and JSON body of the response, 
+    going through the response cache if there is one.
+
+    Args:
+        url (str): The URL of the request.
+        source (str): The API ("scoresaber", "beatleader" or "beatsaver").
+        session (optional): The `requests` session used for the request. Defaults to the `requests` module.
+        cache (ResponseCache, optional): The response cache. Defaults to None.
+
+    Returns:
+        (int, dict): The status code and body of the response.
+    """
+    if cache is not None:
+        cached = cache.get(source, url)
+        if cached is not None:
+            return cached
+
+    r = session.get(url, timeout=5)
+    code, body = r.status_code, r.json()
+
+    if cache is not None:
+        cache.put(source, url, code, body)
+
+    return code, body
+
+def load_scoresaber_by_hash(hash: str, difficulty: str, attempt : int, session = rq, cache = None) -> dict:
     """Load information from ScoreSaber, from a difficulty for the map with a certain hash.
 
     Args:
         hash (str): The Beat Saver hash of the level.
         difficulty (str): The string representing the difficulty (e.g. Easy, Normal, Hard, Expert, ExpertPlus)
         attempt (int): The fetching attempt.
+        session (optional): The `requests` session used for the request. Defaults to the `requests` module.
+        cache (ResponseCache, optional): The response cache. Defaults to None.
 
     Raises:
         MapNotFoundError: If the map is not found, this exception will be raised
@@ -27,9 +56,7 @@ def load_scoresaber_by_hash(hash: str, difficulty: str, attempt : int) -> dict:
     diff_num = diff_from_str(difficulty)
 
     ss_rq_path = f"{os.getenv("SCORESABER_API_URL")}/leaderboard/by-hash/{hash}/info?difficulty={diff_num}"
-    ss_r = rq.get(ss_rq_path, timeout=5)
-    ss_r_code = ss_r.status_code
-    ss_r_body = ss_r.json()
+    ss_r_code, ss_r_body = get_json(ss_rq_path, "scoresaber", session, cache)
 
     if HTTPStatus(ss_r_code) == HTTPStatus.NOT_FOUND:
         raise MapNotFoundError(f"{hash} Not found")
@@ -41,13 +68,15 @@ def load_scoresaber_by_hash(hash: str, difficulty: str, attempt : int) -> dict:
         "stars" : ss_r_body["stars"] if ss_r_body["ranked"] else None
     }
     
-def load_beatsaver_by_hash(hash: str, attempt : int) -> dict:
+def load_beatsaver_by_hash(hash: str, attempt : int, session = rq, cache = None) -> dict:
     """Load information from BeatSaver, for the map with a certain hash.
 
     Args:
         hash (str): The Beat Saver hash of the level.
         difficulty (str): The string representing the difficulty (e.g. Easy, Normal, Hard, Expert, ExpertPlus)
         attempt (int): The fetching attempt.
+        session (optional): The `requests` session used for the request. Defaults to the `requests` module.
+        cache (ResponseCache, optional): The response cache. Defaults to None.
 
     Raises:
         MapNotFoundError: If the map is not found, this exception will be raised
@@ -59,28 +88,94 @@ def load_beatsaver_by_hash(hash: str, attempt : int) -> dict:
     """
 
     bs_rq_path = f"{os.getenv("BEATSAVER_API_URL")}/maps/hash/{hash}"
-    bs_r = rq.get(bs_rq_path, timeout=5)
-    bs_r_code = bs_r.status_code
-    bs_r_body = bs_r.json()
+    bs_r_code, bs_r_body = get_json(bs_rq_path, "beatsaver", session, cache)
 
     if HTTPStatus(bs_r_code) == HTTPStatus.NOT_FOUND:
         raise MapNotFoundError(f"{hash} Not found")
     elif not HTTPStatus(bs_r_code).is_success:
         raise TimeOutError(bs_r_body["errorMessage"], min(2 ** attempt, 60))
     
+    return beatsaver_info(bs_r_body)
+
+def beatsaver_info(bs_map : dict) -> dict:
+    """Extract the relevant information from a BeatSaver map object."""
     return {
-        "id" : bs_r_body["id"],
-        "name" : bs_r_body["name"],
-        "updatedAt" : bs_r_body["updatedAt"]
+        "id" : bs_map["id"],
+        "name" : bs_map["name"],
+        "updatedAt" : bs_map["updatedAt"]
     }
 
-def load_beatleader_by_hash(hash: str, difficulty : str, attempt : int):
+def load_beatsaver_by_hashes(hashes: list, attempt : int, session = rq, cache = None) -> dict:
+    """Load information from BeatSaver for several maps at once, with a single request
+    (BeatSaver accepts up to 50 comma-separated hashes). Each map is cached on its own, with 
+    the same key as in `load_beatsaver_by_hash`, so only the maps missing from the cache are 
+    requested.
+
+    Args:
+        hashes (list): The Beat Saver hashes of the levels.
+        attempt (int): The fetching attempt.
+        session (optional): The `requests` session used for the request. Defaults to the `requests` module.
+        cache (ResponseCache, optional): The response cache. Defaults to None.
+
+    Raises:
+        TimeOutError: If an error occurred, a timeout error will be raised, containing 
+        the amount of time to wait (exponential backoff)
+
+    Returns:
+        dict: The information fetched from the BeatSaver API for each (lowercase) hash, 
+            or None if the map wasn't found.
+    """
+    api_url = os.getenv("BEATSAVER_API_URL")
+    results = {}
+
+    # look for each map in the cache first
+    missing = []
+    for hash in dict.fromkeys(h.lower() for h in hashes):
+        cached = cache.get("beatsaver", f"{api_url}/maps/hash/{hash}") if cache is not None else None
+        if cached is None:
+            missing.append(hash)
+        else:
+            bs_r_code, bs_r_body = cached
+            results[hash] = beatsaver_info(bs_r_body) if HTTPStatus(bs_r_code).is_success else None
+
+    if len(missing) == 0:
+        return results
+
+    bs_rq_path = f"{api_url}/maps/hash/{','.join(missing)}"
+    bs_r = session.get(bs_rq_path, timeout=5)
+    bs_r_code = bs_r.status_code
+    bs_r_body = bs_r.json()
+
+    if HTTPStatus(bs_r_code) == HTTPStatus.NOT_FOUND:
+        bs_r_body = {}
+    elif not HTTPStatus(bs_r_code).is_success:
+        raise TimeOutError(bs_r_body["errorMessage"], min(2 ** attempt, 60))
+    elif len(missing) == 1:
+        # a single map is returned as it is, not in a dict
+        bs_r_body = { missing[0] : bs_r_body }
+
+    bs_r_body = { k.lower() : v for k, v in bs_r_body.items() }
+    for hash in missing:
+        bs_map = bs_r_body.get(hash)
+        results[hash] = beatsaver_info(bs_map) if bs_map is not None else None
+
+        if cache is not None:
+            if bs_map is not None:
+                cache.put("beatsaver", f"{api_url}/maps/hash/{hash}", HTTPStatus.OK.value, bs_map)
+            else:
+                cache.put("beatsaver", f"{api_url}/maps/hash/{hash}", HTTPStatus.NOT_FOUND.value, { "error" : "Not Found" })
+    
+    return results
+
+def load_beatleader_by_hash(hash: str, difficulty : str, attempt : int, session = rq, cache = None):
     """Load information from BeatLeader, from a difficulty for the map with a certain hash.
 
     Args:
         hash (str): The Beat Saver hash of the level.
         difficulty (str): The string representing the difficulty (e.g. Easy, Normal, Hard, Expert, ExpertPlus)
         attempt (int): The fetching attempt.
+        session (optional): The `requests` session used for the request. Defaults to the `requests` module.
+        cache (ResponseCache, optional): The response cache. Defaults to None.
 
     Raises:
         MapNotFoundError: If the map is not found, this exception will be raised
@@ -92,9 +187,7 @@ def load_beatleader_by_hash(hash: str, difficulty : str, attempt : int):
     """
 
     bl_rq_path = f"{os.getenv("BEATLEADER_API_URL")}/leaderboard/{hash}/{difficulty}/Standard"
-    bl_r = rq.get(bl_rq_path, timeout=5)
-    bl_r_code = bl_r.status_code
-    bl_r_body = bl_r.json()
+    bl_r_code, bl_r_body = get_json(bl_rq_path, "beatleader", session, cache)
 
     if HTTPStatus(bl_r_code) == HTTPStatus.NOT_FOUND:
         raise MapNotFoundError(f"{hash} Not found")
@@ -105,7 +198,7 @@ def load_beatleader_by_hash(hash: str, difficulty : str, attempt : int):
         "stars" : bl_r_body["difficulty"]["stars"]
     }
 
-def fetch_with_retry(fetcher, max_retries):
+def fetch_with_retry(fetcher, max_retries, stats : FetchStats = None):
     result = None
     retries = 0
     while retries < max_retries:
@@ -117,32 +210,52 @@ def fetch_with_retry(fetcher, max_retries):
         except TimeOutError as te:
             print(f"{te} Retrying ({retries} / {max_retries})...")
             retries += 1
-            time.sleep(te.time)
+
+            # same jittered backoff as `AsyncRankingFetcher.fetch_with_retry`
+            delay = jittered_backoff(te.time)
+            if stats is not None:
+                stats.add(throttles=1, retries=1, backoff_wait=delay)
+            time.sleep(delay)
 
     if retries >= max_retries and result is None:
+        if stats is not None:
+            stats.add(failures=1)
         raise MapNotFoundError("Couldn't retrieve map information")
     
     return result
 
-def load_info_by_hash(hash: str, difficulty : str, max_retries = 5, use_bl : bool = False) -> OnlineLevelInfo:
-
-    # load scoresaber info
-    ss_data = fetch_with_retry(lambda t : load_scoresaber_by_hash(hash, difficulty, t), max_retries)
-
-    # load beatleader info
-    bl_data = None
-    if use_bl:
-        bl_data = fetch_with_retry(lambda t : load_beatleader_by_hash(hash, difficulty, t), max_retries) if use_bl else None
+def combine_online_info(hash : str, difficulty : str, ss_data : dict, bl_data : dict, bs_data : dict) -> OnlineLevelInfo:
+    """Combine the information fetched from each API into a single object."""
 
-    # load beatsaver info
-    bs_data = fetch_with_retry(lambda t : load_beatsaver_by_hash(hash, t), max_retries)
+    if bs_data is None:
+        raise MapNotFoundError(f"{hash} Not found in BeatSaver")
     
     return OnlineLevelInfo(
         bs_data["id"], 
         hash, 
         bs_data["name"],
         difficulty, 
-        bl_data["stars"] if use_bl else None,
+        bl_data["stars"] if bl_data is not None else None,
         ss_data["stars"] if ss_data is not None else None,
         bs_data["updatedAt"]
-    )
\ No newline at end of file
+    )
+
+def load_info_by_hash(hash: str, difficulty : str, max_retries = 5, use_bl : bool = False, cache = None,
+                      rate_limits : dict = None, stats : FetchStats = None) -> OnlineLevelInfo:
+
+    # the requests that miss the cache wait for the rate limit of their API
+    rate_limits = rate_limits or {}
+    sessions = { source : RateLimitedSession(rq, rate_limits.get(source), stats) for source in ("scoresaber", "beatleader", "beatsaver") }
+
+    # load scoresaber info
+    ss_data = fetch_with_retry(lambda t : load_scoresaber_by_hash(hash, difficulty, t, sessions["scoresaber"], cache), max_retries, stats)
+
+    # load beatleader info
+    bl_data = None
+    if use_bl:
+        bl_data = fetch_with_retry(lambda t : load_beatleader_by_hash(hash, difficulty, t, sessions["beatleader"], cache), max_retries, stats) if use_bl else None
+
+    # load beatsaver info
+    bs_data = fetch_with_retry(lambda t : load_beatsaver_by_hash(hash, t, sessions["beatsaver"], cache), max_retries, stats)
+    
+    return combine_online_info(hash, difficulty, ss_data, bl_data, bs_data)
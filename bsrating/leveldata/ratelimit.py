@@ -0,0 +1,131 @@
+import os
+import random
+import threading
+import time
+
+# environment variables with the request rate limit (requests per second) of each API
+RATE_LIMIT_VARIABLES = {
+    "scoresaber" :  "SS_RATE_LIMIT",
+    "beatleader" :  "BL_RATE_LIMIT",
+    "beatsaver" :   "BS_RATE_LIMIT",
+}
+
+class TokenBucket:
+    """Token bucket rate limiter, that can be shared among threads. Tokens are refilled at
+    `rate` tokens per second, up to `burst` tokens, and every request takes one. A request that
+    finds the bucket empty reserves the next token anyway and waits for it, so the waiting
+    requests are served in order.
+
+    Args:
+        rate (float): The sustained rate, in requests per second.
+        burst (float, optional): The bucket capacity. Defaults to max(rate, 1).
+    """
+
+    def __init__(self, rate : float, burst : float = None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token, reserving it in advance if the bucket is empty.
+
+        Returns:
+            float: The time to wait before using the token, in seconds.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1.0
+
+            return max(0.0, -self.tokens / self.rate)
+
+    def wait(self) -> float:
+        """Wait until a token is available and take it, blocking the thread.
+
+        Returns:
+            float: The time spent waiting, in seconds.
+        """
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+        return delay
+
+def rate_limits_from_env() -> dict:
+    """Create a token bucket for every API with a rate limit set in the environment
+    (see `RATE_LIMIT_VARIABLES`). APIs without a limit, or with a limit of 0, are not limited.
+
+    Returns:
+        dict: The token bucket of each API.
+    """
+    buckets = {}
+    for source, var in RATE_LIMIT_VARIABLES.items():
+        rate = float(os.getenv(var) or 0)
+        if rate > 0:
+            buckets[source] = TokenBucket(rate)
+
+    return buckets
+
+def jittered_backoff(delay : float) -> float:
+    """Randomize a backoff delay between half and all of its value, so that requests
+    throttled at the same time don't retry at the same time.
+    """
+    return delay / 2.0 + random.uniform(0.0, delay / 2.0)
+
+class FetchStats:
+    """Counters of the requests sent to the ranking APIs. They can be updated from any thread
+    with `add`.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.throttles = 0
+        self.retries = 0
+        self.failures = 0
+        self.rate_limit_wait = 0.0
+        self.backoff_wait = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, **counters):
+        """Add to some counters, e.g. `stats.add(requests=1)`."""
+
+        with self._lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def as_dict(self) -> dict:
+        return { k : v for k, v in self.__dict__.items() if not k.startswith("_") }
+
+    def __str__(self):
+        return (f"{self.requests} requests, {self.throttles} throttled, {self.retries} retries, "
+                f"{self.failures} failures, {self.rate_limit_wait:.1f}s waiting on rate limits, "
+                f"{self.backoff_wait:.1f}s waiting on backoff")
+
+class RateLimitedSession:
+    """Wraps a `requests` session (or the `requests` module) so that every GET request waits for
+    the token bucket of its API and is counted in the stats. The responses found in the
+    `ResponseCache` never reach the session, so they are neither limited nor counted.
+
+    Args:
+        session: The `requests` session used for the requests.
+        bucket (TokenBucket, optional): The rate limit of the API. Defaults to None (not limited).
+        stats (FetchStats, optional): The counters updated by the requests. Defaults to None.
+    """
+
+    def __init__(self, session, bucket : TokenBucket = None, stats : FetchStats = None):
+        self.session = session
+        self.bucket = bucket
+        self.stats = stats
+
+    def get(self, url : str, **kwargs):
+        waited = self.bucket.wait() if self.bucket is not None else 0.0
+        if self.stats is not None:
+            self.stats.add(requests=1, rate_limit_wait=waited)
+
+        return self.session.get(url, **kwargs)
+
+    def close(self):
+        self.session.close()
@@ -1,2 +1,9 @@
+from .tokenizer import *
+from .sample_cache import *
 from .map_dataset import *
-from .nn import *
\ No newline at end of file
+from .packed_dataset import *
+from .sampler import *
+from .checkpoint import *
+from .nn import *
+from .service import *
+from .inference import *
\ No newline at end of file
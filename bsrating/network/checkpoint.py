@@ -0,0 +1,128 @@
+import os
+import random
+import re
+import threading
+
+import numpy as np
+import torch
+
+def rng_state() -> dict:
+    """The state of every random number generator used in training (torch, CUDA, numpy and python)."""
+
+    return {
+        "torch" :   torch.get_rng_state(),
+        "cuda" :    torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+        "numpy" :   np.random.get_state(),
+        "random" :  random.getstate()
+    }
+
+def set_rng_state(state : dict):
+    """Restore the random number generators from `rng_state`."""
+
+    torch.set_rng_state(state["torch"])
+    if state["cuda"] is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+    np.random.set_state(state["numpy"])
+    random.setstate(state["random"])
+
+def snapshot(obj):
+    """Copy every tensor in a (nested) state to the CPU, so that training can keep updating
+    the originals while the copy is written.
+    """
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return { k : snapshot(v) for k, v in obj.items() }
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot(v) for v in obj)
+
+    return obj
+
+class CheckpointManager:
+    """Writes training checkpoints to a folder as `checkpoint_<step>.pt`, keeping only the last
+    `keep_last` ones.
+
+    Saving takes a CPU snapshot of the state and writes it in a background thread, so the training
+    loop only waits for the copy. Files are written to a temporary name and renamed, so a checkpoint
+    is either complete or not there at all. Only one write is in flight at a time.
+
+    Args:
+        folder (str): The checkpoint folder.
+        keep_last (int, optional): The number of checkpoints to keep (0 keeps all of them). Defaults to 3.
+    """
+
+    PATTERN = re.compile(r"checkpoint_(\d+)\.pt$")
+
+    def __init__(self, folder : str, keep_last : int = 3):
+        self.folder = folder
+        self.keep_last = keep_last
+        self._thread = None
+        self._error = None
+
+        os.makedirs(folder, exist_ok=True)
+
+    def checkpoints(self) -> list:
+        """The paths of the checkpoints in the folder, from oldest to newest."""
+
+        found = []
+        for fname in os.listdir(self.folder):
+            match = self.PATTERN.match(fname)
+            if match is not None:
+                found.append((int(match.group(1)), os.path.join(self.folder, fname)))
+
+        return [ path for _, path in sorted(found) ]
+
+    def latest(self) -> str:
+        """The path of the newest checkpoint, or None if there isn't any."""
+
+        checkpoints = self.checkpoints()
+        return checkpoints[-1] if len(checkpoints) > 0 else None
+
+    def save(self, state : dict, step : int):
+        """Save a checkpoint in the background.
+
+        Args:
+            state (dict): The training state. Tensors are copied before returning.
+            step (int): The global step, used to name and order the checkpoints.
+        """
+        self.wait()
+        state = snapshot(state)
+        path = os.path.join(self.folder, f"checkpoint_{step:09d}.pt")
+
+        self._thread = threading.Thread(target=self._write, args=(state, path), daemon=True)
+        self._thread.start()
+
+    def _write(self, state : dict, path : str):
+        try:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'wb') as fp:
+                torch.save(state, fp)
+                fp.flush()
+                os.fsync(fp.fileno())
+            os.replace(tmp_path, path)
+
+            for old in self.checkpoints()[:-self.keep_last]:
+                os.remove(old)
+        except Exception as e:
+            self._error = e
+
+    def wait(self):
+        """Wait for the checkpoint being written, if any. Errors of the write are raised here."""
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def load(self, path : str = None, map_location = None) -> dict:
+        """Load a checkpoint (by default, the newest one). Returns None if there isn't any."""
+
+        path = path or self.latest()
+        if path is None:
+            return None
+
+        # checkpoints hold the numpy and python RNG states, which are not plain tensors
+        return torch.load(path, map_location=map_location, weights_only=False)
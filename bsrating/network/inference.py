@@ -0,0 +1,184 @@
+import json
+import zipfile
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.export import Dim
+
+from bsrating.game.element import ElementType
+from bsrating.network.nn import RatingPredictorNN
+from bsrating.network.service import load_model
+from bsrating.network.tokenizer import TOKEN_DIM
+
+INPUT_NAMES = ["feats", "type_ids", "pad_mask"]
+
+def example_inputs(batch_size : int, seq_len : int, seed : int = 0) -> tuple[torch.tensor, torch.tensor, torch.tensor]:
+    """Random tokens with increasing times, shaped like a batch of maps, to export and benchmark models.
+
+    Returns:
+        (torch.tensor, torch.tensor, torch.tensor): The tokens, type ids and padding mask.
+    """
+    generator = torch.Generator().manual_seed(seed)
+
+    tokens = torch.rand((batch_size, seq_len, TOKEN_DIM), generator=generator)
+    tokens[..., 1] = torch.cumsum(torch.rand((batch_size, seq_len), generator=generator) * 0.25, dim=1)
+    type_ids = torch.randint(0, ElementType.Obstacle + 1, (batch_size, seq_len), generator=generator)
+    padding_mask = torch.zeros((batch_size, seq_len), dtype=torch.bool)
+
+    return tokens, type_ids, padding_mask
+
+class _GroupedInputs(nn.Module):
+    """The model as it is exported: the inputs come in groups of `notes_per_token` elements,
+    shape ``[batch_size, groups, notes_per_token, ...]``, so that the sequence length is a whole
+    number of groups for every input (a plain symbol the attention can be exported with).
+    """
+
+    def __init__(self, model : RatingPredictorNN):
+        super().__init__()
+        self.model = model
+
+    def forward(self, feats, type_ids, pad_mask):
+        return self.model(feats.flatten(1, 2), type_ids.flatten(1, 2), pad_mask.flatten(1, 2))
+
+def group_inputs(notes_per_token : int, tokens : torch.tensor, type_ids : torch.tensor, padding_mask : torch.tensor):
+    """Pad a batch to a whole number of groups and split it, as `_GroupedInputs` expects it.
+    The padding is masked out, so it doesn't change the ratings.
+    """
+    extra = -tokens.size(1) % notes_per_token
+    tokens = nn.functional.pad(tokens, (0, 0, 0, extra))
+    type_ids = nn.functional.pad(type_ids, (0, extra), value=ElementType.Other)
+    padding_mask = nn.functional.pad(padding_mask, (0, extra), value=True)
+
+    return tuple(x.unflatten(1, (-1, notes_per_token)) for x in (tokens, type_ids, padding_mask))
+
+def export_program(model : RatingPredictorNN) -> torch.export.ExportedProgram:
+    """Export the model with `torch.export`, with a dynamic batch size and sequence length
+    (see `_GroupedInputs` for the shape of the inputs).
+    """
+    model = model.eval()
+    batch, groups = Dim("batch", min=1), Dim("groups", min=1)
+    dynamic_shapes = tuple({ 0 : batch, 1 : groups } for _ in INPUT_NAMES)
+
+    # export with more than one map and group, sizes of 1 would be specialized
+    inputs = group_inputs(model.notes_per_token, *example_inputs(2, 8 * model.notes_per_token))
+    with torch.no_grad():
+        return torch.export.export(_GroupedInputs(model), inputs, dynamic_shapes=dynamic_shapes)
+
+def export_metadata(model : RatingPredictorNN) -> dict:
+    """The configuration stored with an exported model, needed to prepare its inputs."""
+
+    return {
+        "notes_per_token" : model.notes_per_token,
+        "token_dim" :       TOKEN_DIM
+    }
+
+def save_exported_program(program : torch.export.ExportedProgram, model : RatingPredictorNN, path : str):
+    """Save an exported program (.pt2), along with the information needed to run it."""
+
+    torch.export.save(program, path, extra_files={ "metadata.json" : json.dumps(export_metadata(model)) })
+
+def save_onnx(program : torch.export.ExportedProgram, model : RatingPredictorNN, path : str):
+    """Convert an exported program to ONNX (.onnx), keeping the dynamic axes. Requires the
+    `onnx` and `onnxscript` packages.
+    """
+    import onnx
+
+    onnx_program = torch.onnx.export(program, dynamo=True)
+    onnx_program.save(path)
+
+    # keep the metadata in the model itself
+    onnx_model = onnx.load(path)
+    onnx.helper.set_model_props(onnx_model, { k : str(v) for k, v in export_metadata(model).items() })
+    onnx.save(onnx_model, path)
+
+def save_compiled(program : torch.export.ExportedProgram, model : RatingPredictorNN, path : str):
+    """Compile an exported program ahead of time with AOTInductor, into a package (.aoti.pt2)
+    with native code for this machine's CPU. Requires a C++ compiler, and takes a while.
+    """
+    metadata = { k : str(v) for k, v in export_metadata(model).items() }
+    torch._inductor.aoti_compile_and_package(program, package_path=path,
+                                              inductor_configs={ "aot_inductor.metadata" : metadata })
+
+def exported_format(path : str) -> str:
+    """The format of an exported model, found from the contents of the file rather than its extension
+    (the parameters saved by `torch.save` can have a .pt2 extension too).
+
+    Returns:
+        str: "onnx" for ONNX models, "aoti" for AOTInductor packages, "export" for `torch.export`
+            programs, or None if it isn't an exported model.
+    """
+    if path.endswith(".onnx"):
+        return "onnx"
+    if not zipfile.is_zipfile(path):
+        return None
+
+    with zipfile.ZipFile(path) as archive:
+        records = [ name.split("/", 1)[-1] for name in archive.namelist() ]
+
+    # both kinds of PT2 archives have an "archive_format" record, which torch.save archives don't have
+    if any(record.startswith("data/aotinductor/") for record in records):
+        return "aoti"
+    if "archive_format" in records or "extra/metadata.json" in records:
+        return "export"
+
+    return None
+
+class ExportedRatingPredictor:
+    """Runs a model exported by `export_model.py`: a `torch.export` program (.pt2), an AOTInductor
+    package (.aoti.pt2) or an ONNX model (.onnx, run with `onnxruntime`), as a drop-in replacement
+    of the eager model: it takes the same (tokens, type ids, padding mask) batches and returns the ratings.
+
+    Args:
+        path (str): The path to the exported model.
+        device (torch.device, optional): The device of the inputs and outputs. Defaults to the CPU.
+        threads (int, optional): The number of threads of the ONNX runtime. Defaults to its default.
+    """
+
+    def __init__(self, path : str, device : torch.device = None, threads : int = None):
+        self.path = path
+        self.device = device or torch.device("cpu")
+
+        model_format = exported_format(path)
+        if model_format == "onnx":
+            import onnxruntime as ort
+
+            options = ort.SessionOptions()
+            if threads is not None:
+                options.intra_op_num_threads = threads
+            self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+            metadata = self.session.get_modelmeta().custom_metadata_map
+            self.module = None
+        elif model_format == "aoti":
+            self.module = torch._inductor.aoti_load_package(path)
+            metadata = self.module.get_metadata()
+            self.session = None
+        elif model_format == "export":
+            extra_files = { "metadata.json" : "" }
+            program = torch.export.load(path, extra_files=extra_files)
+            metadata = json.loads(extra_files["metadata.json"])
+            self.module = program.module().to(self.device)
+            self.session = None
+        else:
+            raise ValueError(f"{path} is not an exported model")
+
+        self.notes_per_token = int(metadata["notes_per_token"])
+
+    def __call__(self, tokens : torch.tensor, type_ids : torch.tensor, padding_mask : torch.tensor) -> torch.tensor:
+        tokens, type_ids, padding_mask = group_inputs(self.notes_per_token, tokens, type_ids, padding_mask)
+
+        if self.module is not None:
+            return self.module(tokens.to(self.device), type_ids.to(self.device), padding_mask.to(self.device))
+
+        inputs = [ x.cpu().numpy() for x in (tokens.float(), type_ids.long(), padding_mask.bool()) ]
+        ratings, = self.session.run(None, dict(zip(INPUT_NAMES, inputs)))
+        return torch.from_numpy(np.asarray(ratings)).to(self.device)
+
+def load_predictor(path : str, device : torch.device = None, **model_args):
+    """Load a model to rate maps: an exported model (see `ExportedRatingPredictor`) if the file is
+    one (see `exported_format`), or else the parameters of the eager model (see `load_model`).
+    """
+    if exported_format(path) is not None:
+        return ExportedRatingPredictor(path, device)
+
+    return load_model(path, device, **model_args)
@@ -1,18 +1,42 @@
 import json
 from pprint import pprint
+import numpy as np
 import torch
 from torch.nn.utils.rnn import pad_sequence
 
 from bsrating.game.element import ElementType
+from bsrating.network.sample_cache import SharedSampleCache
+from bsrating.network.tokenizer import TOKEN_DIM, tokenize_processed
 from torch.utils.data import Dataset, DataLoader
 
 class MapDataset(Dataset):
+    """Dataset of processed maps (the files written by `load_maps.py`), tokenized when loaded.
 
-    def __init__(self, filepaths, notes_per_token=8):
+    Args:
+        filepaths (list): The processed map files.
+        cache (SharedSampleCache, optional): A cache for the tokenized samples, shared among the
+        DataLoader workers, so that the files are only read once while they fit. Defaults to None.
+    """
+
+    def __init__(self, filepaths, cache : SharedSampleCache = None):
         self.filepaths = filepaths
+        self.cache = cache
+        self._lengths = None
 
     def __len__(self):
         return len(self.filepaths)
+
+    def lengths(self) -> np.ndarray:
+        """The number of tokens of every sample. Every file is read once, the first time."""
+
+        if self._lengths is None:
+            lengths = []
+            for filepath in self.filepaths:
+                with open(filepath) as fp:
+                    lengths.append(len(json.load(fp)["data"]))
+            self._lengths = np.array(lengths, dtype=np.int64)
+
+        return self._lengths
     
     def __getitem__(self, idx : int) -> tuple[torch.tensor, torch.tensor, torch.tensor]:
         """Load the map at some index from the dataset. It will convert the map to 
@@ -25,29 +49,23 @@ class MapDataset(Dataset):
             (torch.tensor, torch.tensor, torch.float32): The type and data of the tokens, 
                 along with its rating, everything as a tensor
         """
+        if self.cache is not None:
+            cached = self.cache.get(idx)
+            if cached is not None:
+                return cached
+
         filepath = self.filepaths[idx]
         with open(filepath) as fp:
             data = json.load(fp)
 
-        def format_token(tok: dict):
-            return [
-                tok.get("type", 0),
-                tok.get("time", 0),
-                tok.get("x", 0),
-                tok.get("y", 0),
-                tok.get("angle", 0),
-                1 if tok.get("any_dir", False) else 0,
-                tok.get("w", 0),
-                tok.get("h", 0),
-                tok.get("duration", 0),
-                tok.get("njs", 0)
-            ], tok.get("type", 0)
-
-        formatted_toks = list(zip(*[ format_token(tok) for tok in data["data"] ]))
+        tokens, type_id = tokenize_processed(data["data"])
 
         rating = torch.tensor(data["rating"], dtype=torch.float32)
-        tokens = torch.tensor(formatted_toks[0], dtype=torch.float32)
-        type_id = torch.tensor(formatted_toks[1], dtype=torch.long)
+        tokens = torch.from_numpy(tokens)
+        type_id = torch.from_numpy(type_id)
+
+        if self.cache is not None:
+            self.cache.put(idx, tokens, type_id, rating)
 
         return tokens, type_id, rating
 
@@ -3,16 +3,103 @@ import torch.nn as nn
 from torch.nn.utils.rnn import pad_sequence
 
 from bsrating.game.element import ElementType
-from bsrating.network.pos_encoding import PositionalEncoding
+from bsrating.network.pos_encoding import PositionalEncoding, TimePositionalEncoding
+
+class NoteGroupEncoder(nn.Module):
+    """Packs every `group_size` consecutive elements into a single token, so that the transformer
+    works on sequences `group_size` times shorter. Each element gets an embedding of its slot in
+    the group and goes through a small MLP, and the group is pooled with learned attention weights
+    (ignoring the padding).
+
+    Args:
+        model_dim (int): The dimension of the element embeddings.
+        group_size (int): The number of elements per group.
+    """
+
+    def __init__(self, model_dim : int, group_size : int):
+        super().__init__()
+        self.group_size = group_size
+
+        self.slot_embed = nn.Parameter(torch.zeros(group_size, model_dim))
+        self.mlp = nn.Sequential(
+            nn.Linear(model_dim, model_dim),
+            nn.GELU(),
+            nn.Linear(model_dim, model_dim))
+        self.score = nn.Linear(model_dim, 1)
+
+    def forward(self, x, pad_mask):
+        """
+        Arguments:
+            x: Tensor, shape ``[batch_size, seq_len, embedding_dim]``
+            pad_mask: Tensor, shape ``[batch_size, seq_len]``, True for padding
+
+        Returns:
+            The group tokens, shape ``[batch_size, ceil(seq_len / group_size), embedding_dim]``,
+            and their padding mask (True if the whole group is padding).
+        """
+        batch_size, seq_len, dim = x.shape
+        groups = -(-seq_len // self.group_size)
+
+        # pad the sequence to a whole number of groups
+        extra = groups * self.group_size - seq_len
+        if extra > 0:
+            x = nn.functional.pad(x, (0, 0, 0, extra))
+            pad_mask = nn.functional.pad(pad_mask, (0, extra), value=True)
+
+        x = x.view(batch_size, groups, self.group_size, dim) + self.slot_embed
+        mask = pad_mask.view(batch_size, groups, self.group_size)
+
+        h = self.mlp(x)
+        scores = self.score(h).squeeze(-1).masked_fill(mask, -1e9)
+        weights = torch.softmax(scores, dim=-1)
+
+        return torch.sum(weights.unsqueeze(-1) * h, dim=2), mask.all(dim=-1)
+
+# the positional encodings, in the order of their codes in the stored configuration
+POSITIONAL_ENCODINGS = {
+    "index" :   PositionalEncoding,
+    "time" :    TimePositionalEncoding
+}
+
+def stored_config(state_dict : dict, prefix : str = "") -> tuple[int, str]:
+    """The configuration saved with the parameters of a `RatingPredictorNN`.
+
+    Returns:
+        (int, str): The notes_per_token and the positional encoding, or None if the parameters
+            were saved without them (models with a table of index positions are known to use
+            "index" and a single element per token).
+    """
+    config = state_dict.get(prefix + "config")
+    if config is not None:
+        notes_per_token, positional = config.tolist()
+        return notes_per_token, list(POSITIONAL_ENCODINGS)[positional]
+
+    # models saved before the configuration was, with a table of index positions
+    if prefix + "pos_encoder.pe" in state_dict:
+        return 1, "index"
+
+    return None
 
 class RatingPredictorNN(nn.Module):
-    def __init__(self, token_dim, model_dim=128, heads=4, attn_layers=3):
+    def __init__(self, token_dim, model_dim=128, heads=4, attn_layers=3, notes_per_token=1, positional="time"):
         super().__init__()
 
         # project tokens into the latent space
         self.token_embed = nn.Linear(token_dim, model_dim)
         self.type_embed = nn.Embedding(5, model_dim, padding_idx=ElementType.Other)
-        self.pos_encoder = PositionalEncoding(model_dim) 
+
+        # pack consecutive elements into a single token
+        self.notes_per_token = notes_per_token
+        self.group_encoder = NoteGroupEncoder(model_dim, notes_per_token) if notes_per_token > 1 else None
+
+        # encode the position from the time of the tokens (in seconds), or from their index
+        if positional not in POSITIONAL_ENCODINGS:
+            raise ValueError(f"Unknown positional encoding '{positional}', expected one of {list(POSITIONAL_ENCODINGS.keys())}")
+        self.positional = positional
+        self.pos_encoder = POSITIONAL_ENCODINGS[positional](model_dim)
+
+        # saved with the parameters, so that they are never loaded into a model with another configuration
+        self.register_buffer("config", torch.tensor([notes_per_token, list(POSITIONAL_ENCODINGS).index(positional)]))
 
         # encoder
         encoder_layer = nn.TransformerEncoderLayer(model_dim, heads, batch_first=True)
@@ -22,24 +109,47 @@ class RatingPredictorNN(nn.Module):
         
         self.out = nn.Linear(model_dim, 1)
 
+    def _load_from_state_dict(self, state_dict, prefix, local_metadata, strict, missing_keys, unexpected_keys, error_msgs):
+        config = stored_config(state_dict, prefix) or (self.notes_per_token, self.positional)
+        if config != (self.notes_per_token, self.positional):
+            notes_per_token, positional = config
+            error_msgs.append(f"The parameters were trained with notes_per_token={notes_per_token} and positional='{positional}', "
+                              f"but the model has notes_per_token={self.notes_per_token} and positional='{self.positional}'")
+            return
+
+        state_dict[prefix + "config"] = self.config
+        super()._load_from_state_dict(state_dict, prefix, local_metadata, strict, missing_keys, unexpected_keys, error_msgs)
+
     def forward(self, feats, type_ids, pad_mask):
 
         # add type and token information
         x = self.token_embed(feats) + self.type_embed(type_ids)
+        times = feats[..., 1]
+
+        # group the elements, the rest of the network only sees the groups (placed at their first element)
+        if self.group_encoder is not None:
+            x, pad_mask = self.group_encoder(x, pad_mask)
+            times = times[:, ::self.notes_per_token]
 
         # add positional encoding information
-        x = self.pos_encoder(x)
+        x = self.pos_encoder(x, times)
 
-        # predict scores and pool
-        x = self.transformer(x)
-        scores = self.pool(x).squeeze(-1)
+        # padding is ignored by the attention too, so a map is rated the same whatever it's batched with
+        x = self.transformer(x, src_key_padding_mask=pad_mask)
 
-        # handle padding and compute attention
-        scores = scores.masked_fill(pad_mask, -1e9)
-        weights = torch.softmax(scores, dim=-1)
+        # the pooling and output head always run in float32, even under autocast
+        with torch.autocast(device_type=x.device.type, enabled=False):
+            x = x.float()
+
+            # predict scores and pool
+            scores = self.pool(x).squeeze(-1)
+
+            # handle padding and compute attention
+            scores = scores.masked_fill(pad_mask, -1e9)
+            weights = torch.softmax(scores, dim=-1)
 
-        # aggregate values and attention
-        pooled = torch.sum(weights.unsqueeze(-1) * x, dim=1)
+            # aggregate values and attention
+            pooled = torch.sum(weights.unsqueeze(-1) * x, dim=1)
 
-        # predict rating
-        return self.out(pooled).squeeze(-1)
\ No newline at end of file
+            # predict rating
+            return self.out(pooled).squeeze(-1)
\ No newline at end of file
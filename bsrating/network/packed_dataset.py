@@ -0,0 +1,161 @@
+import json
+import os
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+from bsrating.network.tokenizer import TOKEN_DIM, tokenize_processed
+
+# position of every sample inside the shards
+PACKED_INDEX_DTYPE = np.dtype([
+    ("shard",   np.int32),
+    ("offset",  np.int64),
+    ("length",  np.int64),
+    ("rating",  np.float32),
+])
+
+def _shard_paths(folder : str, shard : int) -> tuple[str, str]:
+    return (
+        os.path.join(folder, f"tokens_{shard:05d}.f32"),
+        os.path.join(folder, f"types_{shard:05d}.i64")
+    )
+
+class PackedDatasetWriter:
+    """Writes tokenized maps into a packed dataset: large shard files with the raw token
+    matrices (float32, `[rows, TOKEN_DIM]`) and type ids (int64), plus an index with the
+    shard, offset, length and rating of every sample. Use it as a context manager, or call
+    `close` to write the index.
+
+    Args:
+        folder (str): The output folder.
+        shard_bytes (int, optional): Approximate size of the token shard files. Defaults to 256 MiB.
+    """
+
+    def __init__(self, folder : str, shard_bytes : int = 256 << 20):
+        self.folder = folder
+        self.shard_bytes = shard_bytes
+        self.index = []
+        self.names = []
+        self.shard = 0
+        self.shard_rows = 0
+
+        os.makedirs(folder, exist_ok=True)
+
+        # start from scratch, the previous shards would be appended to otherwise
+        for fname in os.listdir(folder):
+            if fname.startswith(("tokens_", "types_")):
+                os.remove(os.path.join(folder, fname))
+
+    def add(self, name : str, tokens : np.ndarray, type_ids : np.ndarray, rating : float):
+        tokens = np.ascontiguousarray(tokens, dtype=np.float32).reshape(-1, TOKEN_DIM)
+        type_ids = np.ascontiguousarray(type_ids, dtype=np.int64)
+
+        if self.shard_rows > 0 and (self.shard_rows + len(tokens)) * TOKEN_DIM * 4 > self.shard_bytes:
+            self.shard += 1
+            self.shard_rows = 0
+
+        # empty maps take no space (a shard with only empty maps has no files)
+        if len(tokens) > 0:
+            tokens_path, types_path = _shard_paths(self.folder, self.shard)
+            with open(tokens_path, 'ab') as tf:
+                tf.write(tokens.tobytes())
+            with open(types_path, 'ab') as tf:
+                tf.write(type_ids.tobytes())
+
+        self.index.append((self.shard, self.shard_rows, len(tokens), rating))
+        self.names.append(name)
+        self.shard_rows += len(tokens)
+
+    def close(self):
+        np.save(os.path.join(self.folder, "index.npy"), np.array(self.index, dtype=PACKED_INDEX_DTYPE))
+        with open(os.path.join(self.folder, "meta.json"), 'w') as mf:
+            json.dump({
+                "token_dim" : TOKEN_DIM,
+                "shards" : self.shard + 1 if len(self.index) > 0 else 0,
+                "names" : self.names
+            }, mf)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def pack_dataset(filepaths : list, folder : str, shard_bytes : int = 256 << 20):
+    """Pack processed maps (the JSON files written by `load_maps.py`) into a packed dataset.
+
+    Args:
+        filepaths (list): The processed map files.
+        folder (str): The output folder.
+        shard_bytes (int, optional): Approximate size of the token shard files. Defaults to 256 MiB.
+    """
+    with PackedDatasetWriter(folder, shard_bytes) as writer:
+        for filepath in filepaths:
+            with open(filepath) as fp:
+                data = json.load(fp)
+
+            tokens, type_ids = tokenize_processed(data["data"])
+            writer.add(os.path.basename(filepath), tokens, type_ids, data["rating"])
+
+class PackedMapDataset(Dataset):
+    """Same as `MapDataset`, but reading the maps from a packed dataset (see `PackedDatasetWriter`).
+    The shards are memory-mapped and the samples are served as views over them, so loading a
+    sample doesn't parse or copy anything, and the OS page cache is shared among the DataLoader
+    workers.
+
+    Args:
+        folder (str): The folder containing the packed dataset.
+    """
+
+    def __init__(self, folder : str):
+        self.folder = folder
+        self.index = np.load(os.path.join(folder, "index.npy"))
+
+        with open(os.path.join(folder, "meta.json")) as mf:
+            meta = json.load(mf)
+        self.names = meta["names"]
+
+        # opened lazily, so that every worker maps the shards by itself
+        self._shards = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_shards"] = {}
+        return state
+
+    def __len__(self):
+        return len(self.index)
+
+    def lengths(self) -> np.ndarray:
+        """The number of tokens of every sample."""
+        return self.index["length"]
+
+    def _open_shard(self, shard : int):
+        if shard not in self._shards:
+            tokens_path, types_path = _shard_paths(self.folder, shard)
+
+            if not os.path.exists(tokens_path) or os.path.getsize(tokens_path) == 0:
+                # empty files can't be mapped
+                self._shards[shard] = (
+                    np.empty((0, TOKEN_DIM), dtype=np.float32),
+                    np.empty(0, dtype=np.int64)
+                )
+            else:
+                # copy-on-write maps are writable (as required by torch) but still backed by the page cache
+                self._shards[shard] = (
+                    np.memmap(tokens_path, dtype=np.float32, mode='c').reshape(-1, TOKEN_DIM),
+                    np.memmap(types_path, dtype=np.int64, mode='c')
+                )
+
+        return self._shards[shard]
+
+    def __getitem__(self, idx : int) -> tuple[torch.tensor, torch.tensor, torch.tensor]:
+        shard, offset, length, rating = self.index[idx]
+        tokens, type_ids = self._open_shard(int(shard))
+
+        return (
+            torch.from_numpy(tokens[offset:offset + length]),
+            torch.from_numpy(type_ids[offset:offset + length]),
+            torch.tensor(rating, dtype=torch.float32)
+        )
@@ -2,25 +2,82 @@ import math
 import torch
 import torch.nn as nn
 
-class PositionalEncoding(nn.Module):
-    # Source: https://pytorch-tutorials-preview.netlify.app/beginner/transformer_tutorial.html
-    # implementation according to the original transformer paper
+class SinusoidalEncoding(nn.Module):
+    """Base class of the sinusoidal positional encodings, as in the original transformer paper,
+    computed on the fly for any position (there is no maximum length). The frequencies are
+    computed once and kept in a (non-persistent) buffer.
+    """
 
-    def __init__(self, d_model: int, dropout: float = 0.1, max_len: int = 5000):
+    def __init__(self, d_model: int, dropout: float = 0.1):
         super().__init__()
+        self.d_model = d_model
         self.dropout = nn.Dropout(p=dropout)
 
-        position = torch.arange(max_len).unsqueeze(1)
         div_term = torch.exp(torch.arange(0, d_model, 2) * (-math.log(10000.0) / d_model))
-        pe = torch.zeros(max_len, 1, d_model)
-        pe[:, 0, 0::2] = torch.sin(position * div_term)
-        pe[:, 0, 1::2] = torch.cos(position * div_term)
-        self.register_buffer('pe', pe)
+        self.register_buffer('div_term', div_term, persistent=False)
+
+    def add_encoding(self, x: torch.Tensor, positions: torch.Tensor) -> torch.Tensor:
+        """
+        Arguments:
+            x: Tensor, shape ``[..., embedding_dim]``
+            positions: Tensor, shape ``[...]`` (or broadcastable to it)
+
+        Returns:
+            ``x`` plus the encoding of the positions, with sines on the even and cosines on the odd features
+        """
+        angles = positions.unsqueeze(-1).to(self.div_term.dtype) * self.div_term
+
+        # add straight into the even and odd features, without building the interleaved encoding
+        x = x.clone()
+        x[..., 0::2] += torch.sin(angles)
+        x[..., 1::2] += torch.cos(angles[..., :self.d_model // 2])
+        return x
+
+class PositionalEncoding(SinusoidalEncoding):
+    # Source: https://pytorch-tutorials-preview.netlify.app/beginner/transformer_tutorial.html
+    # implementation according to the original transformer paper
+
+    def forward(self, x: torch.Tensor, times: torch.Tensor = None) -> torch.Tensor:
+        """
+        Arguments:
+            x: Tensor, shape ``[batch_size, seq_len, embedding_dim]``
+            times: Unused, for compatibility with `TimePositionalEncoding`
+        """
+        positions = torch.arange(x.size(1), device=x.device)
+        x = self.add_encoding(x, positions)
+        return self.dropout(x)
 
-    def forward(self, x: torch.Tensor) -> torch.Tensor:
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # older models stored a precomputed table of this encoding, which is not used anymore
+        state_dict.pop(prefix + 'pe', None)
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+class TimePositionalEncoding(SinusoidalEncoding):
+    """Sinusoidal positional encoding of the real timestamp of each token, instead of its index,
+    so that the encoding reflects how far apart the elements are in the song.
+
+    Args:
+        d_model (int): The dimension of the embeddings.
+        dropout (float, optional): The dropout probability. Defaults to 0.1.
+        time_scale (float, optional): Positions per second, i.e. the finest resolution of the
+        encoding is `1 / time_scale` seconds. Defaults to 100.
+    """
+
+    def __init__(self, d_model: int, dropout: float = 0.1, time_scale: float = 100.0):
+        super().__init__(d_model, dropout)
+        self.time_scale = time_scale
+
+    def forward(self, x: torch.Tensor, times: torch.Tensor) -> torch.Tensor:
         """
         Arguments:
-            x: Tensor, shape ``[seq_len, batch_size, embedding_dim]``
+            x: Tensor, shape ``[batch_size, seq_len, embedding_dim]``
+            times: Tensor, shape ``[batch_size, seq_len]``, the time of every token in seconds
         """
-        x = x + self.pe[:x.size(0)]
-        return self.dropout(x)
\ No newline at end of file
+        x = self.add_encoding(x, times * self.time_scale)
+        return self.dropout(x)
+
+    def _load_from_state_dict(self, state_dict, prefix, local_metadata, strict, missing_keys, unexpected_keys, error_msgs):
+        if prefix + 'pe' in state_dict:
+            error_msgs.append(f"'{prefix}pe' is the table of the index positional encoding, "
+                              "the parameters were not trained with the time positional encoding")
+        super()._load_from_state_dict(state_dict, prefix, local_metadata, strict, missing_keys, unexpected_keys, error_msgs)
@@ -0,0 +1,139 @@
+import math
+import multiprocessing as mp
+
+import torch
+
+from bsrating.network.tokenizer import TOKEN_DIM
+
+class SharedSampleCache:
+    """Bounded LRU cache of tokenized samples, kept in shared memory so that every DataLoader
+    worker reads and fills the same entries. The cache must be created in the main process,
+    before the workers start.
+
+    The samples are stored in a paged arena: fixed-size pages of `page_tokens` tokens, allocated
+    to a sample as a linked list, so that samples of any length fit without fragmentation. When
+    there aren't enough free pages for a new sample, the least recently used samples are evicted.
+    All the bookkeeping lives in shared tensors, guarded by a process lock.
+
+    Args:
+        num_samples (int): The number of samples in the dataset.
+        max_bytes (int): The memory budget of the arena.
+        page_tokens (int, optional): The number of tokens per page. Defaults to 256.
+    """
+
+    def __init__(self, num_samples : int, max_bytes : int, page_tokens : int = 256):
+        self.page_tokens = page_tokens
+        self.page_bytes = page_tokens * (TOKEN_DIM * 4 + 8)
+        self.num_pages = max(max_bytes // self.page_bytes, 0)
+
+        # token features and type ids of every page
+        self.tokens = torch.zeros((self.num_pages, page_tokens, TOKEN_DIM), dtype=torch.float32).share_memory_()
+        self.type_ids = torch.zeros((self.num_pages, page_tokens), dtype=torch.int64).share_memory_()
+
+        # pages: whether they are in use, and the next page of the same sample (-1 for the last one)
+        self.page_used = torch.zeros(self.num_pages, dtype=torch.bool).share_memory_()
+        self.next_page = torch.full((self.num_pages,), -1, dtype=torch.int64).share_memory_()
+
+        # samples: whether they are cached, their first page, length, rating and last use
+        self.cached = torch.zeros(num_samples, dtype=torch.bool).share_memory_()
+        self.first_page = torch.full((num_samples,), -1, dtype=torch.int64).share_memory_()
+        self.lengths = torch.zeros(num_samples, dtype=torch.int64).share_memory_()
+        self.ratings = torch.zeros(num_samples, dtype=torch.float32).share_memory_()
+        self.last_used = torch.zeros(num_samples, dtype=torch.int64).share_memory_()
+
+        # logical clock, hits, misses, evictions
+        self.counters = torch.zeros(4, dtype=torch.int64).share_memory_()
+        self.lock = mp.Lock()
+
+    def _pages(self, idx : int) -> list:
+        pages = []
+        page = int(self.first_page[idx])
+        while page >= 0:
+            pages.append(page)
+            page = int(self.next_page[page])
+
+        return pages
+
+    def _touch(self, idx : int):
+        self.counters[0] += 1
+        self.last_used[idx] = self.counters[0]
+
+    def _evict(self, idx : int):
+        pages = self._pages(idx)
+        self.page_used[pages] = False
+        self.next_page[pages] = -1
+        self.cached[idx] = False
+        self.first_page[idx] = -1
+        self.counters[3] += 1
+
+    def get(self, idx : int) -> tuple[torch.tensor, torch.tensor, torch.tensor]:
+        """Get a cached sample.
+
+        Returns:
+            (torch.tensor, torch.tensor, torch.tensor): A copy of the tokens, type ids and
+                rating of the sample, or None if it isn't cached.
+        """
+        with self.lock:
+            if not self.cached[idx]:
+                self.counters[2] += 1
+                return None
+
+            self.counters[1] += 1
+            self._touch(idx)
+
+            # copy while holding the lock, the pages could be reused right after
+            pages = torch.tensor(self._pages(idx), dtype=torch.int64)
+            length = int(self.lengths[idx])
+            tokens = self.tokens[pages].reshape(-1, TOKEN_DIM)[:length].clone()
+            type_ids = self.type_ids[pages].reshape(-1)[:length].clone()
+
+            return tokens, type_ids, self.ratings[idx].clone()
+
+    def put(self, idx : int, tokens : torch.tensor, type_ids : torch.tensor, rating : torch.tensor):
+        """Cache a sample, evicting the least recently used samples if needed. Samples
+        larger than the whole arena are not cached.
+        """
+        needed = math.ceil(len(tokens) / self.page_tokens)
+        if needed > self.num_pages:
+            return
+
+        with self.lock:
+            if self.cached[idx]:
+                return
+
+            free = self.num_pages - int(self.page_used.sum())
+            while free < needed:
+                last_used = torch.where(self.cached, self.last_used, torch.iinfo(torch.int64).max)
+                victim = int(torch.argmin(last_used))
+                free += len(self._pages(victim))
+                self._evict(victim)
+
+            pages = torch.nonzero(~self.page_used).flatten()[:needed]
+            self.page_used[pages] = True
+            self.next_page[pages[:-1]] = pages[1:]
+
+            for i, page in enumerate(pages.tolist()):
+                chunk = slice(i * self.page_tokens, (i + 1) * self.page_tokens)
+                self.tokens[page, :len(tokens[chunk])] = tokens[chunk]
+                self.type_ids[page, :len(type_ids[chunk])] = type_ids[chunk]
+
+            self.first_page[idx] = pages[0] if needed > 0 else -1
+            self.lengths[idx] = len(tokens)
+            self.ratings[idx] = rating
+            self.cached[idx] = True
+            self._touch(idx)
+
+    def stats(self) -> dict:
+        """The number of hits, misses and evictions, the hit rate and the number of cached
+        samples and bytes used, over all the processes.
+        """
+        with self.lock:
+            hits, misses, evictions = self.counters[1:].tolist()
+            return {
+                "hits" :        hits,
+                "misses" :      misses,
+                "evictions" :   evictions,
+                "hit_rate" :    hits / (hits + misses) if hits + misses > 0 else 0.0,
+                "samples" :     int(self.cached.sum()),
+                "bytes" :       int(self.page_used.sum()) * self.page_bytes
+            }
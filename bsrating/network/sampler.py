@@ -0,0 +1,150 @@
+import math
+
+import numpy as np
+from torch.utils.data import Sampler
+
+def padding_efficiency(lengths, batches : list) -> float:
+    """The fraction of real (non-padding) tokens in a list of batches padded to their longest sample.
+
+    Args:
+        lengths (np.ndarray): The length of every sample.
+        batches (list): The batches, as lists of sample indices.
+
+    Returns:
+        float: Real tokens / padded tokens, 1.0 meaning no padding at all.
+    """
+    lengths = np.asarray(lengths)
+    real = sum(int(lengths[batch].sum()) for batch in batches)
+    padded = sum(len(batch) * int(lengths[batch].max()) for batch in batches)
+
+    return real / padded if padded > 0 else 1.0
+
+class LengthBucketSampler(Sampler):
+    """Batch sampler that groups samples of similar length, so that little compute is spent
+    on padding. Samples are assigned to buckets of geometrically growing length (every bucket
+    spans lengths up to `bucket_ratio` times its lower bound), shuffled inside their bucket,
+    and split into batches. The order of the batches is shuffled as well.
+
+    Batches either have a fixed `batch_size`, or as many samples as fit in `max_tokens` once
+    padded (samples longer than `max_tokens` get a batch of their own).
+
+    ```code
+    sampler = LengthBucketSampler(dataset.lengths(), max_tokens=16384)
+    dataloader = DataLoader(dataset, batch_sampler=sampler, collate_fn=collate_fn)
+    for epoch in range(epochs):
+        sampler.set_epoch(epoch)
+        ...
+    ```
+
+    Args:
+        lengths (np.ndarray): The length (number of tokens) of every sample.
+        max_tokens (int, optional): Maximum number of tokens per batch, including padding. Defaults to None.
+        batch_size (int, optional): Number of samples per batch, if `max_tokens` isn't given. Defaults to None.
+        bucket_ratio (float, optional): Ratio between the longest and shortest lengths of a bucket. Defaults to 1.25.
+        shuffle (bool, optional): Whether to shuffle the samples inside the buckets and the batches. Defaults to True.
+        seed (int, optional): The seed of the shuffling, combined with the epoch. Defaults to 0.
+        drop_last (bool, optional): Whether to drop the last incomplete batch of every bucket, when using
+        `batch_size`. Defaults to False.
+    """
+
+    def __init__(self, lengths, max_tokens : int = None, batch_size : int = None, bucket_ratio : float = 1.25,
+                 shuffle : bool = True, seed : int = 0, drop_last : bool = False):
+        if (max_tokens is None) == (batch_size is None):
+            raise ValueError("Exactly one of max_tokens and batch_size must be given")
+        if bucket_ratio <= 1.0:
+            raise ValueError(f"bucket_ratio must be greater than 1, got {bucket_ratio}")
+
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.max_tokens = max_tokens
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.drop_last = drop_last
+
+        bucket_ids = np.floor(np.log(np.maximum(self.lengths, 1)) / math.log(bucket_ratio)).astype(np.int64)
+        self.buckets = [ np.flatnonzero(bucket_ids == b) for b in np.unique(bucket_ids) ]
+
+        self.epoch = 0
+        self._batches = None
+
+    def set_epoch(self, epoch : int):
+        """Set the epoch, so that every epoch is shuffled differently (but reproducibly)."""
+
+        self.epoch = epoch
+        self._batches = None
+
+    def _split(self, indices : np.ndarray) -> list:
+        if self.batch_size is not None:
+            batches = [ indices[i:i + self.batch_size] for i in range(0, len(indices), self.batch_size) ]
+            if self.drop_last and len(batches) > 0 and len(batches[-1]) < self.batch_size:
+                batches.pop()
+
+            return batches
+
+        batches = []
+        batch, longest = [], 0
+        for idx in indices:
+            length = int(self.lengths[idx])
+            if len(batch) > 0 and max(longest, length) * (len(batch) + 1) > self.max_tokens:
+                batches.append(batch)
+                batch, longest = [], 0
+
+            batch.append(idx)
+            longest = max(longest, length)
+
+        if len(batch) > 0:
+            batches.append(batch)
+
+        return batches
+
+    def batches(self) -> list:
+        """The batches of the current epoch, as lists of sample indices."""
+
+        if self._batches is None:
+            rng = np.random.default_rng((self.seed, self.epoch))
+
+            batches = []
+            for bucket in self.buckets:
+                if self.shuffle:
+                    bucket = rng.permutation(bucket)
+                batches += self._split(bucket)
+
+            if self.shuffle:
+                batches = [ batches[i] for i in rng.permutation(len(batches)) ]
+
+            self._batches = [ np.asarray(batch).tolist() for batch in batches ]
+
+        return self._batches
+
+    def efficiency(self) -> float:
+        """The padding efficiency of the batches of the current epoch (see `padding_efficiency`)."""
+
+        return padding_efficiency(self.lengths, self.batches())
+
+    def __iter__(self):
+        yield from self.batches()
+
+    def __len__(self):
+        return len(self.batches())
+
+class SkipBatchSampler(Sampler):
+    """Wraps a batch sampler so that the next epoch can start after its first `skip` batches,
+    e.g. to resume training in the middle of an epoch. The skipped batches are never loaded.
+    The skip only applies to the next iteration.
+
+    Args:
+        batch_sampler (Sampler): The batch sampler to wrap.
+    """
+
+    def __init__(self, batch_sampler : Sampler):
+        self.batch_sampler = batch_sampler
+        self.skip = 0
+
+    def __iter__(self):
+        skip, self.skip = self.skip, 0
+        for i, batch in enumerate(self.batch_sampler):
+            if i >= skip:
+                yield batch
+
+    def __len__(self):
+        return len(self.batch_sampler)
@@ -0,0 +1,289 @@
+import json
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+import torch
+
+from bsrating.leveldata.parsing import process_map_folder
+from bsrating.network.map_dataset import collate_fn
+from bsrating.network.nn import RatingPredictorNN, stored_config
+from bsrating.network.tokenizer import TOKEN_DIM, tokenize_beatmap, tokenize_processed
+
+def load_model(path : str, device : torch.device = None, model_dim : int = 512, notes_per_token : int = None,
+               positional : str = None) -> RatingPredictorNN:
+    """Build a `RatingPredictorNN` with the configuration saved with its trained parameters, load
+    them and put it in evaluation mode.
+
+    Args:
+        path (str): The path to the model parameters (as saved by `train_maps.py`).
+        device (torch.device, optional): The device of the model. Defaults to the CPU.
+        model_dim (int, optional): The dimension of the model. Defaults to 512.
+        notes_per_token (int, optional): The number of elements per token, for parameters saved
+        without their configuration. Defaults to the saved one, or 1.
+        positional (str, optional): The positional encoding, "time" or "index", for parameters saved
+        without their configuration. Defaults to the saved one, or "time".
+
+    Raises:
+        RuntimeError: If `notes_per_token` or `positional` are given but don't match the saved configuration.
+    """
+    device = device or torch.device("cpu")
+    state_dict = torch.load(path, map_location=device, weights_only=True)
+
+    saved_notes_per_token, saved_positional = stored_config(state_dict) or (1, "time")
+    model = RatingPredictorNN(
+        token_dim=TOKEN_DIM,
+        model_dim=model_dim,
+        heads=4,
+        attn_layers=2,
+        notes_per_token=notes_per_token or saved_notes_per_token,
+        positional=positional or saved_positional)
+    model.load_state_dict(state_dict)
+
+    return model.to(device).eval()
+
+def load_request_maps(request : dict) -> dict:
+    """Tokenize the maps of a rating request. A request has either a "map_folder" (every
+    Standard difficulty is rated, except the ones without any element, e.g. lightshows), a
+    "processed" map file, or the processed map "data" inline.
+
+    Raises:
+        ValueError: If the request has no map, or if a single map has no elements to rate.
+
+    Returns:
+        dict: The tokens and type ids of every map, by name (the difficulty for map folders).
+    """
+    if "map_folder" in request:
+        beatmaps = process_map_folder(request["map_folder"])
+        maps = { diff : tokenize_beatmap(bm) for diff, bm in beatmaps.items() }
+        maps = { diff : (tokens, type_ids) for diff, (tokens, type_ids) in maps.items() if len(tokens) > 0 }
+        if len(maps) == 0:
+            raise ValueError(f"{request['map_folder']} has no difficulty with elements to rate")
+        return maps
+
+    if "processed" in request:
+        with open(request["processed"]) as fp:
+            maps = { "map" : tokenize_processed(json.load(fp)["data"]) }
+    elif "data" in request:
+        maps = { "map" : tokenize_processed(request["data"]) }
+    else:
+        raise ValueError("The request needs a 'map_folder', 'processed' or 'data' field")
+
+    if len(maps["map"][0]) == 0:
+        raise ValueError("The map has no elements to rate")
+    return maps
+
+class _PendingMap:
+
+    def __init__(self, tokens : np.ndarray, type_ids : np.ndarray):
+        self.tokens = torch.from_numpy(tokens)
+        self.type_ids = torch.from_numpy(type_ids)
+        self.future = Future()
+        self.submitted = time.perf_counter()
+
+class DynamicBatcher:
+    """Rates maps submitted from any thread, grouping the ones that arrive close together into
+    batches. A background thread waits up to `max_wait` seconds after the first pending map for
+    others to arrive, sorts the pending maps by length, and splits them into batches of at most
+    `max_batch_size` maps and `max_tokens` padded transformer tokens (a map of `n` elements is
+    `ceil(n / notes_per_token)` tokens long), so that similar lengths share a batch.
+
+    Args:
+        model (RatingPredictorNN): The model, in evaluation mode.
+        device (torch.device, optional): The device of the model. Defaults to the CPU.
+        max_batch_size (int, optional): Maximum number of maps per batch. Defaults to 16.
+        max_tokens (int, optional): Maximum number of transformer tokens per batch, including padding. Defaults to 65536.
+        max_wait (float, optional): Maximum time to wait for a batch to fill up, in seconds. Defaults to 0.01.
+        bf16 (bool, optional): Run the model under bfloat16 autocast. Defaults to False.
+    """
+
+    def __init__(self, model : RatingPredictorNN, device : torch.device = None, max_batch_size : int = 16,
+                 max_tokens : int = 1 << 16, max_wait : float = 0.01, bf16 : bool = False):
+        self.model = model
+        self.device = device or torch.device("cpu")
+        self.max_batch_size = max_batch_size
+        self.max_tokens = max_tokens
+        self.max_wait = max_wait
+        self.bf16 = bf16
+        self.notes_per_token = model.notes_per_token
+
+        self.batches = 0
+        self.maps = 0
+
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, tokens : np.ndarray, type_ids : np.ndarray) -> Future:
+        """Queue a tokenized map. The future resolves to a dict with the "rating", the time
+        spent waiting for a batch ("queue_ms"), the time of the batch ("inference_ms") and the
+        "batch_size".
+
+        Raises:
+            ValueError: If the map has no elements, there is nothing to rate.
+        """
+        if len(tokens) == 0:
+            raise ValueError("The map has no elements to rate")
+
+        pending = _PendingMap(tokens, type_ids)
+        self._queue.put(pending)
+
+        return pending.future
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self) -> list:
+        first = self._queue.get()
+        if first is None:
+            return None
+
+        pending = [ first ]
+        deadline = time.perf_counter() + self.max_wait
+        while True:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+
+            if item is None:
+                # finish the pending maps before stopping
+                self._queue.put(None)
+                break
+            pending.append(item)
+
+        return pending
+
+    def _split(self, pending : list) -> list:
+        pending = sorted(pending, key=lambda p : len(p.tokens))
+
+        batches = []
+        batch = []
+        for p in pending:
+            # sorted by length, so the new map is the longest one of the batch
+            padded = -(-len(p.tokens) // self.notes_per_token) * (len(batch) + 1)
+            if len(batch) > 0 and (len(batch) >= self.max_batch_size or padded > self.max_tokens):
+                batches.append(batch)
+                batch = []
+
+            batch.append(p)
+
+        if len(batch) > 0:
+            batches.append(batch)
+
+        return batches
+
+    def _run(self):
+        while True:
+            pending = self._collect()
+            if pending is None:
+                return
+
+            for batch in self._split(pending):
+                self._run_batch(batch)
+
+    def _run_batch(self, batch : list):
+        start = time.perf_counter()
+        try:
+            tokens, type_ids, _, padding_mask = collate_fn([ (p.tokens, p.type_ids, torch.tensor(0.0)) for p in batch ])
+            with torch.inference_mode(), torch.autocast(device_type=self.device.type, dtype=torch.bfloat16, enabled=self.bf16):
+                ratings = self.model(tokens.to(self.device), type_ids.to(self.device), padding_mask.to(self.device))
+            ratings = ratings.float().cpu().tolist()
+        except Exception as e:
+            for p in batch:
+                p.future.set_exception(e)
+            return
+
+        end = time.perf_counter()
+        self.batches += 1
+        self.maps += len(batch)
+        for p, rating in zip(batch, ratings):
+            p.future.set_result({
+                "rating" :          rating,
+                "queue_ms" :        (start - p.submitted) * 1000,
+                "inference_ms" :    (end - start) * 1000,
+                "batch_size" :      len(batch)
+            })
+
+class RatingService:
+    """Handles rating requests (see `load_request_maps`) on top of a `DynamicBatcher`, and keeps
+    latency statistics. `handle` can be called from many threads at once, which is what allows
+    the maps of concurrent requests to share batches.
+
+    Args:
+        batcher (DynamicBatcher): The batcher used to rate the maps.
+        window (int, optional): The number of recent requests used for the latency percentiles. Defaults to 10000.
+    """
+
+    def __init__(self, batcher : DynamicBatcher, window : int = 10000):
+        self.batcher = batcher
+        self.latencies = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def handle(self, request : dict) -> dict:
+        """Rate the maps of a request.
+
+        Returns:
+            dict: The request "id", the "ratings" by map name and the "latency_ms" of the request
+                (total, loading, and the slowest map's queue and inference times), or the "error".
+        """
+        if request.get("cmd") == "stats":
+            return { "id" : request.get("id"), "stats" : self.stats() }
+
+        start = time.perf_counter()
+        try:
+            maps = load_request_maps(request)
+            loaded = time.perf_counter()
+
+            futures = { name : self.batcher.submit(tokens, type_ids) for name, (tokens, type_ids) in maps.items() }
+            results = { name : future.result() for name, future in futures.items() }
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            return { "id" : request.get("id"), "error" : repr(e) }
+
+        total = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.requests += 1
+            self.latencies.append(total)
+
+        return {
+            "id" :          request.get("id"),
+            "ratings" :     { name : r["rating"] for name, r in results.items() },
+            "latency_ms" :  {
+                "total" :       total,
+                "load" :        (loaded - start) * 1000,
+                "queue" :       max((r["queue_ms"] for r in results.values()), default=0.0),
+                "inference" :   max((r["inference_ms"] for r in results.values()), default=0.0)
+            },
+            "batch_sizes" : { name : r["batch_size"] for name, r in results.items() }
+        }
+
+    def stats(self) -> dict:
+        """The number of requests served and failed, the latency percentiles of the recent ones,
+        and the average batch size.
+        """
+        with self._lock:
+            latencies = np.array(self.latencies)
+            requests, errors = self.requests, self.errors
+
+        stats = {
+            "requests" :    requests,
+            "errors" :      errors,
+            "batches" :     self.batcher.batches,
+            "mean_batch" :  self.batcher.maps / max(self.batcher.batches, 1)
+        }
+        if len(latencies) > 0:
+            for p in (50, 90, 99):
+                stats[f"p{p}_ms"] = float(np.percentile(latencies, p))
+
+        return stats
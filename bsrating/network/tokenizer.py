@@ -0,0 +1,100 @@
+import numpy as np
+
+from bsrating.game.beatmap import BeatMap
+from bsrating.game.element import ElementType
+
+# number of features of each token
+TOKEN_DIM = 10
+
+# angle of every cut direction, as in `ColorNote.note_angle`
+CUT_DIRECTION_ANGLES = np.array([
+    0,                      # 0: up
+    np.pi,                  # 1: down
+    -np.pi / 2.0,           # 2: left
+    np.pi / 2.0,            # 3: right
+    -np.pi / 4.0,           # 4: up left
+    np.pi / 4.0,            # 5: up right
+    -3.0 * np.pi / 4.0,     # 6: down left
+    3.0 * np.pi / 4.0,      # 7: down right
+    0                       # 8: any
+], dtype=np.float64)
+
+# keys of the processed form of each token feature, and their default value
+TOKEN_FIELDS = [
+    ("type",        0),
+    ("time",        0),
+    ("x",           0),
+    ("y",           0),
+    ("angle",       0),
+    ("any_dir",     False),
+    ("width",       0),
+    ("height",      0),
+    ("duration",    0),
+    ("njs",         0),
+]
+
+def tokenize_processed(data : list) -> tuple[np.ndarray, np.ndarray]:
+    """Convert a processed map (the list of elements returned by `BeatMap.to_dict`)
+    into its token features and type ids.
+
+    Args:
+        data (list): The processed map.
+
+    Returns:
+        (np.ndarray, np.ndarray): The token features (float32, `[seq_len, TOKEN_DIM]`) and
+            the type ids (int64, `[seq_len]`)
+    """
+    tokens = np.empty((len(data), TOKEN_DIM), dtype=np.float32)
+    for i, (key, default) in enumerate(TOKEN_FIELDS):
+        tokens[:, i] = np.fromiter((tok.get(key, default) for tok in data), dtype=np.float64, count=len(data))
+
+    type_ids = np.fromiter((tok.get("type", 0) for tok in data), dtype=np.int64, count=len(data))
+
+    return tokens, type_ids
+
+def tokenize_elements(elements : np.ndarray, times : np.ndarray, njs : np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Convert map elements, as a structured array (see `ELEMENT_DTYPE`), into their token
+    features and type ids. The result is the same as tokenizing their processed form.
+
+    Args:
+        elements (np.ndarray): The elements.
+        times (np.ndarray): The time of every element, in seconds.
+        njs (np.ndarray): The NJS at every element.
+
+    Returns:
+        (np.ndarray, np.ndarray): The token features (float32, `[seq_len, TOKEN_DIM]`) and
+            the type ids (int64, `[seq_len]`)
+    """
+    types = elements["type"].astype(np.int64)
+    is_note = (types == ElementType.ColorNoteRed) | (types == ElementType.ColorNoteBlue)
+    is_obstacle = types == ElementType.Obstacle
+
+    # same operations as `ColorNote.note_angle`, so that the values match exactly
+    cut_dir = elements["cut_dir"].astype(np.int64)
+    angles = CUT_DIRECTION_ANGLES[np.where(is_note, cut_dir, 0)] - np.deg2rad(elements["angle_offset"].astype(np.float64))
+    angles = ((angles + 180.0) % 360.0) - 180.0
+
+    tokens = np.zeros((len(elements), TOKEN_DIM), dtype=np.float32)
+    tokens[:, 0] = types
+    tokens[:, 1] = times
+    tokens[:, 2] = elements["x"]
+    tokens[:, 3] = elements["y"]
+    tokens[:, 4] = np.where(is_note, angles, 0)
+    tokens[:, 5] = is_note & (cut_dir == 8)
+    tokens[:, 6] = np.where(is_obstacle, elements["width"], 0)
+    tokens[:, 7] = np.where(is_obstacle, elements["height"], 0)
+    tokens[:, 8] = np.where(is_obstacle, elements["duration"], 0)
+    tokens[:, 9] = njs
+
+    return tokens, types
+
+def tokenize_beatmap(beatmap : BeatMap) -> tuple[np.ndarray, np.ndarray]:
+    """Convert a beatmap straight into its token features and type ids, without going
+    through its processed form (see `tokenize_elements`).
+    """
+    elements = beatmap.element_array()
+
+    return tokenize_elements(
+        elements,
+        beatmap.timing.beat_to_time(elements["beat"]),
+        beatmap.timing.njs_at(elements["beat"]))
@@ -1,2 +1,4 @@
 from .difficulty import *
-from .strings import *
\ No newline at end of file
+from .strings import *
+from .jsonstream import *
+from .parallel import *
\ No newline at end of file
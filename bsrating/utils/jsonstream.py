@@ -0,0 +1,183 @@
+import json
+import re
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_STRUCTURE = re.compile(r'["\[\]{}]')
+_STRING_END = re.compile(r'["\\]')
+_NUMBER_TAIL = re.compile(r"[0-9.eE+\-]*")
+
+class JSONStreamValue:
+    """A value of the top-level object that hasn't been read yet. It can be loaded
+    completely with `load`, or element by element with `iter` if it is an array. If it
+    isn't used at all, it is skipped without being decoded.
+    """
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.consumed = False
+
+    def load(self):
+        self.consumed = True
+        return self.reader._decode()
+
+    def iter(self):
+        """Iterate over the elements of an array, decoding one element at a time."""
+        self.consumed = True
+        reader = self.reader
+        reader._expect("[")
+
+        if reader._peek() == "]":
+            reader._advance()
+            return
+
+        while True:
+            yield reader._decode()
+
+            c = reader._peek()
+            reader._advance()
+            if c == "]":
+                return
+            elif c != ",":
+                raise json.JSONDecodeError("Expecting ',' delimiter", reader.buf, reader.pos - 1)
+
+class JSONStreamReader:
+    """Incremental reader for a JSON document whose root is an object. Only one chunk of
+    the file (plus the element being decoded) is kept in memory at any time, so huge arrays
+    can be processed or skipped with bounded memory usage.
+
+    ```code
+    with open(path, encoding='utf-8') as fp:
+        for key, value in JSONStreamReader(fp).items():
+            if key == "_notes":
+                for note in value.iter():
+                    ...
+    ```
+
+    Args:
+        fp (TextIO): The file to read from.
+        chunk_size (int, optional): The amount of characters read at once. Defaults to 64K.
+    """
+
+    def __init__(self, fp, chunk_size : int = 1 << 16):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def items(self):
+        """Iterate over the (key, value) pairs of the root object. Values are
+        `JSONStreamValue` objects, which are skipped if they aren't used before
+        moving on to the next pair.
+        """
+        self._expect("{")
+        if self._peek() == "}":
+            self._advance()
+            return
+
+        while True:
+            key = self._decode()
+            self._expect(":")
+
+            value = JSONStreamValue(self)
+            yield key, value
+            if not value.consumed:
+                self._skip()
+
+            c = self._peek()
+            self._advance()
+            if c == "}":
+                return
+            elif c != ",":
+                raise json.JSONDecodeError("Expecting ',' delimiter", self.buf, self.pos - 1)
+
+    def _fill(self, size : int = None) -> bool:
+        # drop the data already consumed and append a new chunk
+        if self.eof:
+            return False
+
+        chunk = self.fp.read(size or self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def _peek(self) -> str:
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                raise json.JSONDecodeError("Unexpected end of file", self.buf, self.pos)
+
+    def _advance(self):
+        self.pos += 1
+
+    def _expect(self, c : str):
+        if self._peek() != c:
+            raise json.JSONDecodeError(f"Expecting '{c}'", self.buf, self.pos)
+        self._advance()
+
+    def _decode(self):
+        self._peek()
+        size = self.chunk_size
+        while True:
+            try:
+                obj, end = _DECODER.raw_decode(self.buf, self.pos)
+
+                # a number that runs up to the end of the buffer might continue in the next
+                # chunk, even if a prefix of it (like "123" of "123.4") already decodes
+                if self.eof or _NUMBER_TAIL.match(self.buf, end).end() < len(self.buf):
+                    self.pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+
+            # the value is incomplete, read more data (growing the reads for large values)
+            self._fill(size)
+            size *= 2
+
+    def _skip(self):
+        # skip a value without decoding it, keeping track of the nesting level
+        c = self._peek()
+        if c not in "[{\"":
+            self._decode()
+            return
+
+        depth = 0
+        in_string = False
+        while True:
+            pattern = _STRING_END if in_string else _STRUCTURE
+            m = pattern.search(self.buf, self.pos)
+            if m is None:
+                self.pos = len(self.buf)
+                if not self._fill():
+                    raise json.JSONDecodeError("Unexpected end of file", self.buf, self.pos)
+                continue
+
+            c = m.group()
+            if c == "\\":
+                # skip the escaped character, which might be in the next chunk
+                if m.end() >= len(self.buf):
+                    self.pos = m.start()
+                    if not self._fill():
+                        raise json.JSONDecodeError("Unexpected end of file", self.buf, self.pos)
+                    continue
+                self.pos = m.end() + 1
+                continue
+
+            self.pos = m.end()
+            if c == "\"":
+                in_string = not in_string
+            elif c in "[{":
+                depth += 1
+            else:
+                depth -= 1
+
+            if depth == 0 and not in_string:
+                return
@@ -0,0 +1,50 @@
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+def process_chunks(fn, items : list, *args, workers : int = 1, chunk_size : int = 16,
+                   progress = None, on_error = None) -> list:
+    """Split a list of items into chunks and call `fn(chunk, *args)` on each of them, either in
+    the current process or in a pool of worker processes, and concatenate the lists of results it
+    returns (in the order the chunks finish).
+
+    `fn` is expected to catch the errors of each item and report them in its results. If a whole
+    chunk fails anyway (e.g. a worker process died), `on_error(chunk, error, traceback)` gives the
+    results of its items, so that the other chunks are still collected.
+
+    Args:
+        fn (callable): The function processing a chunk, which must be picklable to run in workers.
+        items (list): The items to process.
+        workers (int, optional): The number of worker processes. If it is 1 or less, everything is
+        processed in the current process. Defaults to 1.
+        chunk_size (int, optional): The number of items sent to a worker at once. Defaults to 16.
+        progress (optional): A progress bar (e.g. tqdm) updated after each chunk. Defaults to None.
+        on_error (callable, optional): Gives the results of a failed chunk. Defaults to None
+        (the error is raised).
+
+    Returns:
+        list: The results of every chunk.
+    """
+    chunks = [ items[i:i + chunk_size] for i in range(0, len(items), chunk_size) ]
+    results = []
+
+    def collect(chunk, run):
+        try:
+            results.extend(run())
+        except Exception as e:
+            if on_error is None:
+                raise
+            results.extend(on_error(chunk, repr(e), traceback.format_exc()))
+
+        if progress is not None:
+            progress.update(len(chunk))
+
+    if workers <= 1:
+        for chunk in chunks:
+            collect(chunk, lambda : fn(chunk, *args))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = { pool.submit(fn, chunk, *args) : chunk for chunk in chunks }
+            for future in as_completed(futures):
+                collect(futures[future], future.result)
+
+    return results
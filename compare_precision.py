@@ -0,0 +1,144 @@
+import argparse
+import json
+import os, time
+from itertools import cycle, islice
+from tqdm import tqdm
+from bsrating.network.map_dataset import MapDataset, collate_fn
+from bsrating.network.packed_dataset import PackedMapDataset
+from bsrating.network.nn import RatingPredictorNN
+
+from dotenv import load_dotenv
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torch.utils.data import DataLoader
+
+def make_model(args) -> RatingPredictorNN:
+    # same initialization for every run
+    torch.manual_seed(args.seed)
+
+    return RatingPredictorNN(
+        token_dim=10,
+        model_dim=args.model_dim,
+        heads=4,
+        attn_layers=2,
+        notes_per_token=args.notes_per_token,
+        positional=args.positional)
+
+def train_run(model : RatingPredictorNN, batches : list, steps : int, bf16 : bool, lr : float) -> dict:
+    """Train the model for some steps over the batches, measuring the loss and throughput."""
+
+    criterion = nn.MSELoss()
+    optimizer = optim.Adam(model.parameters(), lr=lr)
+    model.train()
+
+    losses = []
+    tokens_seen = 0
+    start = time.perf_counter()
+    for tokens, type_id, rating, padding_mask in tqdm(islice(cycle(batches), steps), total=steps, leave=False,
+                                                       desc="bf16" if bf16 else "fp32"):
+        optimizer.zero_grad()
+        with torch.autocast(device_type="cpu", dtype=torch.bfloat16, enabled=bf16):
+            mu = model(tokens, type_id, padding_mask)
+
+        loss = criterion(mu, rating)
+        loss.backward()
+        optimizer.step()
+
+        losses.append(loss.item())
+        tokens_seen += int((~padding_mask).sum())
+
+    elapsed = time.perf_counter() - start
+    return {
+        "losses" :         losses,
+        "final_loss" :     float(np.mean(losses[-len(batches):])),
+        "seconds" :        elapsed,
+        "tokens_per_s" :   tokens_seen / elapsed
+    }
+
+def inference_run(model : RatingPredictorNN, batches : list, bf16 : bool) -> dict:
+    """Predict the rating of every batch, measuring the throughput."""
+
+    model.eval()
+    predictions = []
+    tokens_seen = 0
+    start = time.perf_counter()
+    with torch.inference_mode(), torch.autocast(device_type="cpu", dtype=torch.bfloat16, enabled=bf16):
+        for tokens, type_id, _, padding_mask in batches:
+            predictions.append(model(tokens, type_id, padding_mask).float())
+            tokens_seen += int((~padding_mask).sum())
+
+    elapsed = time.perf_counter() - start
+    return {
+        "predictions" :    torch.cat(predictions),
+        "seconds" :        elapsed,
+        "tokens_per_s" :   tokens_seen / elapsed
+    }
+
+def main(args):
+    # 1. load a fixed set of batches, so that both runs see exactly the same data
+    if args.packed:
+        dataset = PackedMapDataset(args.dataset)
+    else:
+        filepaths = sorted(os.path.join(args.dataset, fname) for fname in os.listdir(args.dataset) if fname.endswith(".json"))
+        dataset = MapDataset(filepaths)
+
+    dataloader = DataLoader(dataset, batch_size=args.batch_size, collate_fn=collate_fn)
+    batches = list(islice(dataloader, args.batches))
+    print(f"{len(batches)} batches, {sum(int((~b[3]).sum()) for b in batches)} tokens")
+
+    # 2. train from the same initialization in both precisions
+    report = { "train" : {}, "inference" : {} }
+    models = {}
+    for name, bf16 in (("fp32", False), ("bf16", True)):
+        models[name] = make_model(args)
+        report["train"][name] = train_run(models[name], batches, args.steps, bf16, args.lr)
+
+    # 3. inference with the float32-trained weights in both precisions
+    for name, bf16 in (("fp32", False), ("bf16", True)):
+        # warm up, the first calls are slower
+        inference_run(models["fp32"], batches[:1], bf16)
+        report["inference"][name] = inference_run(models["fp32"], batches, bf16)
+
+    fp32_train, bf16_train = report["train"]["fp32"], report["train"]["bf16"]
+    fp32_inf, bf16_inf = report["inference"]["fp32"], report["inference"]["bf16"]
+    difference = (bf16_inf["predictions"] - fp32_inf["predictions"]).abs()
+
+    print()
+    print(f"{'':>22}{'fp32':>14}{'bf16':>14}{'ratio':>10}")
+    print(f"{'train loss (last pass)':>22}{fp32_train['final_loss']:>14.4f}{bf16_train['final_loss']:>14.4f}"
+          f"{bf16_train['final_loss'] / fp32_train['final_loss']:>10.3f}")
+    print(f"{'train tokens/s':>22}{fp32_train['tokens_per_s']:>14.0f}{bf16_train['tokens_per_s']:>14.0f}"
+          f"{bf16_train['tokens_per_s'] / fp32_train['tokens_per_s']:>10.2f}x")
+    print(f"{'inference tokens/s':>22}{fp32_inf['tokens_per_s']:>14.0f}{bf16_inf['tokens_per_s']:>14.0f}"
+          f"{bf16_inf['tokens_per_s'] / fp32_inf['tokens_per_s']:>10.2f}x")
+    print(f"bf16 vs fp32 predictions: max abs diff {difference.max().item():.4f}, mean abs diff {difference.mean().item():.4f}")
+
+    if args.output is not None:
+        for inf in report["inference"].values():
+            inf["predictions"] = inf["predictions"].tolist()
+        report["prediction_max_abs_diff"] = difference.max().item()
+        report["prediction_mean_abs_diff"] = difference.mean().item()
+
+        with open(args.output, 'w') as out:
+            json.dump(report, out, indent=2)
+
+if __name__ == '__main__':
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Compare the loss and throughput of float32 and bfloat16 mixed precision on CPU")
+
+    parser.add_argument("dataset", help="The folder containing the maps")
+    parser.add_argument("--packed", action="store_true", help="The dataset folder contains a packed dataset (see load_maps.py --pack)")
+    parser.add_argument("--batches", type=int, default=16, help="The number of batches used for the comparison")
+    parser.add_argument("--batch_size", type=int, default=2, help="The number of maps per batch")
+    parser.add_argument("--steps", type=int, default=64, help="The number of training steps in each precision")
+    parser.add_argument("--lr", type=float, default=1e-4, help="The learning rate")
+    parser.add_argument("--seed", type=int, default=0, help="The seed of the model initialization")
+    parser.add_argument("--model_dim", type=int, default=512, help="The dimension of the model")
+    parser.add_argument("--positional", choices=["time", "index"], default="time", help="Encode the position of the tokens from their time or their index")
+    parser.add_argument("--notes_per_token", type=int, default=1, help="The number of consecutive elements packed into each transformer token")
+    parser.add_argument("--output", help="Write the full report (losses and predictions) to this .json file")
+    main(parser.parse_args())
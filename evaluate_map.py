@@ -1,14 +1,14 @@
 import argparse 
 import json
-from matplotlib import pyplot as plt
 import requests
 import os, time
 from pprint import pprint
 from tqdm import tqdm, trange
 from bsrating.leveldata import *
 from bsrating.leveldata.parsing import process_map_folder
-from bsrating.network.map_dataset import MapDataset, collate_fn
-from bsrating.network.nn import RatingPredictorNN
+from bsrating.network.map_dataset import collate_fn
+from bsrating.network.tokenizer import tokenize_beatmap
+from bsrating.network.inference import load_predictor
 from bsrating.utils import *
 
 from dotenv import load_dotenv
@@ -32,28 +32,25 @@ def main(args):
     print("Using device:", device)
 
     # 1. load map
-    beatmaps = process_map_folder(args.map_folder)
+    beatmaps = process_map_folder(args.map_folder, executor=args.executor, max_workers=args.workers)
 
     paths = []
+    samples = []
     for diff, bm in beatmaps.items():
         output_path = os.path.join(args.output, f"{diff}.json")
         with open(output_path, 'w') as out:
             json.dump({"data": bm.to_dict(), "rating": 0}, out)
 
+        # tokenize the beatmap directly, instead of reading the processed file back
+        tokens, type_ids = tokenize_beatmap(bm)
+        samples.append((torch.from_numpy(tokens), torch.from_numpy(type_ids), torch.tensor(0.0)))
         paths.append(output_path)
     print(paths)
 
     # 2. eval beatmaps
-    # TODO load just the model, don't load a checkpoint
-    model = RatingPredictorNN(
-        token_dim=10,
-        model_dim=512,
-        heads=4,
-        attn_layers=2)
-    model = model.load_state_dict(torch.load(args.model, weights_only=True))
+    model = load_predictor(args.model, device, notes_per_token=args.notes_per_token, positional=args.positional)
 
-    dataset = MapDataset(paths)
-    dataloader = DataLoader(dataset, batch_size=1, collate_fn=collate_fn)
+    dataloader = DataLoader(samples, batch_size=1, collate_fn=collate_fn)
 
     predicted_ratings = []
     map_names = []
@@ -65,16 +62,23 @@ def main(args):
             type_ids = type_ids.to(device)
             padding_mask = padding_mask.to(device)
 
-            rating = model(tokens, type_ids, padding_mask)
+            with torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=args.bf16):
+                rating = model(tokens, type_ids, padding_mask)
             
             predicted_ratings.append(rating.item())
             map_names.append(os.path.basename(path))
 
+    print(json.dumps(dict(zip(beatmaps.keys(), predicted_ratings)), indent=2))
+    if args.no_plot:
+        return
+
+    from matplotlib import pyplot as plt
+
     x = np.arange(len(predicted_ratings))
     ratings = np.array(predicted_ratings)
 
     plt.figure(figsize=(10, 5))
-    plt.plot(x, ratings, fmt='o', ecolor='gray', capsize=5, label="Prediction")
+    plt.plot(x, ratings, 'o', label="Prediction")
     plt.xticks(x, map_names, rotation=45, ha='right')
     plt.ylabel("Stars")
     plt.title("Predicted ratings")
@@ -88,7 +92,13 @@ if __name__ == '__main__':
 
     parser = argparse.ArgumentParser(description="Load info from maps")
 
-    parser.add_argument("model", help="The path to the model parameters")
+    parser.add_argument("model", help="The path to the model parameters, or to a model exported by export_model.py (recognized from its contents)")
     parser.add_argument("map_folder", help="The folder containing the song data")
+    parser.add_argument("--bf16", action="store_true", help="Mixed precision: run the transformer in bfloat16 (autocast)")
+    parser.add_argument("--positional", choices=["time", "index"], help="Encode the position of the tokens from their time or their index, for model parameters saved without it (it is read from the file otherwise)")
+    parser.add_argument("--notes_per_token", type=int, help="The number of consecutive elements packed into each transformer token, for model parameters saved without it (it is read from the file otherwise)")
     parser.add_argument("--output", help="Where is the processed beatmap information stored", default=".")
+    parser.add_argument("--no_plot", action="store_true", help="Only print the ratings, without plotting them")
+    parser.add_argument("--executor", choices=["thread", "process"], help="Load the difficulties concurrently in a pool of threads or processes")
+    parser.add_argument("--workers", type=int, help="The number of workers used to load the difficulties")
     main(parser.parse_args())
\ No newline at end of file
@@ -0,0 +1,136 @@
+import argparse
+import json
+import os, sys, time
+from bsrating.network.inference import ExportedRatingPredictor, example_inputs, export_program, save_compiled, save_exported_program, save_onnx
+from bsrating.network.map_dataset import MapDataset, collate_fn
+from bsrating.network.service import load_model
+
+from dotenv import load_dotenv
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+def parity_batches(args) -> list:
+    """The batches used to compare the exported models with the eager one: the maps of the
+    dataset if there is one, or else random maps of every benchmark length, with padding."""
+
+    if args.dataset is not None:
+        filepaths = sorted(os.path.join(args.dataset, fname) for fname in os.listdir(args.dataset) if fname.endswith(".json"))
+        dataloader = DataLoader(MapDataset(filepaths), batch_size=args.batch_size, collate_fn=collate_fn)
+        return [ (tokens, type_ids, padding_mask) for tokens, type_ids, _, padding_mask in dataloader ]
+
+    batches = []
+    for i, length in enumerate(args.lengths):
+        tokens, type_ids, padding_mask = example_inputs(args.batch_size, length, seed=i)
+        # the first map is full, the rest are shorter
+        for j in range(1, args.batch_size):
+            padding_mask[j, length - (j * length) // (2 * args.batch_size):] = True
+        batches.append((tokens, type_ids, padding_mask))
+
+    return batches
+
+def time_calls(predictor, inputs : tuple, repeats : int) -> float:
+    """The median time of a call, in seconds."""
+
+    with torch.inference_mode():
+        predictor(*inputs)
+
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            predictor(*inputs)
+            times.append(time.perf_counter() - start)
+
+    return float(np.median(times))
+
+def main(args):
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+
+    # 1. export the trained model
+    model = load_model(args.model, notes_per_token=args.notes_per_token, positional=args.positional)
+    program = export_program(model)
+
+    exporters = {
+        "export" :  (save_exported_program, ".pt2"),
+        "onnx" :    (save_onnx, ".onnx"),
+        "aoti" :    (save_compiled, ".aoti.pt2")
+    }
+
+    paths = {}
+    for name in args.formats:
+        save, extension = exporters[name]
+        try:
+            save(program, model, f"{args.output}{extension}")
+            paths[name] = f"{args.output}{extension}"
+            print(f"Saved {paths[name]}")
+        except ImportError as e:
+            print(f"Skipping the {name} export: {e}")
+
+    predictors = { "eager" : model }
+    for name, path in paths.items():
+        try:
+            predictors[name] = ExportedRatingPredictor(path, threads=args.threads)
+        except ImportError as e:
+            print(f"Skipping {path}: {e}")
+
+    # 2. parity with the eager model
+    report = { "paths" : paths, "parity" : {}, "benchmark" : {} }
+    batches = parity_batches(args)
+    with torch.inference_mode():
+        expected = torch.cat([ model(*batch) for batch in batches ])
+        for name, predictor in predictors.items():
+            if name == "eager":
+                continue
+
+            predicted = torch.cat([ predictor(*batch).float() for batch in batches ])
+            difference = (predicted - expected).abs().max().item()
+            report["parity"][name] = difference
+            print(f"{name}: max abs diff with eager {difference:.2e} over {len(expected)} maps "
+                  f"({'ok' if difference <= args.tolerance else 'FAILED'})")
+
+    # 3. latency per map and throughput at every length
+    print()
+    print(f"{'length':>8}{'model':>8}{'ms / map':>12}{'maps / s':>12}{'speedup':>10}")
+    for length in args.lengths:
+        single = example_inputs(1, length)
+        batch = example_inputs(args.batch_size, length)
+
+        results = {}
+        for name, predictor in predictors.items():
+            latency = time_calls(predictor, single, args.repeats)
+            throughput = args.batch_size / time_calls(predictor, batch, args.repeats)
+            results[name] = { "latency_ms" : latency * 1000, "maps_per_s" : throughput }
+
+            speedup = results["eager"]["latency_ms"] / results[name]["latency_ms"]
+            print(f"{length:>8}{name:>8}{latency * 1000:>12.2f}{throughput:>12.1f}{speedup:>9.2f}x")
+
+        report["benchmark"][length] = results
+
+    if args.output_report is not None:
+        with open(args.output_report, 'w') as out:
+            json.dump(report, out, indent=2)
+
+    if any(difference > args.tolerance for difference in report["parity"].values()):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Export a trained model for CPU inference (torch.export, ONNX or AOTInductor), check it against the eager model and benchmark it")
+
+    parser.add_argument("model", help="The path to the model parameters")
+    parser.add_argument("output", help="The path of the exported models, without extension (.pt2, .onnx and .aoti.pt2 are added)")
+    parser.add_argument("--formats", nargs="+", choices=["export", "onnx", "aoti"], default=["export", "onnx"],
+                        help="torch.export program, ONNX model, and/or AOTInductor package (compiled for this CPU, slow to build)")
+    parser.add_argument("--positional", choices=["time", "index"], help="Encode the position of the tokens from their time or their index, for model parameters saved without it (it is read from the file otherwise)")
+    parser.add_argument("--notes_per_token", type=int, help="The number of consecutive elements packed into each transformer token, for model parameters saved without it (it is read from the file otherwise)")
+    parser.add_argument("--dataset", help="Check the exported models on the processed maps of this folder, instead of random maps")
+    parser.add_argument("--tolerance", type=float, default=1e-4, help="The maximum difference with the eager model's ratings")
+    parser.add_argument("--lengths", type=lambda s: [ int(l) for l in s.split(",") ], default=[256, 1024, 4096], help="The sequence lengths of the benchmark, separated by commas")
+    parser.add_argument("--batch_size", type=int, default=8, help="The number of maps per batch, for the throughput")
+    parser.add_argument("--repeats", type=int, default=10, help="The number of timed calls of every measurement")
+    parser.add_argument("--threads", type=int, help="The number of CPU threads")
+    parser.add_argument("--output_report", help="Write the parity and benchmark results to this .json file")
+    main(parser.parse_args())
@@ -1,4 +1,5 @@
 import argparse 
+import asyncio
 import json
 import requests
 import os, time
@@ -10,47 +11,19 @@ from bsrating.utils import *
 from dotenv import load_dotenv
 
 import traceback
-
-def preprocess_folders(song_folder: str):
-    """From the song folder, create the association between ids and the full folder name
-    that contains the map data. This will generate a dictionary like this:
-
-    ```
-    {
-        '1a3e1' : '<song_folder>/1a3e1 (Go Insane - Helloiamdaan & miitchel)',
-        '3b2f8' : '<song_folder>/3b2f8 (Kyuukou - zeon & Gabriel)',
-        '2c239' : '<song_folder>/2c238 (When I use it - Astrella & Timbo)'
-    }
-    ```
-
-    The result is used to efficiently look up for a song folder just by the id of the map.
-
-    Args:
-        song_folder (str): The path pointing to the CustomLevels folder.
-
-    Returns:
-        _type_: _description_
-    """
-
-    # mapping for all files
-    def strip_id(name):
-        tokens = name.split()
-
-        return tokens[0]
-    
-    names = os.listdir(song_folder)
-    
-    return { strip_id(name) : os.path.join(song_folder, name) 
-             for name in names if os.path.isdir(os.path.join(song_folder, name)) }
+import hashlib
 
 def read_maps_info(
         songs_folder : str, 
         ranked_playlist : dict, 
-        folder_association : dict,
+        folder_index : FolderIndex,
         use_bl : bool = False,
         verbose = False,
         map_list : list = [],
-        limit = -1) -> list:
+        limit = -1,
+        concurrency : int = 1,
+        cache : ResponseCache = None,
+        bs_batch_size : int = 50) -> list:
     """Read information about all the maps and return a list containing the combined
     info from Beat Saver and ScoreSaber. 
 
@@ -61,12 +34,17 @@ def read_maps_info(
         songs_folder (str): The path pointing to the folder containing the levels' data
         (i.e. your CustomLevels folder)
         ranked_playlist (dict): An object containing the playlist data for all songs to be searched.
-        folder_association (dict): A dictionary that associates the level's Beat Saver id to its location in the 
-        songs folder. This should be the result of the `preprocess_folder` function.
+        folder_index (FolderIndex): The index of the songs folder, used to look up the levels by hash or id
+        (see `FolderIndex`).
         use_bl (bool, optional): Whether to fetch information from the BeatLeader servers.
         verbose (bool, optional): Whether to print additional info. Defaults to False.
         limit (int, optional): The limit of maps to process. If the limit is negative, 
         then all songs from the playlist are included. Defaults to -1.
+        concurrency (int, optional): The maximum number of requests in flight. If it is greater
+        than 1, the maps are fetched concurrently (see `AsyncRankingFetcher`). Defaults to 1.
+        cache (ResponseCache, optional): The cache for the API responses. Defaults to None.
+        bs_batch_size (int, optional): Maximum number of hashes per BeatSaver request, when fetching 
+        concurrently. Defaults to 50.
 
     Returns:
         list: The list of maps, each contains general information about the 
@@ -81,22 +59,41 @@ def read_maps_info(
     if limit > 0:
         rp = rp[:limit]
 
+    # fetch the information of the new maps concurrently
+    fetched = {}
+    if concurrency > 1:
+        to_fetch = [ item for item in rp if (item[0].lower(), item[1]) not in existing_maps.keys() ]
+        with AsyncRankingFetcher(concurrency, MAX_ATTS, use_bl, cache, bs_batch_size) as fetcher, tqdm(total=len(to_fetch), desc="Fetching") as pbar:
+            fetched = dict(zip(to_fetch, asyncio.run(fetcher.load_all(to_fetch, pbar))))
+        print("API requests:", fetcher.stats)
+    else:
+        # the maps are fetched one at a time, with the same rate limits
+        rate_limits, stats = rate_limits_from_env(), FetchStats()
+
     for i, item in enumerate(tqdm(rp)):
         hash_key, diff_name = item
         try:
             if (hash_key.lower(), diff_name) not in existing_maps.keys():
-                map_info = load_info_by_hash(hash_key, diff_name, MAX_ATTS, use_bl)
-                map_list.append(combine_map_info(map_info, folder_association, use_bl))
+                if concurrency > 1:
+                    map_info = fetched[item]
+                    if isinstance(map_info, Exception):
+                        raise map_info
+                else:
+                    map_info = load_info_by_hash(hash_key, diff_name, MAX_ATTS, use_bl, cache, rate_limits, stats)
+                map_list.append(combine_map_info(map_info, folder_index, use_bl))
             else:
                 # update hash to be consistent just in case
                 map_info = map_list[existing_maps[(hash_key.lower(), capitalize_diff(diff_name))]]
-                updated_info = update_map_info(LocalLevelInfo.from_json(map_info), folder_association, use_bl)
+                updated_info = update_map_info(LocalLevelInfo.from_json(map_info), folder_index, use_bl)
                 map_list[existing_maps[(hash_key.lower(), diff_name)]] = updated_info
         except Exception as e:
             if verbose:
                 print("Unknown error:", e)
                 traceback.print_exc()
 
+    if concurrency <= 1:
+        print("API requests:", stats)
+
     return map_list
 
 def read_playlists(ss_path : str, bl_path : str, use_bl) -> list:
@@ -121,25 +118,134 @@ def read_playlists(ss_path : str, bl_path : str, use_bl) -> list:
     
     return playlist
 
-def process_diff_files(song_data : list, folder : str):
-    
-    err_parse_count = 0
-    
-    for i, diff_data in enumerate(tqdm(song_data)):
+# bump this when the processed format changes, so that every difficulty is processed again
+PROCESSING_VERSION = 1
+
+def diff_output_name(local_data : LocalLevelInfo) -> str:
+    return f"{local_data.id}_{local_data.unique_id()}.json"
+
+def diff_build_key(local_data : LocalLevelInfo, song_info : SongInfo = None) -> str:
+    """Key identifying the inputs of a processed difficulty: the contents of the info and 
+    difficulty files, the star rating and the processing version. If the key doesn't change,
+    the processed file doesn't need to be rebuilt.
+    """
+    h = hashlib.sha256()
+    for path in local_data.source_files(song_info):
+        with open(path, 'rb') as f:
+            h.update(hashlib.file_digest(f, "sha256").digest())
+
+    h.update(f"{local_data.stars}|{PROCESSING_VERSION}".encode())
+
+    return h.hexdigest()
+
+def process_diff_chunk(chunk : list, folder : str, stream : bool = False) -> list:
+    """Process a chunk of difficulties and dump each one into the dataset folder. Difficulties
+    whose build key matches the previous one and whose output exists are skipped.
+
+    Args:
+        chunk (list): A list of (index, difficulty data, previous build key) tuples, with the data as 
+        stored in the song data file.
+        folder (str): The dataset folder.
+        stream (bool, optional): Whether to parse the difficulty files incrementally. Defaults to False.
+
+    Returns:
+        list: One result per difficulty, as a dict with the index, id, difficulty, output name, build key
+        and status ("built", "skipped" or "failed"). Failed results also contain the error and traceback.
+    """
+    results = []
+    song_infos = {}  # the difficulties of a song share its info file, which is only parsed once
+    for i, diff_data, prev_key in chunk:
         local_data = LocalLevelInfo.from_json(diff_data)
-        with open(os.path.join(folder, f"{local_data.id}_{local_data.unique_id()}.json"), 'w', encoding='utf-8') as f:
-            try:
+        name = diff_output_name(local_data)
+        output_path = os.path.join(folder, name)
+        result = {
+            "index" :       i,
+            "id" :          local_data.id,
+            "difficulty" :  local_data.diff,
+            "name" :        name,
+            "key" :         None,
+            "status" :      "built"
+        }
+
+        try:
+            song_key = (local_data.song_path, local_data.info_file)
+            if song_key not in song_infos:
+                song_infos[song_key] = local_data.read_song_info()
+            song_info = song_infos[song_key]
+
+            result["key"] = diff_build_key(local_data, song_info)
+            if result["key"] == prev_key and os.path.isfile(output_path):
+                result["status"] = "skipped"
+            else:
                 beatmap_data = {
-                    "data" : local_data.process(),  # X
+                    "data" : local_data.process(stream, song_info),  # X
                     "rating" : local_data.stars     # y
                 }
-                json.dump(beatmap_data, f)
-            except Exception as e:
-                print(f"({local_data.id}, {local_data.diff}) Error dumping diff:", e)
-                traceback.print_exc()
-                err_parse_count += 1
+                with open(output_path, 'w', encoding='utf-8') as f:
+                    json.dump(beatmap_data, f)
+        except Exception as e:
+            # the previous output (if any) is stale now
+            if os.path.isfile(output_path):
+                os.remove(output_path)
+
+            result["status"] = "failed"
+            result["error"] = repr(e)
+            result["traceback"] = traceback.format_exc()
+
+        results.append(result)
+
+    return results
+
+def process_diff_files(song_data : list, folder : str, stream : bool = False, 
+                       workers : int = 1, chunk_size : int = 16, manifest : dict = None) -> tuple[list, dict]:
+    """Process every difficulty in the song data and dump it into the dataset folder,
+    as `<id>_<hash>_<difficulty>.json`. 
 
-    print(f"{err_parse_count} maps failed to load!")
+    Only the difficulties whose build key (see `diff_build_key`) differs from the one in 
+    the manifest are processed again, and the outputs that don't belong to any difficulty
+    in the song data are deleted.
+
+    Args:
+        song_data (list): The song data, as returned by `read_maps_info`.
+        folder (str): The dataset folder.
+        stream (bool, optional): Whether to parse the difficulty files incrementally. Defaults to False.
+        workers (int, optional): The number of worker processes. If it is 1 or less, everything 
+        is processed in the current process. Defaults to 1.
+        chunk_size (int, optional): The number of difficulties sent to a worker at once. Defaults to 16.
+        manifest (dict, optional): The manifest of the previous build, associating each output name with
+        its build key. If None, everything is processed. Defaults to None.
+
+    Returns:
+        (list, dict): The results sorted by their index in the song data (see `process_diff_chunk`), 
+            and the manifest of this build.
+    """
+    manifest = manifest or {}
+    
+    indexed = [ (i, diff_data, manifest.get(diff_output_name(LocalLevelInfo.from_json(diff_data)))) 
+                for i, diff_data in enumerate(song_data) ]
+
+    def chunk_failed(chunk, error, tb):
+        failed = []
+        for i, diff_data, _ in chunk:
+            local_data = LocalLevelInfo.from_json(diff_data)
+            failed.append({ "index" : i, "id" : local_data.id, "difficulty" : local_data.diff, "name" : diff_output_name(local_data),
+                            "key" : None, "status" : "failed", "error" : error, "traceback" : tb })
+        return failed
+
+    with tqdm(total=len(indexed)) as pbar:
+        results = process_chunks(process_diff_chunk, indexed, folder, stream, workers=workers, chunk_size=chunk_size,
+                                 progress=pbar, on_error=chunk_failed)
+
+    results = sorted(results, key=lambda r : r["index"])
+    new_manifest = { r["name"] : r["key"] for r in results if r["status"] != "failed" }
+
+    # delete stale outputs
+    expected = { r["name"] for r in results }
+    for fname in os.listdir(folder):
+        if fname.endswith(".json") and fname not in expected:
+            os.remove(os.path.join(folder, fname))
+
+    return results, new_manifest
 
 def main(args):
 
@@ -161,8 +267,12 @@ def main(args):
     except Exception as e:
         print(e)
 
-    # associate the id with the local folder of the song
-    folder_association = preprocess_folders(os.getenv("SONG_FOLDER"))
+    # index the song folder, so that the levels can be looked up by hash or id
+    folder_index = FolderIndex.load(os.path.join(args.folder, "folder_index.json"), os.getenv("SONG_FOLDER"))
+    index_stats = folder_index.refresh(full=args.reindex)
+    folder_index.save()
+    print(f"Song folder: {len(folder_index)} levels ({index_stats['added']} added, "
+          f"{index_stats['updated']} updated, {index_stats['removed']} removed)")
 
     print("2. Fetching map info...")
     # read song folder and fetch information from scoresaber
@@ -170,14 +280,28 @@ def main(args):
         with open(os.path.join(args.folder, args.output)) as song_file:
             song_data = json.load(song_file)
     else:
+        cache = None
+        if not args.no_cache:
+            cache = ResponseCache(
+                args.cache or os.path.join(args.folder, "api_cache.sqlite"), 
+                max_bytes=args.cache_mb << 20,
+                refresh=args.refresh)
+
         song_data = read_maps_info(
             os.getenv("SONG_FOLDER"), 
             ranked_playlist, 
-            folder_association, 
+            folder_index, 
             use_bl=args.use_bl,
             map_list=map_list,
             verbose=args.verbose, 
-            limit=args.limit)
+            limit=args.limit,
+            concurrency=args.concurrency,
+            cache=cache,
+            bs_batch_size=args.bs_batch_size)
+
+        if cache is not None:
+            print(f"API cache: {cache.hits} hits, {cache.misses} misses")
+            cache.close()
     
     with open(os.path.join(args.folder, args.output), 'w') as song_list:
         json.dump(song_data, song_list, indent=2)
@@ -187,7 +311,41 @@ def main(args):
     # this can potentially be used for the positional encodings to introduce information about the 
     # speed of the swings.
     print("3. Processing difficulty files...")
-    process_diff_files(song_data, path_to_dataset)
+    manifest_path = os.path.join(args.folder, "manifest.json")
+    manifest = {}
+    if os.path.isfile(manifest_path) and not args.force:
+        with open(manifest_path) as mf:
+            manifest = json.load(mf)
+
+    results, manifest = process_diff_files(
+        song_data, path_to_dataset, args.stream, args.workers, args.chunk_size, manifest)
+
+    with open(manifest_path, 'w') as mf:
+        json.dump(manifest, mf, indent=2)
+
+    errors = [ r for r in results if r["status"] == "failed" ]
+    print(f"{sum(r['status'] == 'built' for r in results)} maps processed, "
+          f"{sum(r['status'] == 'skipped' for r in results)} unchanged.")
+    print(f"{len(errors)} maps failed to load!")
+    if len(errors) > 0:
+        for err in errors:
+            print(f"({err['id']}, {err['difficulty']}) Error dumping diff:", err["error"])
+
+        errors_path = os.path.join(args.folder, "errors.json")
+        with open(errors_path, 'w') as ef:
+            json.dump(errors, ef, indent=2)
+        print(f"Full error report written to {errors_path}")
+
+    if args.pack:
+        print("4. Packing dataset...")
+        from bsrating.network.packed_dataset import pack_dataset
+
+        filepaths = [ os.path.join(path_to_dataset, diff_output_name(LocalLevelInfo.from_json(diff_data))) 
+                      for diff_data in song_data ]
+        pack_dataset(
+            [ fp for fp in filepaths if os.path.isfile(fp) ], 
+            os.path.join(args.folder, "packed"), 
+            args.shard_mb << 20)
 
 if __name__ == '__main__':
     load_dotenv()
@@ -202,4 +360,17 @@ if __name__ == '__main__':
     parser.add_argument("--verbose", action="store_true", help="Whether to print additional info")
     parser.add_argument("--output", help="The name of the output .json file referencing all the songs.", default="song_data.json")
     parser.add_argument("--skip_fetch", action="store_true", help="Skip fetch and use local data only. Will look for a file matching the output name")
+    parser.add_argument("--reindex", action="store_true", help="Read every level in the song folder again instead of only the changed ones")
+    parser.add_argument("--cache", help="The API response cache file. Defaults to <folder>/api_cache.sqlite")
+    parser.add_argument("--cache_mb", type=int, default=256, help="Maximum size of the API response cache, in MiB")
+    parser.add_argument("--no_cache", action="store_true", help="Don't cache the API responses")
+    parser.add_argument("--refresh", action="store_true", help="Ignore the cached API responses and fetch everything again")
+    parser.add_argument("--concurrency", type=int, default=1, help="Maximum number of API requests in flight. Values greater than 1 fetch the maps concurrently")
+    parser.add_argument("--bs_batch_size", type=int, default=50, help="Maximum number of hashes per BeatSaver request when fetching concurrently")
+    parser.add_argument("--workers", type=int, default=1, help="The number of processes used to process the difficulty files")
+    parser.add_argument("--chunk_size", type=int, default=16, help="The number of difficulty files sent to a worker at once")
+    parser.add_argument("--force", action="store_true", help="Process every difficulty file again, even if it didn't change")
+    parser.add_argument("--pack", action="store_true", help="Also write the dataset in packed (memory-mapped) format, in <folder>/packed")
+    parser.add_argument("--shard_mb", type=int, default=256, help="Size of the packed dataset shards, in MiB")
+    parser.add_argument("--stream", action="store_true", help="Parse the difficulty files incrementally, skipping lightshow data (bounded memory usage)")
     main(parser.parse_args())
\ No newline at end of file
@@ -1,6 +1,6 @@
 import argparse 
 import json
-from matplotlib import pyplot as plt
+import os
 from pprint import pprint
 from tqdm import tqdm, trange
 from bsrating.analysis import *
@@ -13,13 +13,34 @@ def load_map(path: str) -> dict:
     with open(path) as fp:
         return json.load(fp)
 
+def batch_main(args):
+
+    output_path = args.output or os.path.join(args.data, "features.npz")
+    with tqdm(desc="Analysing") as pbar:
+        table, results = build_feature_table(
+            args.data, output_path, args.workers, args.chunk_size, args.force, progress=pbar)
+
+    errors = [ r for r in results if "error" in r ]
+    print(f"{len(table['name'])} maps in {output_path} ({len(results) - len(errors)} analysed, "
+          f"{len(table['name']) - len(results) + len(errors)} unchanged)")
+    for err in errors:
+        print(f"{err['path']}: {err['error']}")
+
 def main(args):
 
+    if args.batch:
+        return batch_main(args)
+
+    # only needed for plotting, so that batch mode runs headless
+    from matplotlib import pyplot as plt
+
     map_data = load_map(args.data)
 
     # 1. analyze note density
-    map_ts, density, d_left, d_right = note_density(map_data["data"], 1 / 8, args.kernel_width)
-    _, density_k1, d_left_k1, d_right_k1 = note_density(map_data["data"], 1 / 8, 2)
+    map_ts, densities, ds_left, ds_right = note_densities(map_data["data"], 1 / 8, [args.kernel_width, 2])
+    density, density_k1 = densities
+    d_left, d_left_k1 = ds_left
+    d_right, d_right_k1 = ds_right
 
     # 2. peak analysis
     peaks = signal.find_peaks_cwt(-density, 16, gap_thresh=16)
@@ -60,6 +81,11 @@ if __name__ == '__main__':
 
     parser = argparse.ArgumentParser(description="Analyze ")
 
-    parser.add_argument("data", help="The file containing the processed difficulty data")
+    parser.add_argument("data", help="The file containing the processed difficulty data (or the dataset folder, with --batch)")
     parser.add_argument("--kernel_width", "-k", help="The width of the averaging kernel", type=float, default=8)
+    parser.add_argument("--batch", action="store_true", help="Compute the features of every map in the dataset folder and write them to a table, without plotting")
+    parser.add_argument("--output", help="The feature table file, with --batch. Defaults to <data>/features.npz")
+    parser.add_argument("--workers", type=int, default=1, help="The number of processes used to analyse the maps, with --batch")
+    parser.add_argument("--chunk_size", type=int, default=16, help="The number of maps sent to a worker at once, with --batch")
+    parser.add_argument("--force", action="store_true", help="Analyse every map again, with --batch, even if it didn't change")
     main(parser.parse_args())
\ No newline at end of file
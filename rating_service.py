@@ -0,0 +1,128 @@
+import argparse
+import json
+import os, sys
+import socketserver
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from bsrating.network.inference import load_predictor
+from bsrating.network.service import DynamicBatcher, RatingService
+
+from dotenv import load_dotenv
+
+import torch
+
+# Protocol: one JSON request per line, one JSON response per line (in completion order, matched by "id").
+#   {"id": 1, "map_folder": "CustomLevels/1a2b3 (Song - Mapper)"}   rate every Standard difficulty of a map
+#   {"id": 2, "processed": "dataset/1a2b3_ExpertPlus.json"}          rate a processed map file
+#   {"id": 3, "data": [...]}                                         rate a processed map sent inline
+#   {"id": 4, "cmd": "stats"}                                        latency and batching statistics
+
+def serve_lines(service : RatingService, lines, write, pool : ThreadPoolExecutor):
+    """Handle every request line concurrently, writing each response as soon as it's ready."""
+
+    lock = threading.Lock()
+
+    # only the number of requests in flight is kept, the input may never end
+    finished = threading.Condition()
+    in_flight = 0
+
+    def respond(line : str):
+        try:
+            response = service.handle(json.loads(line))
+        except json.JSONDecodeError as e:
+            response = { "id" : None, "error" : repr(e) }
+
+        with lock:
+            write(json.dumps(response) + "\n")
+
+    def run(line : str):
+        nonlocal in_flight
+        try:
+            respond(line)
+        finally:
+            with finished:
+                in_flight -= 1
+                finished.notify_all()
+
+    for line in lines:
+        if line.strip():
+            with finished:
+                in_flight += 1
+            pool.submit(run, line)
+
+    with finished:
+        finished.wait_for(lambda : in_flight == 0)
+
+def make_handler(service : RatingService, pool : ThreadPoolExecutor):
+
+    class RatingHandler(socketserver.StreamRequestHandler):
+
+        def handle(self):
+            def write(text : str):
+                self.wfile.write(text.encode())
+                self.wfile.flush()
+
+            serve_lines(service, (line.decode() for line in self.rfile), write, pool)
+
+    return RatingHandler
+
+def main(args):
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    print("Using device:", device, file=sys.stderr)
+
+    # 1. load the model once (eager or exported)
+    model = load_predictor(args.model, device, notes_per_token=args.notes_per_token, positional=args.positional)
+    batcher = DynamicBatcher(model, device,
+        max_batch_size=args.max_batch_size,
+        max_tokens=args.max_tokens,
+        max_wait=args.max_wait_ms / 1000,
+        bf16=args.bf16)
+    service = RatingService(batcher)
+
+    # 2. serve requests; maps are loaded and tokenized in the pool, and rated in batches by the batcher
+    pool = ThreadPoolExecutor(max_workers=args.workers)
+    try:
+        if args.socket is not None or args.port is not None:
+            if args.socket is not None:
+                if os.path.exists(args.socket):
+                    os.remove(args.socket)
+                server = socketserver.ThreadingUnixStreamServer(args.socket, make_handler(service, pool))
+            else:
+                server = socketserver.ThreadingTCPServer(("127.0.0.1", args.port), make_handler(service, pool))
+
+            print(f"Listening on {args.socket or f'127.0.0.1:{args.port}'}", file=sys.stderr)
+            with server:
+                try:
+                    server.serve_forever()
+                except KeyboardInterrupt:
+                    pass
+        else:
+            # stdout only carries the responses, anything else printed goes to stderr
+            responses, sys.stdout = sys.stdout, sys.stderr
+
+            def write(text : str):
+                responses.write(text)
+                responses.flush()
+
+            serve_lines(service, sys.stdin, write, pool)
+    finally:
+        pool.shutdown()
+        batcher.close()
+        print(f"Served: {json.dumps(service.stats())}", file=sys.stderr)
+
+if __name__ == '__main__':
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Rate maps continuously: load the model once and serve JSON line requests from stdin or a local socket")
+
+    parser.add_argument("model", help="The path to the model parameters, or to a model exported by export_model.py (recognized from its contents)")
+    parser.add_argument("--socket", help="Listen on this Unix socket instead of reading stdin")
+    parser.add_argument("--port", type=int, help="Listen on this local TCP port instead of reading stdin")
+    parser.add_argument("--workers", type=int, default=8, help="The number of requests loaded and tokenized at the same time")
+    parser.add_argument("--max_batch_size", type=int, default=16, help="The maximum number of maps rated in a batch")
+    parser.add_argument("--max_tokens", type=int, default=1 << 16, help="The maximum number of transformer tokens in a batch, including padding (each token packs the notes_per_token elements of the model)")
+    parser.add_argument("--max_wait_ms", type=float, default=10, help="How long to wait for more requests before rating a batch")
+    parser.add_argument("--bf16", action="store_true", help="Mixed precision: run the transformer in bfloat16 (autocast)")
+    parser.add_argument("--positional", choices=["time", "index"], help="Encode the position of the tokens from their time or their index, for model parameters saved without it (it is read from the file otherwise)")
+    parser.add_argument("--notes_per_token", type=int, help="The number of consecutive elements packed into each transformer token, for model parameters saved without it (it is read from the file otherwise)")
+    main(parser.parse_args())
@@ -0,0 +1,65 @@
+import pytest
+
+import bsrating.leveldata.cache as cache_module
+from bsrating.leveldata.cache import ResponseCache
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_module.time, "time", clock.time)
+    return clock
+
+def stored_size(cache : ResponseCache) -> int:
+    return cache._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+def test_hits_dont_write(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    cache.put("beatsaver", "a", 200, { "id" : "a" })
+
+    changes = cache._conn.total_changes
+    for _ in range(10):
+        clock.now += 30.0
+        assert cache.get("beatsaver", "a") == (200, { "id" : "a" })
+
+    assert cache._conn.total_changes == changes
+    assert not cache._conn.in_transaction
+    cache.close()
+
+def test_least_recently_used_evicted(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), max_bytes=100)
+    for key in "abc":
+        clock.now += 120.0
+        cache.put("beatsaver", key, 200, { "k" : "x" * 20 })
+
+    # "a" is read again, so "b" is now the least recently used one
+    clock.now += 120.0
+    assert cache.get("beatsaver", "a") is not None
+    clock.now += 120.0
+    cache.put("beatsaver", "d", 200, { "k" : "x" * 20 })
+
+    assert cache.get("beatsaver", "b") is None
+    assert all(cache.get("beatsaver", key) is not None for key in "acd")
+    assert cache._size == stored_size(cache)
+    cache.close()
+
+def test_running_size(tmp_path, clock):
+    path = str(tmp_path / "cache.sqlite")
+    cache = ResponseCache(path, max_bytes=1000)
+    for i in range(50):
+        # replacing a response changes its size
+        cache.put("scoresaber", f"key{i % 20}", 200, { "body" : "x" * (i % 7) })
+        cache.put("scoresaber", f"error{i}", 500, {})
+        assert cache._size == stored_size(cache)
+    cache.close()
+
+    # the size is read back when the cache is opened again
+    cache = ResponseCache(path)
+    assert cache._size == stored_size(cache)
+    cache.close()
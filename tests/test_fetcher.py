@@ -0,0 +1,205 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import pytest
+
+from bsrating.leveldata.cache import ResponseCache
+from bsrating.leveldata.fetcher import AsyncRankingFetcher
+from bsrating.leveldata.ranking import beatsaver_info, load_beatsaver_by_hashes, load_info_by_hash
+from bsrating.leveldata.ratelimit import FetchStats, TokenBucket
+import bsrating.leveldata.ranking as ranking
+
+def beatsaver_map(hash : str) -> dict:
+    return { "id" : hash[:5], "name" : f"Song {hash}", "updatedAt" : "2024-01-01T00:00:00Z" }
+
+class StubAPI:
+    """A local server answering like ScoreSaber, BeatLeader and BeatSaver, which records the
+    paths it is asked for. The maps in `missing` are not found, and the next `throttle` requests
+    get a 429.
+    """
+
+    def __init__(self):
+        self.paths = []
+        self.times = []
+        self.missing = set()
+        self.throttle = 0
+        self._lock = threading.Lock()
+
+        api = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                code, body = api.respond(urlparse(self.path).path)
+                data = json.dumps(body).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+
+    def respond(self, path : str) -> tuple[int, dict]:
+        with self._lock:
+            self.paths.append(path)
+            self.times.append(time.monotonic())
+            if self.throttle > 0:
+                self.throttle -= 1
+                return 429, { "errorMessage" : "Too many requests" }
+
+        parts = path.strip("/").split("/")
+        if parts[:2] == ["maps", "hash"]:
+            hashes = [ h for h in parts[2].split(",") if h not in self.missing ]
+            if len(hashes) == 0:
+                return 404, { "error" : "Not Found" }
+            if len(parts[2].split(",")) == 1:
+                return 200, beatsaver_map(hashes[0])
+            return 200, { h.upper() : beatsaver_map(h) for h in hashes }
+
+        if parts[:3] == ["leaderboard", "by-hash", parts[2]]:
+            if parts[2] in self.missing:
+                return 404, { "errorMessage" : "Leaderboard not found" }
+            return 200, { "songHash" : parts[2].upper(), "stars" : 5.0, "ranked" : True }
+
+        if parts[0] == "leaderboard":
+            return 200, { "difficulty" : { "stars" : 6.0 } }
+
+        return 404, { "error" : "Not Found" }
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def api(monkeypatch):
+    api = StubAPI()
+    for var in ("SCORESABER_API_URL", "BEATLEADER_API_URL", "BEATSAVER_API_URL"):
+        monkeypatch.setenv(var, api.url)
+    yield api
+    api.close()
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    yield cache
+    cache.close()
+
+HASHES = [ f"{i:040x}" for i in range(6) ]
+
+def fetch_all(items : list, **kwargs) -> tuple[list, FetchStats]:
+    with AsyncRankingFetcher(**kwargs) as fetcher:
+        results = asyncio.run(fetcher.load_all(items))
+    return results, fetcher.stats
+
+def test_cache_hits_skip_rate_limit(api, cache):
+    items = [ (h, "ExpertPlus") for h in HASHES ]
+
+    results, stats = fetch_all(items, concurrency=4, cache=cache, rate_limits={})
+    assert [ r.hash for r in results ] == HASHES
+    assert stats.requests == len(api.paths)
+
+    # a warm cache sends nothing, so it neither waits for the (very slow) rate limits nor counts requests
+    sent = len(api.paths)
+    slow = { source : TokenBucket(0.01, burst=1) for source in ("scoresaber", "beatsaver") }
+    results, stats = fetch_all(items, concurrency=4, cache=cache, rate_limits=slow)
+    assert [ r.hash for r in results ] == HASHES
+    assert len(api.paths) == sent
+    assert stats.requests == 0
+    assert stats.rate_limit_wait == 0.0
+
+def test_rate_limit_does_not_block_other_apis(api):
+    items = [ (h, "ExpertPlus") for h in [ f"{i:040x}" for i in range(12) ] ]
+
+    # ScoreSaber at 10 requests per second takes over a second, BeatSaver isn't limited
+    start = time.monotonic()
+    rate_limits = { "scoresaber" : TokenBucket(10.0, burst=1) }
+    results, stats = fetch_all(items, concurrency=4, bs_batch_size=1, rate_limits=rate_limits)
+    assert all(not isinstance(r, Exception) for r in results)
+
+    sent = { "scoresaber" : [], "beatsaver" : [] }
+    for path, t in zip(api.paths, api.times):
+        sent["beatsaver" if path.startswith("/maps/hash/") else "scoresaber"].append(t - start)
+
+    # the requests waiting for their ScoreSaber token don't hold the threads the BeatSaver requests need
+    assert max(sent["scoresaber"]) >= 1.0
+    assert max(sent["beatsaver"]) < 0.5
+    assert stats.requests == 24 and stats.rate_limit_wait > 0.0
+
+def test_sync_path_rate_limit_and_retry(api, cache, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(ranking.time, "sleep", sleeps.append)
+
+    rate_limits = { "scoresaber" : TokenBucket(10.0, burst=1) }
+    stats = FetchStats()
+    api.throttle = 1
+
+    info = load_info_by_hash(HASHES[0], "ExpertPlus", 5, cache=cache, rate_limits=rate_limits, stats=stats)
+    assert info.hash == HASHES[0] and info.ss_stars == 5.0
+
+    # the 429 is retried after a jittered backoff (the first delay is 1s), through the rate limiter again
+    assert (stats.requests, stats.throttles, stats.retries) == (3, 1, 1)
+    assert 0.5 <= stats.backoff_wait <= 1.0
+    assert stats.rate_limit_wait > 0.0
+    assert len(sleeps) == 2
+
+    # cached now: nothing is sent, limited or counted
+    load_info_by_hash(HASHES[0], "ExpertPlus", 5, cache=cache, rate_limits=rate_limits, stats=stats)
+    assert stats.requests == 3
+    assert len(api.paths) == 3
+
+def beatsaver_requests(api : StubAPI) -> list:
+    """The hashes of every BeatSaver request received, in order."""
+    return [ path.rsplit("/", 1)[1].split(",") for path in api.paths if path.startswith("/maps/hash/") ]
+
+def test_beatsaver_single_hash(api):
+    # a single map is returned as the map object itself, not keyed by its hash
+    assert load_beatsaver_by_hashes([ HASHES[0].upper() ], 0) == { HASHES[0] : beatsaver_info(beatsaver_map(HASHES[0])) }
+    assert beatsaver_requests(api) == [[ HASHES[0] ]]
+
+    api.missing.add(HASHES[1])
+    assert load_beatsaver_by_hashes([ HASHES[1] ], 0) == { HASHES[1] : None }
+
+def test_beatsaver_not_found(api, cache):
+    api.missing.update(HASHES[:2])
+
+    expected = { HASHES[0] : None, HASHES[1] : None, HASHES[2] : beatsaver_info(beatsaver_map(HASHES[2])) }
+    assert load_beatsaver_by_hashes(HASHES[:3], 0, cache=cache) == expected
+
+    # a request where no map is found at all gets a 404
+    api.missing.update(HASHES[3:])
+    assert load_beatsaver_by_hashes(HASHES[3:], 0) == { h : None for h in HASHES[3:] }
+
+    # the maps that weren't found are cached too, so they aren't requested again
+    sent = len(api.paths)
+    assert load_beatsaver_by_hashes(HASHES[:3], 0, cache=cache) == expected
+    assert len(api.paths) == sent
+
+def test_beatsaver_batches(api):
+    hashes = [ f"{i:040x}" for i in range(120) ]
+    api.missing.update(hashes[100:])
+
+    # every map is asked for twice (two difficulties), once more in uppercase for some of them
+    items = [ (h, diff) for h in hashes for diff in ("Expert", "ExpertPlus") ]
+    items += [ (h.upper(), "Hard") for h in hashes[::7] ]
+    results, stats = fetch_all(items, concurrency=8, rate_limits={})
+
+    # each hash is requested once, in batches of at most 50
+    batches = beatsaver_requests(api)
+    assert sorted(len(b) for b in batches) == [ 20, 50, 50 ]
+    assert sorted(h for b in batches for h in b) == hashes
+
+    # all the difficulties of a map share the result, and the maps that weren't found fail
+    for (hash, diff), result in zip(items, results):
+        if hash.lower() in api.missing:
+            assert isinstance(result, Exception)
+        else:
+            assert result.hash == hash and result.id == hash[:5].lower()
@@ -0,0 +1,57 @@
+import pytest
+import torch
+
+from bsrating.network.inference import (
+    ExportedRatingPredictor, example_inputs, export_program, exported_format, load_predictor, save_exported_program, save_onnx
+)
+from bsrating.network.nn import RatingPredictorNN
+from bsrating.network.tokenizer import TOKEN_DIM
+
+def small_model(notes_per_token : int) -> RatingPredictorNN:
+    torch.manual_seed(0)
+    return RatingPredictorNN(TOKEN_DIM, model_dim=32, heads=2, attn_layers=2, notes_per_token=notes_per_token).eval()
+
+def padded_batch(length : int, seed : int) -> tuple[torch.tensor, torch.tensor, torch.tensor]:
+    """A batch with one full map, and shorter maps padded to its length."""
+
+    tokens, type_ids, padding_mask = example_inputs(4, length, seed=seed)
+    for i in range(1, 4):
+        padding_mask[i, length - (i * length) // 5:] = True
+    return tokens, type_ids, padding_mask
+
+@pytest.fixture(scope="module", params=[1, 3], ids=lambda g : f"notes_per_token={g}")
+def exported(request) -> tuple[RatingPredictorNN, torch.export.ExportedProgram]:
+    model = small_model(request.param)
+    return model, export_program(model)
+
+@pytest.mark.parametrize("save, extension", [
+    (save_exported_program, ".pt2"),
+    (save_onnx, ".onnx"),
+])
+def test_exported_parity(tmp_path, exported, save, extension):
+    if save is save_onnx:
+        pytest.importorskip("onnxruntime")
+        pytest.importorskip("onnxscript")
+
+    model, program = exported
+    path = str(tmp_path / f"model{extension}")
+    save(program, model, path)
+
+    predictor = load_predictor(path)
+    assert isinstance(predictor, ExportedRatingPredictor)
+    assert predictor.notes_per_token == model.notes_per_token
+
+    # lengths that aren't a whole number of groups, and a single map
+    batches = [ padded_batch(length, seed) for seed, length in enumerate([ 1, 7, 16, 50, 129 ]) ]
+    batches.append(example_inputs(1, 11))
+    with torch.inference_mode():
+        for batch in batches:
+            torch.testing.assert_close(predictor(*batch).float(), model(*batch), atol=1e-5, rtol=1e-5)
+
+def test_state_dict_with_pt2_extension(tmp_path):
+    path = str(tmp_path / "model.pt2")
+    torch.save(small_model(1).state_dict(), path)
+
+    assert exported_format(path) is None
+    with pytest.raises(ValueError):
+        ExportedRatingPredictor(path)
@@ -0,0 +1,46 @@
+import io
+import json
+
+import pytest
+
+from bsrating.utils.jsonstream import JSONStreamReader
+
+DOCUMENT = json.dumps({
+    "_version" :    "2.0.0",
+    "_time" :       123.456,
+    "_bpm" :        -1.5e-3,
+    "_count" :      1200,
+    "_big" :        6.02E+23,
+    "_flags" :      [ True, False, None ],
+    "_name" :       "quote \" backslash \\ unicode é",
+    "_notes" :      [ { "_time" : 10.125, "_lineIndex" : 1, "_type" : 0 },
+                      { "_time" : 1e2, "_lineIndex" : -3, "_type" : 1 } ],
+    "_events" :     [],
+    "_empty" :      {}
+})
+
+def read(reader : JSONStreamReader, arrays : bool) -> dict:
+    # arrays of the root object are read element by element, or loaded at once
+    result = {}
+    for key, value in reader.items():
+        if arrays and key in ("_notes", "_events"):
+            result[key] = list(value.iter())
+        elif key != "_skipped":
+            result[key] = value.load()
+
+    return result
+
+@pytest.mark.parametrize("chunk_size", range(1, len(DOCUMENT) + 2))
+def test_chunk_boundaries(chunk_size):
+    expected = json.loads(DOCUMENT)
+
+    for arrays in (False, True):
+        reader = JSONStreamReader(io.StringIO(DOCUMENT), chunk_size=chunk_size)
+        assert read(reader, arrays) == expected
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 7, 64])
+def test_skipped_values(chunk_size):
+    document = json.dumps({ "_skipped" : { "a" : [1.5, "x\\\"]", {}] }, "_time" : 0.5e1 })
+
+    reader = JSONStreamReader(io.StringIO(document), chunk_size=chunk_size)
+    assert read(reader, False) == { "_time" : 5.0 }
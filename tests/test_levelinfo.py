@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+import bsrating.leveldata.levelinfo as levelinfo_module
+from bsrating.leveldata.levelinfo import LocalLevelInfo
+from load_maps import process_diff_chunk
+
+def notes(count : int) -> list:
+    return [ { "_time" : 0.5 * i, "_lineIndex" : i % 4, "_lineLayer" : i % 3, "_type" : i % 2, "_cutDirection" : i % 9 }
+             for i in range(count) ]
+
+@pytest.fixture
+def song_path(tmp_path) -> str:
+    """A song with a Hard and an ExpertPlus difficulty, the latter without an NJS."""
+
+    song = tmp_path / "song"
+    song.mkdir()
+    info = {
+        "_version" : "2.0.0", "_songName" : "Test", "_beatsPerMinute" : 120.0,
+        "_difficultyBeatmapSets" : [{
+            "_beatmapCharacteristicName" : "Standard",
+            "_difficultyBeatmaps" : [
+                { "_difficulty" : "Hard", "_difficultyRank" : 5, "_beatmapFilename" : "HardStandard.dat",
+                  "_noteJumpMovementSpeed" : 14, "_noteJumpStartBeatOffset" : 0 },
+                { "_difficulty" : "ExpertPlus", "_difficultyRank" : 9, "_beatmapFilename" : "ExpertPlusStandard.dat" }
+            ]
+        }]
+    }
+    with open(song / "Info.dat", "w") as fp:
+        json.dump(info, fp)
+    for diff in ("Hard", "ExpertPlus"):
+        with open(song / f"{diff}Standard.dat", "w") as fp:
+            json.dump({ "_version" : "2.5.0", "_notes" : notes(10), "_obstacles" : [], "_events" : [] }, fp)
+
+    return str(song)
+
+def diff_data(song_path : str, diff : str) -> dict:
+    return { "id" : "1a", "hash" : "abc", "name" : "Test", "difficulty" : diff, "stars" : 5.0,
+             "song_path" : song_path, "info_file" : "Info.dat" }
+
+def test_default_njs(song_path):
+    data = LocalLevelInfo.from_json(diff_data(song_path, "expertPlus")).process()
+    assert all(element["njs"] == 16.0 for element in data)
+
+    data = LocalLevelInfo.from_json(diff_data(song_path, "hard")).process()
+    assert all(element["njs"] == 14.0 for element in data)
+
+def test_info_read_once_per_song(song_path, tmp_path, monkeypatch):
+    reads = []
+    load_song_info = levelinfo_module.load_song_info
+    def counting_load(*args):
+        reads.append(args)
+        return load_song_info(*args)
+    monkeypatch.setattr(levelinfo_module, "load_song_info", counting_load)
+
+    folder = tmp_path / "dataset"
+    folder.mkdir()
+    chunk = [ (i, diff_data(song_path, diff), None) for i, diff in enumerate(("hard", "expertPlus")) ]
+    results = process_diff_chunk(chunk, str(folder))
+
+    assert [ result["status"] for result in results ] == [ "built", "built" ]
+    assert len(reads) == 1
@@ -0,0 +1,41 @@
+import pytest
+import torch
+
+from bsrating.network.nn import RatingPredictorNN
+from bsrating.network.service import load_model
+from bsrating.network.tokenizer import TOKEN_DIM
+
+def small_model(**kwargs) -> RatingPredictorNN:
+    return RatingPredictorNN(TOKEN_DIM, model_dim=32, heads=2, attn_layers=1, **kwargs)
+
+@pytest.mark.parametrize("trained, loaded", [
+    ({ "positional" : "index" }, { "positional" : "time" }),
+    ({ "positional" : "time" }, { "positional" : "index" }),
+    ({ "notes_per_token" : 3 }, { "notes_per_token" : 4 }),
+])
+def test_config_mismatch(trained, loaded):
+    state = small_model(**trained).state_dict()
+    with pytest.raises(RuntimeError, match="were trained with"):
+        small_model(**loaded).load_state_dict(state)
+
+def test_legacy_index_table():
+    # models saved before the configuration stored a table of index positions
+    state = small_model(positional="index").state_dict()
+    del state["config"]
+    state["pos_encoder.pe"] = torch.zeros(5000, 1, 32)
+
+    small_model(positional="index").load_state_dict(state)
+    with pytest.raises(RuntimeError, match="positional='index'"):
+        small_model(positional="time").load_state_dict(state)
+
+def test_load_model_reads_config(tmp_path):
+    trained = RatingPredictorNN(TOKEN_DIM, model_dim=32, heads=4, attn_layers=2, notes_per_token=3, positional="index")
+    path = str(tmp_path / "model.pt2")
+    torch.save(trained.state_dict(), path)
+
+    model = load_model(path, model_dim=32)
+    assert (model.notes_per_token, model.positional) == (3, "index")
+
+    # the configuration can still be given, but it has to match
+    with pytest.raises(RuntimeError, match="were trained with"):
+        load_model(path, model_dim=32, positional="time")
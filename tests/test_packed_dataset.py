@@ -0,0 +1,26 @@
+import numpy as np
+
+from bsrating.network.packed_dataset import PackedDatasetWriter, PackedMapDataset
+from bsrating.network.tokenizer import TOKEN_DIM
+
+def test_empty_dataset(tmp_path):
+    with PackedDatasetWriter(str(tmp_path)):
+        pass
+
+    assert len(PackedMapDataset(str(tmp_path))) == 0
+
+def test_empty_maps(tmp_path):
+    tokens = np.arange(3 * TOKEN_DIM, dtype=np.float32).reshape(3, TOKEN_DIM)
+
+    # the first shard only has empty maps
+    with PackedDatasetWriter(str(tmp_path), shard_bytes=1) as writer:
+        writer.add("empty", np.empty((0, TOKEN_DIM)), np.empty(0), 1.0)
+        writer.add("map", tokens, np.array([0, 1, 3]), 2.0)
+        writer.add("empty2", np.empty((0, TOKEN_DIM)), np.empty(0), 3.0)
+
+    dataset = PackedMapDataset(str(tmp_path))
+    assert len(dataset) == 3
+    assert [ len(dataset[i][0]) for i in range(3) ] == [0, 3, 0]
+    assert np.array_equal(dataset[1][0].numpy(), tokens)
+    assert dataset[1][1].tolist() == [0, 1, 3]
+    assert dataset[2][2].item() == 3.0
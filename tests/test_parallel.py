@@ -0,0 +1,37 @@
+import pytest
+
+from bsrating.utils.parallel import process_chunks
+
+def square_chunk(chunk : list, offset : int) -> list:
+    if 13 in chunk:
+        raise ValueError("unlucky chunk")
+    return [ x * x + offset for x in chunk ]
+
+class Progress:
+    def __init__(self):
+        self.n = 0
+
+    def update(self, n : int):
+        self.n += n
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_process_chunks(workers):
+    progress = Progress()
+    results = process_chunks(square_chunk, list(range(10)), 1, workers=workers, chunk_size=3, progress=progress)
+
+    assert sorted(results) == [ x * x + 1 for x in range(10) ]
+    assert progress.n == 10
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_failed_chunk(workers):
+    items = list(range(20))
+    with pytest.raises(ValueError):
+        process_chunks(square_chunk, items, 0, workers=workers, chunk_size=4)
+
+    # the failed chunk (12 to 15) gets its results from on_error, the others are still collected
+    results = process_chunks(square_chunk, items, 0, workers=workers, chunk_size=4,
+                             on_error=lambda chunk, error, tb : [ (x, error) for x in chunk ])
+    failed = sorted(r for r in results if isinstance(r, tuple))
+    assert [ x for x, _ in failed ] == [ 12, 13, 14, 15 ]
+    assert "unlucky chunk" in failed[0][1]
+    assert len(results) == 20
@@ -0,0 +1,27 @@
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from rating_service import serve_lines
+
+class SlowService:
+    """Answers every request after a random delay, so that they finish out of order."""
+
+    def handle(self, request : dict) -> dict:
+        time.sleep(random.uniform(0.0, 0.005))
+        return { "id" : request["id"] }
+
+def test_serve_lines_waits_for_every_request():
+    responses = []
+    lines = [ json.dumps({ "id" : i }) + "\n" for i in range(200) ] + [ "\n", "not json\n" ]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        serve_lines(SlowService(), iter(lines), responses.append, pool)
+
+        # every response is written by the time serve_lines returns
+        assert len(responses) == 201
+
+    ids = [ json.loads(r)["id"] for r in responses ]
+    assert sorted(i for i in ids if i is not None) == list(range(200))
+    assert ids.count(None) == 1
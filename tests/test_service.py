@@ -0,0 +1,68 @@
+import json
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import torch
+
+from bsrating.network.nn import RatingPredictorNN
+from bsrating.network.service import DynamicBatcher, RatingService, load_request_maps
+from bsrating.network.tokenizer import TOKEN_DIM
+
+def notes(count : int) -> list:
+    return [ { "_time" : 0.5 * i, "_lineIndex" : i % 4, "_lineLayer" : i % 3, "_type" : i % 2, "_cutDirection" : i % 9 }
+             for i in range(count) ]
+
+@pytest.fixture
+def map_folder(tmp_path) -> str:
+    """A map with a Hard difficulty with notes, and a lightshow-only Expert difficulty."""
+
+    difficulties = { "Hard" : notes(20), "Expert" : [] }
+    info = {
+        "_version" : "2.0.0", "_songName" : "Test", "_beatsPerMinute" : 120.0,
+        "_difficultyBeatmapSets" : [{
+            "_beatmapCharacteristicName" : "Standard",
+            "_difficultyBeatmaps" : [
+                { "_difficulty" : diff, "_difficultyRank" : rank, "_beatmapFilename" : f"{diff}Standard.dat",
+                  "_noteJumpMovementSpeed" : 16, "_noteJumpStartBeatOffset" : 0 }
+                for rank, diff in enumerate(difficulties)
+            ]
+        }]
+    }
+    with open(tmp_path / "Info.dat", "w") as fp:
+        json.dump(info, fp)
+    for diff, diff_notes in difficulties.items():
+        with open(tmp_path / f"{diff}Standard.dat", "w") as fp:
+            json.dump({ "_version" : "2.5.0", "_notes" : diff_notes, "_obstacles" : [], "_events" : [{ "_time" : 1.0, "_type" : 1, "_value" : 1 }] }, fp)
+
+    return str(tmp_path)
+
+@pytest.fixture
+def service():
+    torch.manual_seed(0)
+    model = RatingPredictorNN(TOKEN_DIM, model_dim=32, heads=2, attn_layers=1).eval()
+    batcher = DynamicBatcher(model, max_wait=0.001)
+    yield RatingService(batcher)
+    batcher.close()
+
+def test_empty_maps(service, map_folder):
+    # the lightshow difficulty of a folder is skipped
+    assert list(load_request_maps({ "map_folder" : map_folder })) == [ "Hard" ]
+    response = service.handle({ "id" : 1, "map_folder" : map_folder })
+    assert list(response["ratings"]) == [ "Hard" ] and np.isfinite(response["ratings"]["Hard"])
+
+    # a single empty map is an error, whatever it is batched with
+    response = service.handle({ "id" : 2, "data" : [] })
+    assert response["id"] == 2 and "no elements" in response["error"]
+
+    with pytest.raises(ValueError):
+        service.batcher.submit(np.empty((0, TOKEN_DIM), np.float32), np.empty(0, np.int64))
+
+def test_split_counts_transformer_tokens():
+    model = RatingPredictorNN(TOKEN_DIM, model_dim=32, heads=2, attn_layers=1, notes_per_token=4).eval()
+    batcher = DynamicBatcher(model, max_batch_size=16, max_tokens=20)
+    batcher.close()
+
+    # 40 elements are 10 tokens, so two of these maps fit in a batch of 20 tokens
+    pending = [ SimpleNamespace(tokens=np.zeros((length, TOKEN_DIM))) for length in (37, 40, 40) ]
+    assert [ len(batch) for batch in batcher._split(pending) ] == [ 2, 1 ]
@@ -7,34 +7,87 @@ from pprint import pprint
 from tqdm import tqdm, trange
 from bsrating.leveldata import *
 from bsrating.network.map_dataset import MapDataset, collate_fn
+from bsrating.network.packed_dataset import PackedMapDataset
+from bsrating.network.sample_cache import SharedSampleCache
+from bsrating.network.sampler import LengthBucketSampler, SkipBatchSampler
+from bsrating.network.checkpoint import CheckpointManager, rng_state, set_rng_state
 from bsrating.network.nn import RatingPredictorNN
 from bsrating.utils import *
 
 from dotenv import load_dotenv
 
 import traceback
+import random
 
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import DataLoader
+from torch.utils.data import BatchSampler, DataLoader, RandomSampler, SequentialSampler
+
+def seed_worker(worker_id : int):
+    # every worker gets its own torch seed, derive the numpy and python seeds from it
+    worker_seed = torch.initial_seed() % 2 ** 32
+    np.random.seed(worker_seed)
+    random.seed(worker_seed)
 
 def main(args):
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     # device = torch.device("cpu")
     print("Using device:", device)
 
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+    random.seed(args.seed)
+
     # 1. load dataset
-    filepaths = [ os.path.join(args.dataset, fname) for fname in os.listdir(args.dataset) ]
-    dataset = MapDataset(filepaths)
-    dataloader = DataLoader(dataset, batch_size=2, collate_fn=collate_fn)
+    if args.packed:
+        dataset = PackedMapDataset(args.dataset)
+    else:
+        filepaths = [ os.path.join(args.dataset, fname) for fname in os.listdir(args.dataset) if fname.endswith(".json") ]
+
+        # keep the tokenized maps in memory after the first epoch
+        cache = SharedSampleCache(len(filepaths), args.cache_mb << 20) if args.cache_mb > 0 else None
+        dataset = MapDataset(filepaths, cache=cache)
+
+    pin_memory = args.pin_memory and device.type == "cuda"
+    loader_args = {
+        "collate_fn" :  collate_fn,
+        "num_workers" : args.workers,
+        "pin_memory" :  pin_memory
+    }
+    if args.workers > 0:
+        loader_args["prefetch_factor"] = args.prefetch
+        loader_args["persistent_workers"] = args.persistent_workers
+        loader_args["worker_init_fn"] = seed_worker
+
+    # the shuffling generator is saved in the checkpoints, so that a resumed epoch sees the same order
+    generator = torch.Generator().manual_seed(args.seed)
+    sampler = None
+    if args.max_tokens is not None:
+        # batches of maps with similar lengths, up to a budget of padded tokens; the budget counts the
+        # transformer tokens, so with grouped elements a map is ceil(elements / notes_per_token) tokens long
+        lengths = -(-np.asarray(dataset.lengths()) // args.notes_per_token)
+        sampler = LengthBucketSampler(lengths, max_tokens=args.max_tokens, bucket_ratio=args.bucket_ratio,
+                                      shuffle=not args.no_shuffle, seed=args.seed)
+        print(f"{len(sampler)} batches of up to {args.max_tokens} tokens, padding efficiency: {sampler.efficiency():.1%}")
+        batch_sampler = SkipBatchSampler(sampler)
+    else:
+        index_sampler = SequentialSampler(dataset) if args.no_shuffle else RandomSampler(dataset, generator=generator)
+        batch_sampler = SkipBatchSampler(BatchSampler(index_sampler, args.batch_size, drop_last=False))
+
+    # the loader gets its own generator for the worker seeds, so that it doesn't consume the global RNG
+    dataloader = DataLoader(dataset, batch_sampler=batch_sampler, 
+                            generator=torch.Generator().manual_seed(args.seed + 1), **loader_args)
 
     # 2. train network
     model = RatingPredictorNN(
         token_dim=10,
         model_dim=512,
         heads=4,
-        attn_layers=2)
+        attn_layers=2,
+        notes_per_token=args.notes_per_token,
+        positional=args.positional)
     
     model.to(device)
     criterion = nn.MSELoss()  # Or GaussianNLLLoss if predicting variance too
@@ -42,32 +95,110 @@ def main(args):
 
     losses = []
     epochs = 50
-    for epoch in (pbar := tqdm(range(epochs), position=0, desc="Epochs")):
+    start_epoch, batches_done, global_step, epoch_loss = 0, 0, 0, 0.0
+
+    checkpoints = CheckpointManager(args.checkpoint_dir, args.keep_checkpoints)
+    if args.resume is not None:
+        checkpoint = checkpoints.load(None if args.resume == "latest" else args.resume, map_location=device)
+        if checkpoint is None:
+            print(f"No checkpoint found in {args.checkpoint_dir}, starting from scratch.")
+        else:
+            model.load_state_dict(checkpoint["model"])
+            optimizer.load_state_dict(checkpoint["optimizer"])
+            generator.set_state(checkpoint["generator"])
+            set_rng_state(checkpoint["rng"])
+            losses = checkpoint["losses"]
+            start_epoch = checkpoint["epoch"]
+            batches_done = checkpoint["batches_done"]
+            global_step = checkpoint["global_step"]
+            epoch_loss = checkpoint["epoch_loss"]
+            print(f"Resuming from epoch {start_epoch}, batch {batches_done} (step {global_step})")
+
+    def save_checkpoint(epoch, batches_done, epoch_generator_state):
+        checkpoints.save({
+            "model" :           model.state_dict(),
+            "optimizer" :       optimizer.state_dict(),
+            "generator" :       epoch_generator_state,
+            "rng" :             rng_state(),
+            "losses" :          losses,
+            "epoch" :           epoch,
+            "batches_done" :    batches_done,
+            "global_step" :     global_step,
+            "epoch_loss" :      epoch_loss,
+            "args" :            vars(args)
+        }, global_step)
+
+    for epoch in (pbar := tqdm(range(start_epoch, epochs), position=0, desc="Epochs", initial=start_epoch, total=epochs)):
         
-        epoch_loss = 0.0
+        real_tokens, padded_tokens = 0, 0
+        data_time, compute_time = 0.0, 0.0
         model.train()
+        if sampler is not None:
+            sampler.set_epoch(epoch)
+
+        # the order of this epoch depends on the generator state before it starts
+        epoch_generator_state = generator.get_state()
+
+        # when resuming in the middle of an epoch, skip the batches that were already trained on
+        batch_sampler.skip = batches_done
+        if batches_done == 0:
+            epoch_loss = 0.0
 
         # take batches from the dataloader and train
-        for _, batch in enumerate(tqdm(dataloader, position=1, leave=False, desc="Batch")):
+        data_start = time.perf_counter()
+        for batch_idx, batch in enumerate(tqdm(dataloader, position=1, leave=False, desc="Batch", 
+                                               initial=batches_done, total=len(dataloader)), start=batches_done):
+            compute_start = time.perf_counter()
+            data_time += compute_start - data_start
+
             # pass batch to device
             tokens, type_id, rating, padding_mask = batch
-            tokens = tokens.to(device)
-            type_id = type_id.to(device)
-            rating = rating.to(device)
-            padding_mask = padding_mask.to(device)
+            tokens = tokens.to(device, non_blocking=pin_memory)
+            type_id = type_id.to(device, non_blocking=pin_memory)
+            rating = rating.to(device, non_blocking=pin_memory)
+            padding_mask = padding_mask.to(device, non_blocking=pin_memory)
+
+            # counted in transformer tokens (groups of elements), like the budget of the sampler
+            lengths = (~padding_mask).sum(dim=1)
+            real_tokens += int((-(-lengths // args.notes_per_token)).sum())
+            padded_tokens += padding_mask.size(0) * -(-padding_mask.size(1) // args.notes_per_token)
             
             optimizer.zero_grad()
-            mu = model(tokens, type_id, padding_mask)
+            with torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=args.bf16):
+                mu = model(tokens, type_id, padding_mask)
 
             loss = criterion(mu, rating)
 
             loss.backward()
             optimizer.step()
 
+            # item() waits for the device, so the compute time is accurate
             epoch_loss += loss.item()
+            global_step += 1
+
+            if args.checkpoint_steps > 0 and global_step % args.checkpoint_steps == 0:
+                save_checkpoint(epoch, batch_idx + 1, epoch_generator_state)
+
+            data_start = time.perf_counter()
+            compute_time += data_start - compute_start
 
+        batches_done = 0
         losses.append(epoch_loss / len(dataloader))
-        pbar.set_postfix({"loss": epoch_loss / len(dataloader)})
+        postfix = {
+            "loss": epoch_loss / len(dataloader), 
+            "pad_eff": real_tokens / max(padded_tokens, 1),
+            "data_s": data_time,
+            "compute_s": compute_time,
+            "data_wait": data_time / max(data_time + compute_time, 1e-9)
+        }
+        if getattr(dataset, "cache", None) is not None:
+            postfix["cache_hit"] = dataset.cache.stats()["hit_rate"]
+        pbar.set_postfix(postfix)
+
+        if args.checkpoint_epochs > 0 and (epoch + 1) % args.checkpoint_epochs == 0:
+            save_checkpoint(epoch + 1, 0, generator.get_state())
+
+    checkpoints.wait()
 
     # 3. save model
     torch.save(model.state_dict(), args.model_path)
@@ -87,5 +218,24 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Load info from maps")
 
     parser.add_argument("dataset", help="The folder containing the maps")
+    parser.add_argument("--positional", choices=["time", "index"], default="time", help="Encode the position of the tokens from their time or their index")
+    parser.add_argument("--notes_per_token", type=int, default=1, help="The number of consecutive elements packed into each transformer token")
     parser.add_argument("--model_path", help="The path to the trained model parameters", default="model.pt2")
+    parser.add_argument("--packed", action="store_true", help="The dataset folder contains a packed dataset (see load_maps.py --pack)")
+    parser.add_argument("--checkpoint_dir", default="checkpoints", help="The folder where the training checkpoints are saved")
+    parser.add_argument("--checkpoint_epochs", type=int, default=1, help="Save a checkpoint every this many epochs (0 disables it)")
+    parser.add_argument("--checkpoint_steps", type=int, default=0, help="Also save a checkpoint every this many batches (0 disables it)")
+    parser.add_argument("--keep_checkpoints", type=int, default=3, help="The number of checkpoints to keep (0 keeps all of them)")
+    parser.add_argument("--resume", nargs="?", const="latest", help="Resume training from a checkpoint (by default, the latest one in --checkpoint_dir)")
+    parser.add_argument("--bf16", action="store_true", help="Mixed precision: run the transformer in bfloat16 (autocast), and the pooling and output head in float32")
+    parser.add_argument("--batch_size", type=int, default=2, help="The number of maps per batch (ignored with --max_tokens)")
+    parser.add_argument("--workers", type=int, default=0, help="The number of DataLoader worker processes (0 loads the data in the main process)")
+    parser.add_argument("--prefetch", type=int, default=2, help="The number of batches prefetched by each worker")
+    parser.add_argument("--persistent_workers", action="store_true", help="Keep the workers alive between epochs")
+    parser.add_argument("--no_shuffle", action="store_true", help="Don't shuffle the maps every epoch")
+    parser.add_argument("--seed", type=int, default=0, help="The seed of the model initialization and the shuffling")
+    parser.add_argument("--pin_memory", action="store_true", help="Use pinned memory for faster host to GPU copies")
+    parser.add_argument("--cache_mb", type=int, default=0, help="Memory budget of the shared cache of tokenized maps, in MiB (0 disables it). Not used with --packed")
+    parser.add_argument("--max_tokens", type=int, help="Group maps of similar length into batches of up to this many transformer tokens (including padding, each token packs --notes_per_token elements), instead of fixed-size batches")
+    parser.add_argument("--bucket_ratio", type=float, default=1.25, help="Ratio between the longest and shortest maps of a length bucket, with --max_tokens")
     main(parser.parse_args())
\ No newline at end of file